@@ -0,0 +1,277 @@
+"""
+MCP 工具的调用指标，以 Prometheus 文本格式在 /metrics 上提供。
+
+- instrument() 包装 FastMCP 的工具调用入口，所有工具（按需加载的、热重载后的、server.py 中直接注册的）都经过这里：
+  按工具统计调用次数、错误次数（抛出异常，或按本仓库的约定返回 {"status": "error"}）、耗时直方图、
+  最近 METRICS_QUANTILE_WINDOW 次调用的 p50/p95/p99、请求参数和响应内容的字节数、正在执行的调用数及其峰值。
+- 工具调用期间 current_tool 上下文变量记录工具名，asyncio 任务和 asyncio.to_thread / 复制了上下文的线程池任务都能读到。
+  MySQL、RAGFlow、Tavily、LLM 等上游的访问通过 observe_upstream() 记录耗时和错误，按 (上游, 工具) 汇总，
+  可以看出一个工具的耗时花在哪个上游上。
+- 每次调用只做几次计时、字典查找和二分查找，请求大小按参数中字符串的长度估算，不做序列化；
+  分位数只在抓取 /metrics 时计算。
+"""
+import bisect
+import contextvars
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Sequence, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+METRICS_QUANTILE_WINDOW = int(os.getenv("METRICS_QUANTILE_WINDOW", 1024))   # 计算 p50/p95/p99 使用的最近调用数
+
+_DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+_BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+_QUANTILES = (0.5, 0.95, 0.99)
+
+current_tool: contextvars.ContextVar[str] = contextvars.ContextVar("current_tool", default="-")
+
+_lock = threading.Lock()
+
+
+class _Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def copy(self) -> "_Histogram":
+        copy = _Histogram(self.buckets)
+        copy.counts = list(self.counts)
+        copy.sum = self.sum
+        copy.count = self.count
+        return copy
+
+
+class _ToolStats:
+    __slots__ = ("calls", "errors", "in_flight", "in_flight_max", "duration", "request_bytes", "response_bytes",
+                 "recent")
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.in_flight_max = 0
+        self.duration = _Histogram(_DURATION_BUCKETS)
+        self.request_bytes = _Histogram(_BYTES_BUCKETS)
+        self.response_bytes = _Histogram(_BYTES_BUCKETS)
+        self.recent: deque = deque(maxlen=METRICS_QUANTILE_WINDOW)
+
+
+class _UpstreamStats:
+    __slots__ = ("requests", "errors", "duration")
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.duration = _Histogram(_DURATION_BUCKETS)
+
+
+_tools: Dict[str, _ToolStats] = {}
+_upstreams: Dict[Tuple[str, str], _UpstreamStats] = {}
+
+
+def _payload_size(value: Any) -> int:
+    """估算参数序列化后的字节数：字符串按长度计（非 ASCII 按 UTF-8 编码长度），不实际序列化。"""
+    if isinstance(value, str):
+        return len(value) if value.isascii() else len(value.encode("utf-8"))
+    if isinstance(value, dict):
+        return sum(len(k) + _payload_size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sum(_payload_size(v) for v in value)
+    return 8
+
+
+def _result_size(result: Any) -> int:
+    """响应内容块的字节数。结构化结果与文本内容重复，不另外计算。"""
+    content = result[0] if isinstance(result, tuple) else result
+    size = 0
+    for block in content or ():
+        text = getattr(block, "text", None)
+        if text is None:
+            text = getattr(block, "data", None) or ""
+        size += len(text) if text.isascii() else len(text.encode("utf-8"))
+    return size
+
+
+def _is_error_result(result: Any) -> bool:
+    if not isinstance(result, tuple) or not isinstance(result[1], dict):
+        return False
+    payload = result[1].get("result", result[1])
+    return isinstance(payload, dict) and payload.get("status") == "error"
+
+
+def instrument(tool_manager):
+    """包装 ToolManager.call_tool，记录每次工具调用的指标。未注册的工具名不记录，避免指标的标签无限增长。"""
+    if not METRICS_ENABLED:
+        return
+    call_tool = tool_manager.call_tool
+
+    async def instrumented_call_tool(name: str, arguments: Dict[str, Any], *args, **kwargs):
+        if tool_manager.get_tool(name) is None:
+            return await call_tool(name, arguments, *args, **kwargs)
+        with _lock:
+            stats = _tools.get(name)
+            if stats is None:
+                stats = _tools[name] = _ToolStats()
+            stats.calls += 1
+            stats.in_flight += 1
+            stats.in_flight_max = max(stats.in_flight_max, stats.in_flight)
+        token = current_tool.set(name)
+        started = time.perf_counter()
+        error = True
+        response_size = 0
+        try:
+            result = await call_tool(name, arguments, *args, **kwargs)
+            error = _is_error_result(result)
+            response_size = _result_size(result)
+            return result
+        finally:
+            elapsed = time.perf_counter() - started
+            current_tool.reset(token)
+            request_size = _payload_size(arguments)
+            with _lock:
+                stats.in_flight -= 1
+                stats.errors += error
+                stats.duration.observe(elapsed)
+                stats.recent.append(elapsed)
+                stats.request_bytes.observe(request_size)
+                stats.response_bytes.observe(response_size)
+
+    tool_manager.call_tool = instrumented_call_tool
+
+
+def observe_upstream(upstream: str, seconds: float, error: bool = False):
+    """记录一次上游访问（mysql、ragflow、tavily、llm 等），归到当前正在执行的工具名下。"""
+    if not METRICS_ENABLED:
+        return
+    key = (upstream, current_tool.get())
+    with _lock:
+        stats = _upstreams.get(key)
+        if stats is None:
+            stats = _upstreams[key] = _UpstreamStats()
+        stats.requests += 1
+        stats.errors += error
+        stats.duration.observe(seconds)
+
+
+@contextmanager
+def time_upstream(upstream: str) -> Iterator[None]:
+    started = time.perf_counter()
+    error = True
+    try:
+        yield
+        error = False
+    finally:
+        observe_upstream(upstream, time.perf_counter() - started, error)
+
+
+def httpx_event_hooks(upstream: str, asynchronous: bool = False) -> Dict[str, list]:
+    """返回记录上游耗时（从发出请求到收到响应头）的 httpx 事件钩子，asynchronous 对应 httpx.AsyncClient。"""
+    def on_request(request):
+        request.extensions["metrics_started"] = time.perf_counter()
+
+    def on_response(response):
+        started = response.request.extensions.get("metrics_started")
+        if started is not None:
+            observe_upstream(upstream, time.perf_counter() - started, response.status_code >= 400)
+
+    if not asynchronous:
+        return {"request": [on_request], "response": [on_response]}
+
+    async def on_request_async(request):
+        on_request(request)
+
+    async def on_response_async(response):
+        on_response(response)
+
+    return {"request": [on_request_async], "response": [on_response_async]}
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(**labels: str) -> str:
+    return ",".join(f'{k}="{_escape(str(v))}"' for k, v in labels.items())
+
+
+def _format(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _histogram_lines(name: str, labels: str, histogram: _Histogram) -> List[str]:
+    lines = []
+    cumulative = 0
+    for bound, count in zip(histogram.buckets, histogram.counts):
+        cumulative += count
+        lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+    lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {histogram.count}')
+    lines.append(f"{name}_sum{{{labels}}} {_format(histogram.sum)}")
+    lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+    return lines
+
+
+def _quantiles(values: List[float]) -> List[Tuple[float, float]]:
+    values = sorted(values)
+    return [(q, values[min(int(q * len(values)), len(values) - 1)]) for q in _QUANTILES] if values else []
+
+
+def render() -> str:
+    """返回 Prometheus 文本格式（0.0.4）的全部指标。"""
+    with _lock:
+        tools = {name: (stats.calls, stats.errors, stats.in_flight, stats.in_flight_max, list(stats.recent),
+                        stats.duration.copy(), stats.request_bytes.copy(), stats.response_bytes.copy())
+                 for name, stats in sorted(_tools.items())}
+        upstreams = {key: (stats.requests, stats.errors, stats.duration.copy())
+                     for key, stats in sorted(_upstreams.items())}
+
+    lines: List[str] = []
+
+    def family(name: str, kind: str, help_text: str):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+
+    family("mcp_tool_calls_total", "counter", "工具调用次数。")
+    lines += [f"mcp_tool_calls_total{{{_labels(tool=n)}}} {t[0]}" for n, t in tools.items()]
+    family("mcp_tool_errors_total", "counter", "工具调用失败次数（抛出异常或返回 status=error）。")
+    lines += [f"mcp_tool_errors_total{{{_labels(tool=n)}}} {t[1]}" for n, t in tools.items()]
+    family("mcp_tool_in_flight", "gauge", "正在执行的工具调用数。")
+    lines += [f"mcp_tool_in_flight{{{_labels(tool=n)}}} {t[2]}" for n, t in tools.items()]
+    family("mcp_tool_in_flight_max", "gauge", "启动以来同时执行的工具调用数峰值。")
+    lines += [f"mcp_tool_in_flight_max{{{_labels(tool=n)}}} {t[3]}" for n, t in tools.items()]
+    family("mcp_tool_duration_seconds", "histogram", "工具调用耗时（秒）。")
+    for n, t in tools.items():
+        lines += _histogram_lines("mcp_tool_duration_seconds", _labels(tool=n), t[5])
+    family("mcp_tool_duration_quantile_seconds", "gauge", f"最近 {METRICS_QUANTILE_WINDOW} 次调用耗时的分位数（秒）。")
+    for n, t in tools.items():
+        lines += [f"mcp_tool_duration_quantile_seconds{{{_labels(tool=n, quantile=q)}}} {_format(v)}"
+                  for q, v in _quantiles(t[4])]
+    family("mcp_tool_request_bytes", "histogram", "工具调用参数的字节数（估算）。")
+    for n, t in tools.items():
+        lines += _histogram_lines("mcp_tool_request_bytes", _labels(tool=n), t[6])
+    family("mcp_tool_response_bytes", "histogram", "工具返回内容的字节数。")
+    for n, t in tools.items():
+        lines += _histogram_lines("mcp_tool_response_bytes", _labels(tool=n), t[7])
+    family("mcp_upstream_requests_total", "counter", "工具调用期间访问上游的次数。")
+    lines += [f"mcp_upstream_requests_total{{{_labels(upstream=u, tool=n)}}} {s[0]}" for (u, n), s in upstreams.items()]
+    family("mcp_upstream_errors_total", "counter", "上游访问失败次数。")
+    lines += [f"mcp_upstream_errors_total{{{_labels(upstream=u, tool=n)}}} {s[1]}" for (u, n), s in upstreams.items()]
+    family("mcp_upstream_duration_seconds", "histogram", "上游访问耗时（秒）。")
+    for (u, n), s in upstreams.items():
+        lines += _histogram_lines("mcp_upstream_duration_seconds", _labels(upstream=u, tool=n), s[2])
+    return "\n".join(lines) + "\n"
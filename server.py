@@ -1,48 +1,56 @@
-import os
-import glob
-import importlib.util
+import sys
 import time
+
+_STARTED = time.perf_counter()
+
+from typing import Dict
 from logger import logger  # 导入配置好的 logger
 
 from mcp.server.fastmcp import FastMCP
+from starlette.requests import Request
+from starlette.responses import PlainTextResponse
+
+import metrics
+from tool_loader import ToolLoader
 
 # 初始化 MCP 服务器实例
 mcp = FastMCP("Demo", port=8080, host="0.0.0.0")
+# 记录每次工具调用的次数、耗时、负载大小和并发数，由 /metrics 提供给 Prometheus
+metrics.instrument(mcp._tool_manager)
+
+# 以 python server.py 运行时本模块名为 __main__，工具模块中的 from server import mcp 应拿到这里的实例，
+# 而不是把 server.py 作为新模块再执行一遍
+sys.modules.setdefault("server", sys.modules[__name__])
 
 # 定义工具目录
-TOOLS_DIR = "tools"     
+TOOLS_DIR = "tools"
+
+tool_loader = ToolLoader(mcp, TOOLS_DIR, started=_STARTED)
 
-def load_tools_from_dir(dir_path: str):
+
+@mcp.tool()
+def get_tool_load_profile() -> Dict:
     """
-    从指定目录加载工具模块。
-    这个函数会在服务器启动时和热重载时被调用。
+    查看工具模块的加载情况：每个模块是按需加载还是启动时导入、源码扫描和导入耗时、导入时新加载的包，
+    以及工具登记、端口开放和后台预热的耗时。
     """
-    full_dir = os.path.join(os.path.dirname(__file__), dir_path)
-    if not os.path.isdir(full_dir):
-        logger.warning(f"工具目录未找到: {full_dir}")
-        return
-
-    logger.info(f"正在从以下目录加载工具: {full_dir}")
-    for path in glob.glob(os.path.join(full_dir, "*.py")):
-        name = os.path.splitext(os.path.basename(path))[0]
-        if name.startswith("_"):
-            continue  # 忽略私有文件 (例如 __init__.py)
-        try:
-            # 创建一个唯一的模块名来避免重载时的冲突
-            # 这对于 Python 的导入系统识别变化至关重要
-            module_name = f"{dir_path}.{name}.{time.time_ns()}" 
-            spec = importlib.util.spec_from_file_location(module_name, path)
-            mod = importlib.util.module_from_spec(spec)
-            spec.loader.exec_module(mod)
-            logger.success(f"成功加载工具模块: {dir_path}/{name}.py")
-        except Exception as e:
-            logger.error(f"加载 {dir_path}/{name}.py 失败: {e}")
+    return tool_loader.profile()
+
+
+@mcp.custom_route("/metrics", methods=["GET"])
+async def metrics_endpoint(request: Request) -> PlainTextResponse:
+    """Prometheus 抓取接口，与 streamable-http 传输使用同一端口。"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 
 # --- 初始加载工具 ---
 logger.info("--- 正在进行初始工具加载... ---")
-load_tools_from_dir(TOOLS_DIR)
+tool_loader.load_all()
 logger.info("--- 初始工具加载完成。 ---")
 
-# --- 运行 MCP 服务器 ---
-logger.info("--- 正在启动 MCP 服务器... ---")
-mcp.run(transport="streamable-http")
+if __name__ == "__main__":
+    # --- 运行 MCP 服务器 ---
+    logger.info("--- 正在启动 MCP 服务器... ---")
+    tool_loader.start_warmup(mcp.settings.host, mcp.settings.port)
+    tool_loader.start_watcher()
+    mcp.run(transport="streamable-http")
@@ -0,0 +1,570 @@
+"""
+工具模块的加载器：启动时只根据源码登记工具，重量级的工具模块在第一次调用时（或端口开放后在后台预热时）才真正导入。
+
+- 启动时用 ast 解析 tools/ 下每个公开模块的源码，找出顶层被 @mcp.tool() 装饰的函数，按原函数的签名、
+  返回类型和文档字符串生成一个同签名的占位函数并注册，客户端看到的工具列表和参数 schema 与直接导入时一致。
+  pandas、matplotlib、LangChain、tavily 等依赖此时都不会被导入。
+- 签名中的类型注解和默认值（如 RAGFLOW_DATASET_ID）在一个只执行轻量语句的命名空间中求值：只导入标准库和
+  已经导入的模块，只执行顶层的简单赋值，tools._x 中的常量按同样的方式递归求值。
+  求值失败、模块中除 @mcp.tool() 外还用到了 mcp 等无法静态处理的情况，该模块仍在启动时直接导入。
+- 第一次调用占位工具时在线程中导入真正的模块，再转交给真正的函数，并把占位工具换成模块注册的工具。
+  同一时间只导入一个模块，已导入的模块不会重复导入。
+- 模块导入时 @mcp.tool() 注册的工具先由加载器收集，包装上正在执行的调用计数后再统一上线；
+  上线和下线都通过整体替换 FastMCP 的工具字典完成，请求不会看到一个模块只替换了一半的工具。
+- TOOLS_HOT_RELOAD=true 时后台线程每 TOOLS_RELOAD_INTERVAL 秒检查一次工具目录：只读取修改时间或大小变化的文件，
+  内容哈希变化的模块导入新版本（失败时保留旧版本）后替换其工具；新增的文件加载，删除的文件下线。
+  旧版本在后台等待正在执行的调用结束（最多 TOOLS_RELOAD_DRAIN_TIMEOUT 秒），调用模块中可选的 _unload()
+  （同步或异步，用于关闭模块自己持有的客户端），然后释放对旧模块的全部引用。连接池等共享资源在 tools/_x.py 中，
+  不随工具模块重载；这些辅助模块修改后需要重启服务。
+- TOOLS_WARMUP=true 时，服务端口开放后由后台线程依次导入剩余模块，启动不再等待重量级依赖。
+- 每个模块的登记方式、扫描耗时、导入耗时和导入时新加载的顶层包记录在 profile() 中，启动时输出到日志。
+"""
+import ast
+import asyncio
+import builtins
+import functools
+import glob
+import hashlib
+import importlib
+import importlib.util
+import inspect
+import os
+import socket
+import sys
+import threading
+import time
+import weakref
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from mcp.server.fastmcp.tools import Tool
+
+from logger import logger
+
+load_dotenv()
+
+TOOLS_LAZY_LOAD = os.getenv("TOOLS_LAZY_LOAD", "true").lower() in ("1", "true", "yes")
+TOOLS_WARMUP = os.getenv("TOOLS_WARMUP", "true").lower() in ("1", "true", "yes")
+TOOLS_WARMUP_TIMEOUT = float(os.getenv("TOOLS_WARMUP_TIMEOUT", 60))   # 等待服务端口开放的最长秒数，超时后仍开始预热
+TOOLS_HOT_RELOAD = os.getenv("TOOLS_HOT_RELOAD", "false").lower() in ("1", "true", "yes")
+TOOLS_RELOAD_INTERVAL = float(os.getenv("TOOLS_RELOAD_INTERVAL", 1))             # 检查工具文件变化的间隔秒数
+TOOLS_RELOAD_DRAIN_TIMEOUT = float(os.getenv("TOOLS_RELOAD_DRAIN_TIMEOUT", 30))  # 等待旧版本上的调用结束的最长秒数
+
+_TOOL_KWARGS = ("name", "title", "description", "annotations", "icons", "meta", "structured_output")
+_import_lock = threading.Lock()
+
+
+class _NotLazy(Exception):
+    """模块无法只凭源码登记工具，需要在启动时直接导入。"""
+
+
+def _is_tool_decorator(node: ast.expr) -> bool:
+    func = node.func if isinstance(node, ast.Call) else node
+    return (isinstance(func, ast.Attribute) and func.attr == "tool"
+            and isinstance(func.value, ast.Name) and func.value.id == "mcp")
+
+
+def _is_light_module(name: str) -> bool:
+    return name.split(".")[0] in sys.stdlib_module_names or name in sys.modules
+
+
+def _static_namespace(path: str, cache: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    """只执行模块中的轻量导入和顶层简单赋值，得到可以用来求值类型注解和默认值的命名空间。"""
+    if path in cache:
+        return cache[path]
+    namespace: Dict[str, Any] = {"__builtins__": builtins}
+    cache[path] = namespace
+    with open(path, encoding="utf-8") as f:
+        tree = ast.parse(f.read(), path)
+    tools_dir = os.path.dirname(path)
+    for node in tree.body:
+        try:
+            if isinstance(node, ast.Import):
+                for alias in node.names:
+                    if _is_light_module(alias.name):
+                        module = importlib.import_module(alias.name)
+                        if alias.asname:
+                            namespace[alias.asname] = module
+                        else:
+                            namespace[alias.name.split(".")[0]] = sys.modules[alias.name.split(".")[0]]
+            elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+                if node.module.startswith("tools._"):
+                    source = _static_namespace(os.path.join(tools_dir, node.module.split(".", 1)[1] + ".py"), cache)
+                elif _is_light_module(node.module):
+                    source = vars(importlib.import_module(node.module))
+                else:
+                    continue
+                for alias in node.names:
+                    if alias.name in source:
+                        namespace[alias.asname or alias.name] = source[alias.name]
+            elif isinstance(node, (ast.Assign, ast.AnnAssign)) and node.value is not None:
+                targets = node.targets if isinstance(node, ast.Assign) else [node.target]
+                if len(targets) == 1 and isinstance(targets[0], ast.Name):
+                    namespace[targets[0].id] = eval(compile(ast.Expression(node.value), path, "eval"), namespace)
+        except Exception:
+            continue  # 依赖重量级模块或函数的语句跳过，用到它们的签名会在生成占位函数时失败
+    return namespace
+
+
+def _make_stub(node: ast.AST, namespace: Dict[str, Any], path: str) -> Callable:
+    """生成与工具函数签名、返回类型和文档字符串相同、函数体为空的占位函数。"""
+    body: List[ast.stmt] = []
+    if ast.get_docstring(node, clean=False) is not None:
+        body.append(node.body[0])
+    body.append(ast.Pass())
+    stub = type(node)(name=node.name, args=node.args, body=body, decorator_list=[], returns=node.returns,
+                      type_comment=None, **({"type_params": []} if sys.version_info >= (3, 12) else {}))
+    module = ast.fix_missing_locations(ast.Module(body=[ast.copy_location(stub, node)], type_ignores=[]))
+    scope = dict(namespace)
+    try:
+        exec(compile(module, path, "exec"), scope)
+    except Exception as e:
+        raise _NotLazy(f"{node.name} 的签名无法静态求值: {e!r}")
+    return scope[node.name]
+
+
+def _scan(path: str) -> List[Dict[str, Any]]:
+    """返回模块中工具的登记信息：[{"func": 函数名, "stub": 占位函数, "kwargs": mcp.tool() 的参数}]。"""
+    with open(path, encoding="utf-8") as f:
+        tree = ast.parse(f.read(), path)
+    namespace = _static_namespace(path, {})
+    specs = []
+    for node in tree.body:
+        if not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            continue
+        positions = [i for i, d in enumerate(node.decorator_list) if _is_tool_decorator(d)]
+        if not positions:
+            continue
+        if positions != [0]:
+            raise _NotLazy(f"{node.name} 的 @mcp.tool() 不是最外层的装饰器")
+        decorator = node.decorator_list[0]
+        kwargs = {}
+        if isinstance(decorator, ast.Call):
+            if decorator.args or any(k.arg not in _TOOL_KWARGS for k in decorator.keywords):
+                raise _NotLazy(f"{node.name} 的 @mcp.tool() 参数无法静态处理")
+            try:
+                kwargs = {k.arg: eval(compile(ast.Expression(k.value), path, "eval"), namespace)
+                          for k in decorator.keywords}
+            except Exception as e:
+                raise _NotLazy(f"{node.name} 的 @mcp.tool() 参数无法静态求值: {e!r}")
+        specs.append({"func": node.name, "stub": _make_stub(node, namespace, path), "kwargs": kwargs})
+    uses = sum(isinstance(n, ast.Name) and n.id == "mcp" for n in ast.walk(tree))
+    if uses != len(specs):
+        raise _NotLazy("模块中除 @mcp.tool() 外还用到了 mcp")
+    return specs
+
+
+class ToolModule:
+    """tools/ 下一个公开工具模块的一个版本：注册的工具、正在执行的调用数和加载记录。"""
+
+    def __init__(self, loader: "ToolLoader", path: str, source: bytes, version: int = 1):
+        self.loader = loader
+        self.dir_path = loader.dir_path
+        self.path = path
+        self.name = os.path.splitext(os.path.basename(path))[0]
+        self.digest = hashlib.sha256(source).hexdigest()
+        self.version = version
+        self.mode = "eager"
+        self.reason: Optional[str] = None
+        self.tools: Dict[str, Tool] = {}
+        self.scan_seconds: Optional[float] = None
+        self.import_seconds: Optional[float] = None
+        self.imported_by: Optional[str] = None
+        self.new_packages: List[str] = []
+        self.error: Optional[str] = None
+        self.module = None
+        self.loaded_tools: Dict[str, Tool] = {}
+        self.in_flight = 0
+        self._idle = threading.Condition()
+
+    def _enter(self):
+        with self._idle:
+            self.in_flight += 1
+
+    def _exit(self):
+        with self._idle:
+            self.in_flight -= 1
+            if self.in_flight == 0:
+                self._idle.notify_all()
+
+    def drain(self, timeout: float) -> bool:
+        """等待这个版本上正在执行的调用全部结束，超时返回 False。"""
+        with self._idle:
+            return self._idle.wait_for(lambda: self.in_flight == 0, timeout)
+
+    def _tracked(self, fn: Callable) -> Callable:
+        """包装工具函数以统计正在执行的调用数，签名、文档字符串和同步/异步属性保持不变。"""
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def wrapper(*args, **kwargs):
+                self.loader.remember_loop()
+                self._enter()
+                try:
+                    return await fn(*args, **kwargs)
+                finally:
+                    self._exit()
+        else:
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                self._enter()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    self._exit()
+        return wrapper
+
+    def placeholder(self, spec: Dict[str, Any]) -> Tool:
+        """占位工具：签名与原函数相同，第一次调用时导入模块，然后转交给模块中的同名函数。"""
+        func_name = spec["func"]
+
+        @functools.wraps(spec["stub"])
+        async def proxy(*args, **kwargs):
+            self.loader.remember_loop()
+            self._enter()
+            try:
+                loaded = self.module
+                if loaded is None:
+                    loaded = await asyncio.to_thread(self.loader.load_lazy, self, f"首次调用 {func_name}")
+                result = getattr(loaded, func_name)(*args, **kwargs)
+                if inspect.isawaitable(result):
+                    result = await result
+                return result
+            finally:
+                self._exit()
+
+        return Tool.from_function(proxy, **spec["kwargs"])
+
+    def load(self, trigger: str = "启动时导入"):
+        """
+        导入模块（已导入时直接返回）。模块中 @mcp.tool() 注册的工具先收集到 loaded_tools，由加载器统一替换上线。
+        同一时间只导入一个模块，新加载的顶层包才能准确归到这个模块名下。
+        """
+        if self.module is not None:
+            return self.module
+        with _import_lock:
+            if self.module is not None:
+                return self.module
+            mcp = self.loader.mcp
+            captured: List[Tuple[Callable, Dict[str, Any]]] = []
+            mcp.add_tool = lambda fn, **kwargs: captured.append((fn, kwargs))
+            before = set(sys.modules)
+            started = time.perf_counter()
+            try:
+                # 创建一个唯一的模块名，同一文件的新旧版本互不影响；模块不放入 sys.modules，旧版本不再被引用后即可回收
+                module_name = f"{self.dir_path}.{self.name}.{time.time_ns()}"
+                spec = importlib.util.spec_from_file_location(module_name, self.path)
+                module = importlib.util.module_from_spec(spec)
+                spec.loader.exec_module(module)
+                tools = {}
+                for fn, kwargs in captured:
+                    tool = Tool.from_function(self._tracked(fn), **kwargs)
+                    tools[tool.name] = tool
+            except Exception as e:
+                self.error = repr(e)
+                logger.error(f"加载 {self.dir_path}/{self.name}.py 失败: {e}")
+                raise
+            finally:
+                del mcp.add_tool
+            self.import_seconds = time.perf_counter() - started
+            self.imported_by = trigger
+            self.new_packages = sorted({m.split(".")[0] for m in set(sys.modules) - before
+                                        if not m.startswith("_") and m.split(".")[0] not in sys.stdlib_module_names}
+                                       - {self.dir_path})
+            self.error = None
+            self.loaded_tools = tools
+            self.module = module
+            logger.success(f"成功加载工具模块: {self.dir_path}/{self.name}.py（{trigger}，{self.import_seconds * 1000:.1f} ms）")
+            return module
+
+    def report(self) -> Dict[str, Any]:
+        report = {"mode": self.mode, "version": self.version, "digest": self.digest[:12], "tools": list(self.tools),
+                  "loaded": self.module is not None, "in_flight": self.in_flight}
+        if self.reason:
+            report["reason"] = self.reason
+        if self.scan_seconds is not None:
+            report["scan_ms"] = round(self.scan_seconds * 1000, 2)
+        if self.import_seconds is not None:
+            report.update(import_ms=round(self.import_seconds * 1000, 1), imported_by=self.imported_by,
+                          new_packages=self.new_packages)
+        if self.error:
+            report["error"] = self.error
+        return report
+
+
+def _file_state(path: str) -> Tuple[int, int]:
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+class ToolLoader:
+    def __init__(self, mcp, dir_path: str, started: Optional[float] = None):
+        self.mcp = mcp
+        self.dir_path = dir_path
+        self.full_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), dir_path)
+        self.started = started if started is not None else time.perf_counter()
+        self.modules: Dict[str, ToolModule] = {}
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.registered_seconds: Optional[float] = None
+        self.port_open_seconds: Optional[float] = None
+        self.warmup_seconds: Optional[float] = None
+        self._swap_lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self._file_states: Dict[str, Tuple[int, int]] = {}
+        self._failed_digests: Dict[str, str] = {}
+        self._failures: Dict[str, str] = {}
+        self._retired: List[Tuple[str, int, weakref.ref]] = []
+        self._reload_stats = {"checks": 0, "reloaded": 0, "added": 0, "removed": 0, "failed": 0,
+                              "last_reload_ms": None, "drain_timeouts": 0}
+
+    def remember_loop(self):
+        if self.loop is None:
+            self.loop = asyncio.get_running_loop()
+
+    def load_all(self):
+        """登记（或导入）工具目录下的全部公开模块，并输出启动剖析报告。"""
+        if not os.path.isdir(self.full_dir):
+            logger.warning(f"工具目录未找到: {self.full_dir}")
+            return
+
+        logger.info(f"正在从以下目录加载工具: {self.full_dir}（按需加载: {TOOLS_LAZY_LOAD}）")
+        for path in self._files():
+            name = os.path.splitext(os.path.basename(path))[0]
+            self._file_states[path] = _file_state(path)
+            if name.startswith("_"):
+                continue  # 忽略私有文件 (例如 __init__.py)
+            try:
+                self._activate(path)
+            except Exception as e:
+                self._failures[name] = repr(e)
+        self.registered_seconds = time.perf_counter() - self.started
+        self._log_profile()
+
+    def _files(self) -> List[str]:
+        return sorted(glob.glob(os.path.join(self.full_dir, "*.py")))
+
+    def _prepare_lazy(self, module: ToolModule) -> bool:
+        started = time.perf_counter()
+        try:
+            specs = _scan(module.path)
+            if not specs:
+                raise _NotLazy("没有找到 @mcp.tool() 工具")
+            tools = [module.placeholder(spec) for spec in specs]
+        except _NotLazy as e:
+            module.reason = str(e)
+            return False
+        except Exception as e:
+            module.reason = f"源码解析失败: {e!r}"
+            return False
+        finally:
+            module.scan_seconds = time.perf_counter() - started
+        module.tools = {tool.name: tool for tool in tools}
+        module.mode = "lazy"
+        return True
+
+    def _activate(self, path: str, old: Optional[ToolModule] = None, trigger: str = "启动时导入") -> ToolModule:
+        """
+        准备模块的新版本并替换旧版本的工具注册。旧版本未导入过时新版本仍按需加载，否则立即导入，
+        导入失败时抛出异常，旧版本保持不变。
+        """
+        with open(path, "rb") as f:
+            source = f.read()
+        module = ToolModule(self, path, source, version=old.version + 1 if old else 1)
+        lazy = TOOLS_LAZY_LOAD and (old is None or old.module is None) and self._prepare_lazy(module)
+        if not lazy:
+            module.load(trigger)
+            module.tools = dict(module.loaded_tools)
+        with self._swap_lock:
+            self.modules[module.name] = module
+            self._swap(module, old.tools if old else {})
+        return module
+
+    def _swap(self, module: ToolModule, remove: Dict[str, Tool]):
+        """用 module.tools 替换 remove 中的工具。整体替换工具字典，正在处理的请求不会看到注册了一半的状态。需持有 _swap_lock。"""
+        tools = dict(self.mcp._tool_manager._tools)
+        for name in remove:
+            tools.pop(name, None)
+        owned = {n for m in self.modules.values() if m is not module for n in m.tools}
+        for name, tool in list(module.tools.items()):
+            if name in owned or (name in tools and name not in remove):
+                logger.warning(f"工具名重复，忽略 {module.name}.py 中的 {name}")
+                del module.tools[name]
+                continue
+            tools[name] = tool
+        self.mcp._tool_manager._tools = tools
+        # 低层服务按工具名缓存了工具定义（用于校验输出），替换后的工具下次调用时重新读取
+        cache = getattr(self.mcp._mcp_server, "_tool_cache", None)
+        if cache is not None:
+            for name in set(remove) | set(module.tools):
+                cache.pop(name, None)
+
+    def load_lazy(self, module: ToolModule, trigger: str):
+        """导入按需加载的模块，并把占位工具换成真正的工具（模块已被新版本替换时不再替换）。"""
+        loaded = module.load(trigger)
+        with self._swap_lock:
+            if self.modules.get(module.name) is module and module.tools and module.mode == "lazy":
+                placeholders = module.tools
+                module.tools = {name: tool for name, tool in module.loaded_tools.items() if name in placeholders}
+                module.mode = "lazy-loaded"
+                self._swap(module, placeholders)
+        return loaded
+
+    def start_warmup(self, host: str, port: int):
+        """服务端口开放后在后台线程中依次导入尚未导入的模块。"""
+        if not TOOLS_WARMUP or all(m.module is not None for m in self.modules.values()):
+            return
+        threading.Thread(target=self._warm_up, args=(host, port), name="tool-warmup", daemon=True).start()
+
+    def _warm_up(self, host: str, port: int):
+        if self._wait_for_port(host, port):
+            self.port_open_seconds = time.perf_counter() - self.started
+            logger.info(f"服务端口已开放（启动后 {self.port_open_seconds:.2f} 秒），开始在后台预热工具模块")
+        else:
+            logger.warning(f"{TOOLS_WARMUP_TIMEOUT} 秒内未检测到端口 {port} 开放，仍开始预热工具模块")
+        started = time.perf_counter()
+        for module in list(self.modules.values()):
+            try:
+                self.load_lazy(module, "后台预热")
+            except Exception:
+                continue
+        self.warmup_seconds = time.perf_counter() - started
+        logger.info(f"--- 工具模块预热完成，耗时 {self.warmup_seconds:.2f} 秒。 ---")
+
+    @staticmethod
+    def _wait_for_port(host: str, port: int) -> bool:
+        host = "127.0.0.1" if host in ("", "0.0.0.0") else ("::1" if host == "::" else host)
+        deadline = time.monotonic() + TOOLS_WARMUP_TIMEOUT
+        while time.monotonic() < deadline:
+            try:
+                with socket.create_connection((host, port), timeout=1):
+                    return True
+            except OSError:
+                time.sleep(0.2)
+        return False
+
+    # --- 热重载 ---
+
+    def start_watcher(self):
+        """TOOLS_HOT_RELOAD=true 时启动后台线程，每 TOOLS_RELOAD_INTERVAL 秒检查一次工具文件的变化。"""
+        if not TOOLS_HOT_RELOAD:
+            return
+        logger.info(f"已开启工具热重载，每 {TOOLS_RELOAD_INTERVAL} 秒检查一次 {self.full_dir}")
+        threading.Thread(target=self._watch, name="tool-reloader", daemon=True).start()
+
+    def _watch(self):
+        while True:
+            time.sleep(TOOLS_RELOAD_INTERVAL)
+            try:
+                self.check_for_changes()
+            except Exception as e:
+                logger.error(f"检查工具文件变化失败: {e}")
+
+    def check_for_changes(self) -> Dict[str, List[str]]:
+        """
+        重载内容有变化的工具模块、加载新增的模块、下线删除的模块。只读取修改时间或大小变化了的文件，
+        内容哈希不变时不重载，耗时只与变化的文件数有关。返回 {"reloaded", "added", "removed", "failed"}。
+        """
+        with self._reload_lock:
+            started = time.perf_counter()
+            self._reload_stats["checks"] += 1
+            result: Dict[str, List[str]] = {"reloaded": [], "added": [], "removed": [], "failed": []}
+            paths = set(self._files())
+            for path in sorted(paths):
+                state = _file_state(path)
+                if self._file_states.get(path) == state:
+                    continue
+                self._file_states[path] = state
+                name = os.path.splitext(os.path.basename(path))[0]
+                if name.startswith("_"):
+                    logger.warning(f"辅助模块 {self.dir_path}/{name}.py 已修改，需要重启服务才能生效")
+                    continue
+                with open(path, "rb") as f:
+                    digest = hashlib.sha256(f.read()).hexdigest()
+                old = self.modules.get(name)
+                if (old is not None and old.digest == digest) or self._failed_digests.get(path) == digest:
+                    continue
+                try:
+                    self._activate(path, old, trigger="热重载")
+                except Exception as e:
+                    self._failures[name] = repr(e)
+                    self._failed_digests[path] = digest
+                    self._reload_stats["failed"] += 1
+                    result["failed"].append(name)
+                    continue
+                self._failed_digests.pop(path, None)
+                self._failures.pop(name, None)
+                result["reloaded" if old else "added"].append(name)
+                if old is not None:
+                    self._retire(old)
+            for path in set(self._file_states) - paths:
+                del self._file_states[path]
+                name = os.path.splitext(os.path.basename(path))[0]
+                old = self.modules.get(name)
+                if old is None or old.path != path:
+                    continue
+                with self._swap_lock:
+                    del self.modules[name]
+                    removed, old.tools = old.tools, {}
+                    self._swap(old, removed)
+                result["removed"].append(name)
+                self._retire(old)
+            if any(result.values()):
+                for key in ("reloaded", "added", "removed"):
+                    self._reload_stats[key] += len(result[key])
+                self._reload_stats["last_reload_ms"] = round((time.perf_counter() - started) * 1000, 1)
+                logger.info(f"工具热重载完成（{self._reload_stats['last_reload_ms']} ms）: {result}")
+            return result
+
+    def _retire(self, old: ToolModule):
+        """在后台等待旧版本上正在执行的调用结束，然后调用模块的 _unload() 并释放对旧模块的引用。"""
+        threading.Thread(target=self._release, args=(old,), name=f"tool-retire-{old.name}", daemon=True).start()
+
+    def _release(self, old: ToolModule):
+        if not old.drain(TOOLS_RELOAD_DRAIN_TIMEOUT):
+            self._reload_stats["drain_timeouts"] += 1
+            logger.warning(f"{old.name}.py 第 {old.version} 版还有 {old.in_flight} 个调用在 "
+                           f"{TOOLS_RELOAD_DRAIN_TIMEOUT} 秒内未结束，仍然释放")
+        module = old.module
+        unload = getattr(module, "_unload", None) if module is not None else None
+        if unload is not None:
+            try:
+                result = unload()
+                if inspect.isawaitable(result):
+                    if self.loop is not None and self.loop.is_running():
+                        asyncio.run_coroutine_threadsafe(result, self.loop).result(TOOLS_RELOAD_DRAIN_TIMEOUT)
+                    else:
+                        asyncio.run(result)
+            except Exception as e:
+                logger.error(f"释放 {old.name}.py 第 {old.version} 版的资源失败: {e}")
+        if module is not None:
+            self._retired = [r for r in self._retired if r[2]() is not None]
+            self._retired.append((old.name, old.version, weakref.ref(module)))
+        old.module = None
+        old.tools = {}
+        old.loaded_tools = {}
+        logger.info(f"已释放 {old.name}.py 第 {old.version} 版")
+
+    def _log_profile(self):
+        logger.info(f"工具登记完成，启动后 {self.registered_seconds * 1000:.1f} ms，各模块情况：")
+        for name, module in self.modules.items():
+            if module.mode == "lazy":
+                logger.info(f"  {name}: 按需加载，{len(module.tools)} 个工具，源码扫描 {module.scan_seconds * 1000:.1f} ms")
+            else:
+                reason = f"（{module.reason}）" if module.reason else ""
+                logger.info(f"  {name}: 启动时导入{reason}，{module.import_seconds * 1000:.1f} ms，"
+                            f"新加载的包: {', '.join(module.new_packages) or '无'}")
+        for name, error in self._failures.items():
+            logger.info(f"  {name}: 加载失败: {error}")
+
+    def profile(self) -> Dict[str, Any]:
+        return {
+            "lazy_load": TOOLS_LAZY_LOAD,
+            "warmup": TOOLS_WARMUP,
+            "registered_ms": round(self.registered_seconds * 1000, 1) if self.registered_seconds is not None else None,
+            "port_open_ms": round(self.port_open_seconds * 1000, 1) if self.port_open_seconds is not None else None,
+            "warmup_ms": round(self.warmup_seconds * 1000, 1) if self.warmup_seconds is not None else None,
+            "modules": {name: module.report() for name, module in self.modules.items()},
+            "failed": dict(self._failures),
+            "hot_reload": dict(self._reload_stats, enabled=TOOLS_HOT_RELOAD,
+                               # 已释放但仍未被回收的旧模块版本，正常情况下应为空
+                               retired_alive=[f"{n} v{v}" for n, v, ref in self._retired if ref() is not None]),
+        }
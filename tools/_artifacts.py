@@ -0,0 +1,90 @@
+"""
+分析结果产物（图表等）的存储。
+
+产物按内容的 SHA-256 命名保存在 ARTIFACT_DIR 中，相同内容只保存一份。每次写入后清理
+超过 ARTIFACT_MAX_AGE 秒未被使用的文件，并按最后使用时间淘汰，使目录总大小不超过 ARTIFACT_MAX_BYTES。
+刚写入的产物不会被淘汰；单个文件就超过 ARTIFACT_MAX_BYTES 时拒绝保存并抛出 ArtifactTooLargeError。
+"""
+import hashlib
+import os
+import shutil
+import threading
+import time
+from typing import Any, Dict
+
+from dotenv import load_dotenv
+
+from logger import logger
+
+load_dotenv()
+
+ARTIFACT_DIR = os.getenv("ARTIFACT_DIR", "downloads/artifacts")
+ARTIFACT_MAX_BYTES = int(os.getenv("ARTIFACT_MAX_BYTES", 200 * 1024 * 1024))   # 产物目录总大小上限
+ARTIFACT_MAX_AGE = float(os.getenv("ARTIFACT_MAX_AGE", 7 * 24 * 3600))          # 未被使用超过该秒数的产物会被删除
+
+class ArtifactTooLargeError(ValueError):
+    """单个产物超过 ARTIFACT_MAX_BYTES，保存后会立即被淘汰，因此拒绝保存。"""
+
+
+_lock = threading.Lock()
+_stats = {"stored": 0, "deduplicated": 0, "evicted": 0}
+
+
+def _file_digest(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _evict(keep: str):
+    """调用方需持有 _lock。keep 是刚写入或刚使用的产物，不参与淘汰。"""
+    now = time.time()
+    entries = []
+    for entry in os.scandir(ARTIFACT_DIR):
+        if entry.is_file() and entry.path != keep:
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+    entries.sort()
+    total = sum(size for _, size, _ in entries) + os.path.getsize(keep)
+    for mtime, size, path in entries:
+        if now - mtime <= ARTIFACT_MAX_AGE and total <= ARTIFACT_MAX_BYTES:
+            break
+        try:
+            os.remove(path)
+            total -= size
+            _stats["evicted"] += 1
+        except OSError as e:
+            logger.warning(f"删除产物文件 {path} 失败: {e}")
+
+
+def store_file(path: str) -> str:
+    """
+    把文件存入产物目录（相同内容只保存一份），返回可在 Markdown 中引用的相对路径。
+    文件超过 ARTIFACT_MAX_BYTES 时抛出 ArtifactTooLargeError。
+    """
+    size = os.path.getsize(path)
+    if size > ARTIFACT_MAX_BYTES:
+        raise ArtifactTooLargeError(f"产物文件 {size} 字节，超过上限 ARTIFACT_MAX_BYTES={ARTIFACT_MAX_BYTES}，未保存。")
+    extension = os.path.splitext(path)[1].lower()
+    name = _file_digest(path)[:32] + extension
+    target = os.path.join(ARTIFACT_DIR, name)
+    with _lock:
+        os.makedirs(ARTIFACT_DIR, exist_ok=True)
+        if os.path.exists(target):
+            os.utime(target)  # 刷新最后使用时间
+            _stats["deduplicated"] += 1
+        else:
+            tmp_target = target + ".tmp"
+            shutil.copyfile(path, tmp_target)
+            os.replace(tmp_target, target)
+            _stats["stored"] += 1
+        _evict(target)
+    return target.replace("\\", "/")
+
+
+def artifact_stats() -> Dict[str, Any]:
+    with _lock:
+        files = [e.stat().st_size for e in os.scandir(ARTIFACT_DIR) if e.is_file()] if os.path.isdir(ARTIFACT_DIR) else []
+        return dict(_stats, files=len(files), bytes=sum(files))
@@ -0,0 +1,191 @@
+"""
+通用的进程内 LRU 缓存：按总字节数限制容量，每个条目带独立的过期时间，并统计命中/未命中。
+sliding=True 时过期时间在每次命中后顺延，即按空闲时间淘汰。
+SingleFlight / AsyncSingleFlight 用于合并并发的相同请求（线程 / 协程），只让其中一个调用真正执行。
+"""
+import asyncio
+import functools
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+
+class _Entry:
+    __slots__ = ("value", "size", "ttl", "expires_at")
+
+    def __init__(self, value, size, ttl, expires_at):
+        self.value = value
+        self.size = size
+        self.ttl = ttl
+        self.expires_at = expires_at
+
+
+class TTLCache:
+    """线程安全的 LRU + TTL 缓存，容量以调用方提供的 size（字节）计算。"""
+
+    def __init__(self, max_bytes: int, ttl: float, name: str = "cache", sliding: bool = False):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.name = name
+        self.sliding = sliding
+        self._data: "OrderedDict[Hashable, _Entry]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "sets": 0, "evictions": 0, "expirations": 0, "rejected": 0}
+
+    def _remove(self, key):
+        entry = self._data.pop(key)
+        self._bytes -= entry.size
+        return entry
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+                return default
+            if entry.expires_at <= time.monotonic():
+                self._remove(key)
+                self._stats["expirations"] += 1
+                self._stats["misses"] += 1
+                return default
+            self._data.move_to_end(key)
+            if self.sliding:
+                entry.expires_at = time.monotonic() + entry.ttl
+            self._stats["hits"] += 1
+            return entry.value
+
+    def set(self, key: Hashable, value: Any, size: int, ttl: Optional[float] = None) -> bool:
+        """写入条目；单个条目超过总容量时不缓存并返回 False。"""
+        ttl = self.ttl if ttl is None else ttl
+        if size > self.max_bytes or ttl <= 0:
+            with self._lock:
+                self._stats["rejected"] += 1
+            return False
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = _Entry(value, size, ttl, time.monotonic() + ttl)
+            self._bytes += size
+            self._stats["sets"] += 1
+            while self._bytes > self.max_bytes:
+                self._remove(next(iter(self._data)))
+                self._stats["evictions"] += 1
+        return True
+
+    def purge_expired(self) -> int:
+        """删除所有已过期的条目，返回删除数量。"""
+        now = time.monotonic()
+        with self._lock:
+            expired = [key for key, entry in self._data.items() if entry.expires_at <= now]
+            for key in expired:
+                self._remove(key)
+            self._stats["expirations"] += len(expired)
+        return len(expired)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            if key not in self._data:
+                return default
+            return self._remove(key).value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            lookups = stats["hits"] + stats["misses"]
+            stats.update({
+                "entries": len(self._data),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hit_rate": round(stats["hits"] / lookups, 4) if lookups else 0.0,
+            })
+        return stats
+
+
+class _Call:
+    __slots__ = ("done", "value", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """
+    合并并发的相同请求：同一 key 同时只执行一次 fn，其余调用方等待并共享同一个结果（或异常）。
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+        self._stats = {"calls": 0, "shared": 0}
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self._stats["calls"] += 1
+            else:
+                self._stats["shared"] += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value
+        try:
+            call.value = fn()
+            return call.value
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._stats, in_flight=len(self._calls))
+
+
+class AsyncSingleFlight:
+    """
+    SingleFlight 的协程版本：fn 在独立的任务中执行，所有调用方（包括发起者）都通过 shield 等待它。
+    某个调用方被取消只会停止它自己的等待，不会取消正在执行的调用，也不影响其他调用方。
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+        self._stats = {"calls": 0, "shared": 0}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        loop = asyncio.get_running_loop()
+        task = self._calls.get(key)
+        if task is not None and task.get_loop() is loop:
+            self._stats["shared"] += 1
+        else:
+            task = self._calls[key] = loop.create_task(fn())
+            self._stats["calls"] += 1
+            task.add_done_callback(functools.partial(self._finished, key))
+        return await asyncio.shield(task)
+
+    def _finished(self, key: Hashable, task: asyncio.Task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            task.exception()  # 所有调用方都已取消等待时避免 "exception was never retrieved" 警告
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(self._stats, in_flight=len(self._calls))
@@ -0,0 +1,168 @@
+"""
+知识库检索结果的分块处理：精简字段、去重合并并保留来源，以及按预算重排裁剪。
+
+batch_knowledge_retrieval 会对多个子问题、多个数据集分别检索，不同检索经常返回同一个分块。
+这里按分块 ID（没有 ID 时按规范化后内容的哈希）去重，合并后每个分块只出现一次，
+并记录命中它的全部 (问题, 数据集)。排序取各次检索中的最高相似度，相同时命中次数多的在前。
+
+rerank_and_pack 是可选的本地后处理：用 BM25 对分块和问题做词法打分（NumPy 向量化），与 RAGFlow 的相似度加权合并后排序，
+丢弃内容几乎相同的分块（词 shingle 的 Jaccard 相似度不低于阈值），再按字符数或估算的 token 数预算装入最相关的分块。
+"""
+import hashlib
+import os
+import re
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Tuple
+
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+RERANK_LEXICAL_WEIGHT = float(os.getenv("RERANK_LEXICAL_WEIGHT", 0.5))          # BM25 分数在排序中的权重（0~1）
+RERANK_DUPLICATE_THRESHOLD = float(os.getenv("RERANK_DUPLICATE_THRESHOLD", 0.85))  # 视为近似重复的 Jaccard 相似度
+
+_BM25_K1 = 1.5
+_BM25_B = 0.75
+_SHINGLE_SIZE = 3
+_WORD_RE = re.compile(r"[a-z0-9]+|[\u3400-\u9fff\uf900-\ufaff]+")
+_CJK_RE = re.compile(r"[\u3400-\u9fff\uf900-\ufaff]")
+
+# 缓存和返回时保留的字段，其余（向量、位置信息等）丢弃
+_FIELDS = ("id", "content", "document_id", "document_keyword", "dataset_id", "similarity")
+
+
+def slim_chunk(chunk: Dict[str, Any]) -> Dict[str, Any]:
+    slim = {k: chunk.get(k) for k in _FIELDS}
+    if slim["dataset_id"] is None:
+        slim["dataset_id"] = chunk.get("kb_id")
+    return slim
+
+
+def chunk_key(chunk: Dict[str, Any]) -> str:
+    if chunk.get("id"):
+        return str(chunk["id"])
+    content = re.sub(r"\s+", " ", chunk.get("content") or "").strip().lower()
+    return "sha1:" + hashlib.sha1(content.encode("utf-8")).hexdigest()
+
+
+def merge_chunks(results: Iterable[Tuple[str, str, List[Dict[str, Any]]]]) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    合并多次检索的分块。results 为 (问题, 数据集 ID, 分块列表) 序列。
+    返回 (按相关度排序的去重分块列表, 合并前的分块总数)。
+    """
+    merged: Dict[str, Dict[str, Any]] = {}
+    total = 0
+    for query, dataset_id, chunks in results:
+        for chunk in chunks:
+            total += 1
+            key = chunk_key(chunk)
+            similarity = float(chunk.get("similarity") or 0.0)
+            entry = merged.get(key)
+            if entry is None:
+                entry = merged[key] = {
+                    "id": chunk.get("id") or key,
+                    "content": chunk.get("content") or "",
+                    "document_id": chunk.get("document_id"),
+                    "document_name": chunk.get("document_keyword"),
+                    "dataset_id": chunk.get("dataset_id") or dataset_id,
+                    "similarity": similarity,
+                    "matched_queries": [],
+                }
+            entry["similarity"] = max(entry["similarity"], similarity)
+            if query not in entry["matched_queries"]:
+                entry["matched_queries"].append(query)
+    ranked = sorted(merged.values(), key=lambda c: (c["similarity"], len(c["matched_queries"])), reverse=True)
+    for chunk in ranked:
+        chunk["similarity"] = round(chunk["similarity"], 4)
+    return ranked, total
+
+
+def _tokens(text: str) -> List[str]:
+    """英文和数字按词切分，中文按相邻两字切分（单字词保留单字）。"""
+    tokens: List[str] = []
+    for word in _WORD_RE.findall(text.lower()):
+        if _CJK_RE.match(word):
+            if len(word) == 1:
+                tokens.append(word)
+            tokens.extend(word[i:i + 2] for i in range(len(word) - 1))
+        else:
+            tokens.append(word)
+    return tokens
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算 token 数：中文每字约 1 个 token，其余字符约 4 个一个 token。"""
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def bm25_scores(query: str, texts: List[str]) -> np.ndarray:
+    """返回每段文本相对 query 的 BM25 分数。"""
+    terms = list(dict.fromkeys(_tokens(query)))
+    if not terms or not texts:
+        return np.zeros(len(texts))
+    column = {term: i for i, term in enumerate(terms)}
+    tf = np.zeros((len(texts), len(terms)))
+    lengths = np.empty(len(texts))
+    for row, text in enumerate(texts):
+        tokens = _tokens(text)
+        lengths[row] = len(tokens)
+        for term, count in Counter(t for t in tokens if t in column).items():
+            tf[row, column[term]] = count
+    df = (tf > 0).sum(axis=0)
+    idf = np.log(1 + (len(texts) - df + 0.5) / (df + 0.5))
+    norm = _BM25_K1 * (1 - _BM25_B + _BM25_B * lengths / max(lengths.mean(), 1.0))
+    return ((tf * (_BM25_K1 + 1)) / (tf + norm[:, None]) * idf).sum(axis=1)
+
+
+def _shingles(text: str) -> set:
+    tokens = _tokens(text)
+    if len(tokens) <= _SHINGLE_SIZE:
+        return {tuple(tokens)}
+    return {tuple(tokens[i:i + _SHINGLE_SIZE]) for i in range(len(tokens) - _SHINGLE_SIZE + 1)}
+
+
+def rerank_and_pack(query: str, chunks: List[Dict[str, Any]], max_chars: int = 0,
+                    max_tokens: int = 0) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """
+    对分块重排、去掉近似重复，并按预算（max_chars 或 max_tokens，都为 0 时不限制）装入。
+    返回 (保留的分块, 统计)。装不下的分块跳过，继续尝试后面较短的分块。
+    """
+    texts = [chunk.get("content") or "" for chunk in chunks]
+    lexical = bm25_scores(query, texts)
+    if lexical.max(initial=0) > 0:
+        lexical = lexical / lexical.max()
+    similarity = np.array([float(chunk.get("similarity") or 0.0) for chunk in chunks])
+    scores = RERANK_LEXICAL_WEIGHT * lexical + (1 - RERANK_LEXICAL_WEIGHT) * similarity
+
+    kept: List[Dict[str, Any]] = []
+    kept_shingles: List[set] = []
+    duplicates = over_budget = 0
+    used = 0
+    unit = "tokens" if max_tokens > 0 else "chars"
+    budget = max_tokens if max_tokens > 0 else max_chars
+    for index in np.argsort(-scores, kind="stable"):
+        shingles = _shingles(texts[index])
+        if any(len(shingles & other) / max(len(shingles | other), 1) >= RERANK_DUPLICATE_THRESHOLD
+               for other in kept_shingles):
+            duplicates += 1
+            continue
+        cost = estimate_tokens(texts[index]) if unit == "tokens" else len(texts[index])
+        if budget > 0 and used + cost > budget:
+            over_budget += 1
+            continue
+        used += cost
+        kept_shingles.append(shingles)
+        kept.append(dict(chunks[index], score=round(float(scores[index]), 4)))
+    report = {
+        "input_chunks": len(chunks),
+        "kept": len(kept),
+        "dropped_duplicates": duplicates,
+        "dropped_over_budget": over_budget,
+        "budget": budget or None,
+        "unit": unit,
+        "used": used,
+        "input_size": sum(estimate_tokens(t) if unit == "tokens" else len(t) for t in texts),
+    }
+    return kept, report
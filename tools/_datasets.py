@@ -0,0 +1,315 @@
+"""
+数据集加载与缓存。
+
+load_csv / analyze_csv_content 把数据内容解析为 DataFrame 后，以内容哈希作为数据集句柄（ds_ 开头）
+缓存在进程内：按 DataFrame 实际占用内存限制总容量（DATASET_CACHE_MAX_BYTES），
+超过 DATASET_CACHE_IDLE_TTL 秒未被使用的数据集会被淘汰。相同内容再次传入时直接命中缓存，不会重复解析。
+
+CSV 的读取方式：
+- 输入可以是文本、bytes 或 DATASET_FILE_ROOTS 下的文件路径；文本只编码一次为 bytes，不再经过 StringIO。
+- 默认使用 pyarrow 引擎解析，失败时退回 pandas 默认引擎。
+- 输入超过 DATASET_SAMPLE_THRESHOLD_BYTES 或指定了 sample_rows 时分块流式读取，
+  只保留均匀随机抽取的行（保持原有顺序），内存占用与抽样行数成正比。
+- 解析后默认保留原始类型。浮点列降为 float32、整数列降为 int32、低基数字符串列转为 category 需分别开启
+  （DATASET_DOWNCAST_FLOATS / DATASET_DOWNCAST_INTEGERS / DATASET_STRING_CATEGORIES）：float32 上的求和、均值会损失精度，
+  int32 上的算术可能静默溢出，category 列无法直接赋入新的取值。
+读取前后的内存占用记录在 df.attrs["ingest"] 中，由 load_csv 返回。
+"""
+import hashlib
+import io
+import json
+import os
+import re
+from typing import Any, Dict, Iterator, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+
+from logger import logger
+from tools._cache import TTLCache
+from tools._result_format import ResultFormatError, decode_arrow_table, decode_table, detect_format
+
+load_dotenv()
+
+DATASET_CACHE_MAX_BYTES = int(os.getenv("DATASET_CACHE_MAX_BYTES", 512 * 1024 * 1024))  # 缓存的 DataFrame 总内存上限
+DATASET_CACHE_IDLE_TTL = float(os.getenv("DATASET_CACHE_IDLE_TTL", 1800))              # 数据集空闲多少秒后淘汰
+DATASET_FILE_ROOTS = [os.path.realpath(p.strip()) for p in os.getenv("DATASET_FILE_ROOTS", "downloads").split(",") if p.strip()]
+DATASET_SAMPLE_THRESHOLD_BYTES = int(os.getenv("DATASET_SAMPLE_THRESHOLD_BYTES", 256 * 1024 * 1024))  # 超过该大小自动抽样
+DATASET_SAMPLE_ROWS = int(os.getenv("DATASET_SAMPLE_ROWS", 1_000_000))                 # 自动抽样保留的行数
+DATASET_CSV_BLOCK_SIZE = int(os.getenv("DATASET_CSV_BLOCK_SIZE", 16 * 1024 * 1024))    # 流式读取的块大小（字节）
+DATASET_DOWNCAST_FLOATS = os.getenv("DATASET_DOWNCAST_FLOATS", "false").lower() in ("1", "true", "yes")  # 浮点列降为 float32
+DATASET_DOWNCAST_INTEGERS = os.getenv("DATASET_DOWNCAST_INTEGERS", "false").lower() in ("1", "true", "yes")  # 整数列降为 int32
+DATASET_STRING_CATEGORIES = os.getenv("DATASET_STRING_CATEGORIES", "false").lower() in ("1", "true", "yes")  # 低基数字符串列转为 category
+DATASET_CATEGORY_MAX_RATIO = float(os.getenv("DATASET_CATEGORY_MAX_RATIO", 0.5))       # 去重值占比低于该值的字符串列转为 category
+
+_HANDLE_RE = re.compile(r"ds_[0-9a-f]{32}")
+
+dataset_cache = TTLCache(DATASET_CACHE_MAX_BYTES, DATASET_CACHE_IDLE_TTL, name="datasets", sliding=True)
+
+
+class DatasetNotFoundError(KeyError):
+    """数据集句柄不存在或已被淘汰。"""
+
+
+class DatasetPathError(ValueError):
+    """文件不存在，或不在 DATASET_FILE_ROOTS 允许的目录下。"""
+
+
+Source = Union[str, bytes]
+
+
+def is_handle(text: str) -> bool:
+    return _HANDLE_RE.fullmatch(text.strip()) is not None
+
+
+def _resolve_format(content: Source, content_format: str) -> str:
+    if content_format and content_format != "auto":
+        return content_format
+    head = content[:64]
+    return detect_format(head.decode("utf-8", "ignore") if isinstance(head, bytes) else head)
+
+
+def _handle(digest, fmt: str, sample_rows: int) -> str:
+    digest.update(f"\0{fmt}\0{sample_rows}".encode())
+    return "ds_" + digest.hexdigest()[:32]
+
+
+def dataset_handle(content: Source, content_format: str = "auto", sample_rows: int = 0) -> str:
+    """按 (内容, 格式, 抽样行数) 计算数据集句柄；相同内容的文本和 bytes 得到相同的句柄。"""
+    raw = content.encode("utf-8", "surrogatepass") if isinstance(content, str) else content
+    return _handle(hashlib.sha256(raw), _resolve_format(content, content_format), sample_rows)
+
+
+def file_handle(path: str, content_format: str = "auto", sample_rows: int = 0) -> str:
+    """按文件内容计算句柄，与直接传入相同内容时一致。"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        head = f.read(64)
+        digest.update(head)
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return _handle(digest, _resolve_format(head, content_format), sample_rows)
+
+
+def resolve_path(file_path: str) -> str:
+    """把文件路径解析为绝对路径，只允许读取 DATASET_FILE_ROOTS 下的文件。"""
+    path = os.path.realpath(file_path)
+    if not any(path == root or path.startswith(root + os.sep) for root in DATASET_FILE_ROOTS):
+        raise DatasetPathError(f"只允许读取以下目录中的文件: {', '.join(DATASET_FILE_ROOTS)}")
+    if not os.path.isfile(path):
+        raise DatasetPathError(f"文件不存在: {file_path}")
+    return path
+
+
+def _open(source: Source):
+    """路径（str）原样返回，bytes 包装为只读缓冲区，供 pandas / pyarrow 读取。"""
+    return io.BytesIO(source) if isinstance(source, bytes) else source
+
+
+def _csv_chunks(source: Source) -> Iterator[pd.DataFrame]:
+    """用 pyarrow 按块流式读取 CSV。"""
+    import pyarrow.csv as pa_csv
+    reader = pa_csv.open_csv(_open(source), read_options=pa_csv.ReadOptions(block_size=DATASET_CSV_BLOCK_SIZE))
+    for batch in reader:
+        yield batch.to_pandas()
+
+
+def _pandas_chunks(source: Source) -> Iterator[pd.DataFrame]:
+    yield from pd.read_csv(_open(source), chunksize=100_000)
+
+
+def _sample(chunks: Iterator[pd.DataFrame], sample_rows: int, seed: int = 0) -> Tuple[pd.DataFrame, int]:
+    """
+    从分块中无放回地均匀抽取 sample_rows 行：给每行一个随机键，始终只保留键最小的 sample_rows 行。
+    返回 (按原顺序排列的样本, 总行数)。
+    """
+    rng = np.random.default_rng(seed)
+    kept: Optional[pd.DataFrame] = None
+    kept_keys = np.empty(0)
+    total = 0
+    for chunk in chunks:
+        chunk.index = pd.RangeIndex(total, total + len(chunk))
+        total += len(chunk)
+        keys = rng.random(len(chunk))
+        if kept is not None:
+            chunk = pd.concat([kept, chunk])
+            keys = np.concatenate([kept_keys, keys])
+        if len(chunk) > sample_rows:
+            selected = np.argpartition(keys, sample_rows - 1)[:sample_rows]
+            chunk, keys = chunk.iloc[selected], keys[selected]
+        kept, kept_keys = chunk, keys
+    if kept is None:
+        return pd.DataFrame(), 0
+    return kept.sort_index().reset_index(drop=True), total
+
+
+def read_csv(source: Source, sample_rows: int = 0) -> Tuple[pd.DataFrame, Dict[str, Any]]:
+    """
+    读取 CSV，source 为文件路径（str）或内容（bytes）。sample_rows 为 0 且输入超过 DATASET_SAMPLE_THRESHOLD_BYTES 时
+    自动抽取 DATASET_SAMPLE_ROWS 行。返回 (DataFrame, 读取信息)。
+    """
+    size = os.path.getsize(source) if isinstance(source, str) else len(source)
+    if not sample_rows and size > DATASET_SAMPLE_THRESHOLD_BYTES:
+        sample_rows = DATASET_SAMPLE_ROWS
+    info: Dict[str, Any] = {"source_bytes": size}
+    if sample_rows:
+        try:
+            df, total = _sample(_csv_chunks(source), sample_rows)
+            info["engine"] = "pyarrow"
+        except Exception as e:
+            # 后续块的类型与首块推断不一致等情况，整体退回 pandas 分块读取
+            logger.warning(f"pyarrow 流式读取 CSV 失败，改用 pandas 分块读取: {e}")
+            df, total = _sample(_pandas_chunks(source), sample_rows)
+            info["engine"] = "c"
+        info.update(sampled=len(df) < total, total_rows=total)
+        return df, info
+    try:
+        df = pd.read_csv(_open(source), engine="pyarrow")
+        info["engine"] = "pyarrow"
+    except Exception as e:
+        logger.warning(f"pyarrow 引擎解析 CSV 失败，改用 pandas 默认引擎: {e}")
+        df = pd.read_csv(_open(source))
+        info["engine"] = "c"
+    info.update(sampled=False, total_rows=len(df))
+    return df, info
+
+
+def optimize_dataframe(df: pd.DataFrame, downcast_floats: bool = DATASET_DOWNCAST_FLOATS,
+                       downcast_integers: bool = DATASET_DOWNCAST_INTEGERS,
+                       string_categories: bool = DATASET_STRING_CATEGORIES) -> pd.DataFrame:
+    """
+    原地压缩 DataFrame 的内存占用，三种转换默认都关闭。
+    downcast_floats 为 True 时每个值都能无损表示的 float64 列降为 float32，之后的求和、均值按 float32 计算会损失精度；
+    downcast_integers 为 True 时取值范围允许的 int64 列降为 int32，之后的算术结果超出 int32 会静默溢出；
+    string_categories 为 True 时低基数字符串列转为 category，之后 df.loc[i, col] = 新取值 会报错。
+    默认浮点保持 float64、整数保持 int64、字符串保持 object。
+    """
+    rows = len(df)
+    for name in df.columns:
+        column = df[name]
+        if pd.api.types.is_bool_dtype(column):
+            continue
+        if pd.api.types.is_integer_dtype(column):
+            if downcast_integers and column.dtype.itemsize > 4 and rows and column.min() >= np.iinfo(np.int32).min \
+                    and column.max() <= np.iinfo(np.int32).max:
+                df[name] = column.astype(np.int32)
+        elif pd.api.types.is_float_dtype(column):
+            if downcast_floats and column.dtype.itemsize > 4:
+                narrowed = column.astype(np.float32)
+                if np.array_equal(narrowed.to_numpy(np.float64), column.to_numpy(), equal_nan=True):
+                    df[name] = narrowed
+        elif string_categories and column.dtype == object and rows:
+            if pd.api.types.infer_dtype(column, skipna=True) == "string" \
+                    and column.nunique(dropna=True) <= rows * DATASET_CATEGORY_MAX_RATIO:
+                df[name] = column.astype("category")
+    return df
+
+
+def parse_dataframe(content: Source, content_format: str = "auto", sample_rows: int = 0,
+                    is_path: bool = False) -> pd.DataFrame:
+    """
+    按格式把内容解析为 DataFrame 并压缩内存，读取信息写入 df.attrs["ingest"]。
+    is_path 为 True 时 content 是已经过 resolve_path 校验的文件路径。CSV 走 read_csv，Arrow 保留原始类型。
+    """
+    if is_path:
+        with open(content, "rb") as f:
+            fmt = _resolve_format(f.read(64), content_format)
+    else:
+        fmt = _resolve_format(content, content_format)
+    if fmt == "csv":
+        if isinstance(content, str) and not is_path:
+            content = content.encode("utf-8")  # 文本内容直接转为 bytes 交给解析器，不再复制到 StringIO
+        df, info = read_csv(content, sample_rows)
+    else:
+        if is_path:
+            with open(content, "rb") as f:
+                content = f.read()
+        text = content.decode("utf-8") if isinstance(content, bytes) else content
+        info = {"source_bytes": len(text), "engine": fmt}
+        df = _parse_text(text, fmt)
+        info.update(sampled=False, total_rows=len(df))
+    info["parsed_bytes"] = dataframe_bytes(df)
+    optimize_dataframe(df)
+    info["optimized_bytes"] = dataframe_bytes(df)
+    df.attrs["ingest"] = info
+    logger.info(f"数据集读取完成: {info}")
+    return df
+
+
+def _parse_text(text: str, fmt: str) -> pd.DataFrame:
+    if fmt == "arrow":
+        return decode_arrow_table(text).to_pandas()
+    try:
+        payload = json.loads(text)
+    except json.JSONDecodeError as e:
+        raise ResultFormatError(f"无效的JSON数据: {e}") from e
+    if isinstance(payload, dict) and payload.get("format") in ("csv", "arrow") and "data" in payload:
+        # run_readonly_query_in_database 的分页对象
+        if payload["format"] == "csv":
+            return read_csv(payload["data"].encode("utf-8"))[0]
+        return decode_arrow_table(payload["data"]).to_pandas()
+    columns, rows = decode_table(text, fmt)
+    return pd.DataFrame(rows, columns=columns)
+
+
+def dataframe_bytes(df: pd.DataFrame) -> int:
+    return int(df.memory_usage(deep=True).sum())
+
+
+def _cached_or_parse(handle: str, source: Source, content_format: str, sample_rows: int,
+                     is_path: bool = False) -> Tuple[str, pd.DataFrame, bool]:
+    dataset_cache.purge_expired()
+    df = dataset_cache.get(handle)
+    if df is not None:
+        return handle, df, True
+    df = parse_dataframe(source, content_format, sample_rows, is_path)
+    dataset_cache.set(handle, df, dataframe_bytes(df))
+    return handle, df, False
+
+
+def load(content: Source, content_format: str = "auto", sample_rows: int = 0) -> Tuple[str, pd.DataFrame, bool]:
+    """解析文本或 bytes 内容并放入缓存，返回 (句柄, DataFrame, 是否命中缓存)。"""
+    return _cached_or_parse(dataset_handle(content, content_format, sample_rows), content,
+                            content_format, sample_rows)
+
+
+def load_file(file_path: str, content_format: str = "auto", sample_rows: int = 0) -> Tuple[str, pd.DataFrame, bool]:
+    """读取 DATASET_FILE_ROOTS 下的文件并放入缓存，返回 (句柄, DataFrame, 是否命中缓存)。"""
+    path = resolve_path(file_path)
+    return _cached_or_parse(file_handle(path, content_format, sample_rows), path, content_format, sample_rows,
+                            is_path=True)
+
+
+def get(handle: str) -> pd.DataFrame:
+    """按句柄取出已缓存的 DataFrame，不存在时抛出 DatasetNotFoundError。"""
+    df = dataset_cache.get(handle.strip())
+    if df is None:
+        raise DatasetNotFoundError(handle)
+    return df
+
+
+def resolve(content_or_handle: str, content_format: str = "auto") -> Tuple[str, pd.DataFrame, bool]:
+    """接受数据集句柄或原始内容，返回 (句柄, DataFrame, 是否命中缓存)。"""
+    if is_handle(content_or_handle):
+        handle = content_or_handle.strip()
+        return handle, get(handle), True
+    return load(content_or_handle, content_format)
+
+
+def describe(handle: str, df: pd.DataFrame, cached: bool) -> Dict[str, Any]:
+    """数据集的简要信息，供 load_csv 返回。"""
+    return {
+        "dataset_id": handle,
+        "rows": len(df),
+        "columns": [str(c) for c in df.columns[:50]],
+        "column_count": len(df.columns),
+        "dtypes": {str(c): str(t) for c, t in list(df.dtypes.items())[:50]},
+        "memory_bytes": dataframe_bytes(df),
+        "ingest": df.attrs.get("ingest"),
+        "cached": cached,
+    }
+
+
+def cache_stats() -> Dict[str, Any]:
+    return dataset_cache.stats()
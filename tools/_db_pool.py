@@ -0,0 +1,438 @@
+"""
+MySQL 连接池与数据库工具执行器。
+
+按数据库名维护有界连接池，借出时 ping 探活，并按空闲时长 / 生命周期淘汰旧连接，
+避免每次工具调用都重新进行 TCP 握手、认证和字符集协商。
+阻塞的 pymysql 调用通过 db_task 放到专用线程池中执行，并按数据库限制并发，
+慢查询只占用本库的名额，不会阻塞 MCP 事件循环上的其他请求。
+MCP 请求被取消时，会对该请求正在使用的连接发送 KILL QUERY，让服务端停止执行。
+文件名以下划线开头，server.py 的工具加载器会跳过它，只作为 database_tools 的内部模块使用。
+"""
+import asyncio
+import contextvars
+import functools
+import inspect
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+import pymysql
+from loguru import logger
+from dotenv import load_dotenv
+
+from metrics import time_upstream
+
+load_dotenv()
+
+# Database connection details
+DB_HOST = os.getenv("DB_HOST", "localhost")
+DB_PORT = int(os.getenv("DB_PORT", 3306))
+DB_USER = os.getenv("DB_USER", "root")
+DB_PASSWORD = os.getenv("DB_PASSWORD", "123456")
+
+# Connection pool settings
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))                       # 每个数据库的最大连接数
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 10))              # 池满时等待空闲连接的最长秒数
+DB_POOL_MAX_IDLE = float(os.getenv("DB_POOL_MAX_IDLE", 300))           # 连接空闲超过该秒数即淘汰
+DB_POOL_MAX_LIFETIME = float(os.getenv("DB_POOL_MAX_LIFETIME", 3600))  # 连接存活超过该秒数即淘汰
+
+# Executor settings
+DB_EXECUTOR_WORKERS = int(os.getenv("DB_EXECUTOR_WORKERS", 16))                          # 执行数据库调用的线程数
+DB_MAX_CONCURRENCY_PER_DB = int(os.getenv("DB_MAX_CONCURRENCY_PER_DB", DB_POOL_SIZE))    # 每个数据库同时执行的工具调用数
+
+
+class _TimedConnection(pymysql.connections.Connection):
+    """记录每条语句的执行耗时（含读取缓冲的结果集；服务端游标之后逐批读取的时间不计入）。"""
+
+    def query(self, sql, unbuffered=False):
+        with time_upstream("mysql"):
+            return super().query(sql, unbuffered)
+
+
+def _new_connection(db_name: Optional[str] = None):
+    return _TimedConnection(
+        host=DB_HOST,
+        port=DB_PORT,
+        user=DB_USER,
+        password=DB_PASSWORD,
+        database=db_name,
+        charset='utf8mb4',
+        cursorclass=pymysql.cursors.DictCursor,
+        # 池化连接必须开启 autocommit，否则长期持有的事务快照会让后续查询读到旧数据
+        autocommit=True
+    )
+
+
+class PoolTimeoutError(Exception):
+    """在 DB_POOL_TIMEOUT 内没有等到可用连接。"""
+
+
+class _PoolEntry:
+    __slots__ = ("conn", "created_at", "last_used")
+
+    def __init__(self, conn):
+        now = time.monotonic()
+        self.conn = conn
+        self.created_at = now
+        self.last_used = now
+
+
+class ConnectionPool:
+    """单个数据库的有界连接池（线程安全）。"""
+
+    def __init__(self, db_name: Optional[str] = None, size: int = DB_POOL_SIZE, timeout: float = DB_POOL_TIMEOUT,
+                 max_idle: float = DB_POOL_MAX_IDLE, max_lifetime: float = DB_POOL_MAX_LIFETIME):
+        self.db_name = db_name
+        self.size = max(1, size)
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.max_lifetime = max_lifetime
+        self._idle: deque = deque()
+        self._leased: Dict[int, _PoolEntry] = {}
+        self._total = 0  # 已创建且未关闭的连接数（含正在创建中的占位）
+        self._cond = threading.Condition()
+        self._stats = {
+            "checkouts": 0,
+            "waits": 0,
+            "wait_time": 0.0,
+            "created": 0,
+            "evictions": 0,
+            "evicted_idle": 0,
+            "evicted_lifetime": 0,
+            "evicted_ping": 0,
+            "evicted_broken": 0,
+            "timeouts": 0,
+        }
+
+    def _connect(self):
+        return _new_connection(self.db_name)
+
+    def _expired_reason(self, entry: _PoolEntry, now: float) -> Optional[str]:
+        if self.max_lifetime > 0 and now - entry.created_at > self.max_lifetime:
+            return "lifetime"
+        if self.max_idle > 0 and now - entry.last_used > self.max_idle:
+            return "idle"
+        return None
+
+    def _evict(self, entry: _PoolEntry, reason: str):
+        """关闭连接并释放其占用的名额。调用方不能持有锁。"""
+        try:
+            entry.conn.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._total -= 1
+            self._stats["evictions"] += 1
+            self._stats[f"evicted_{reason}"] += 1
+            self._cond.notify()
+        logger.debug(f"连接池[{self.db_name or '-'}] 淘汰连接，原因: {reason}")
+
+    def acquire(self):
+        """借出一个健康的连接，池满时最多等待 timeout 秒。"""
+        deadline = None
+        waited_since = None
+        while True:
+            entry = None
+            expired = []
+            create = False
+            with self._cond:
+                now = time.monotonic()
+                while self._idle:
+                    candidate = self._idle.pop()  # LIFO：优先复用最近用过的热连接
+                    reason = self._expired_reason(candidate, now)
+                    if reason:
+                        expired.append((candidate, reason))
+                    else:
+                        entry = candidate
+                        break
+                if entry is None and self._total - len(expired) < self.size:
+                    # 先占位再在锁外建连，避免并发请求超出上限
+                    self._total += 1
+                    create = True
+                elif entry is None and not expired:
+                    if deadline is None:
+                        deadline = now + self.timeout
+                        waited_since = now
+                        self._stats["waits"] += 1
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        self._stats["wait_time"] += now - waited_since
+                        self._stats["timeouts"] += 1
+                        raise PoolTimeoutError(
+                            f"等待数据库连接超时（{self.timeout}s），连接池已满: {self.size}")
+                    self._cond.wait(remaining)
+                    continue
+
+            for stale, reason in expired:
+                self._evict(stale, reason)
+
+            if create:
+                try:
+                    entry = _PoolEntry(self._connect())
+                except Exception:
+                    with self._cond:
+                        self._total -= 1
+                        self._cond.notify()
+                    raise
+                with self._cond:
+                    self._stats["created"] += 1
+            elif entry is not None:
+                try:
+                    entry.conn.ping(reconnect=False)
+                except Exception:
+                    self._evict(entry, "ping")
+                    continue
+            else:
+                continue
+
+            with self._cond:
+                self._leased[id(entry.conn)] = entry
+                self._stats["checkouts"] += 1
+                if waited_since is not None:
+                    self._stats["wait_time"] += time.monotonic() - waited_since
+            return entry.conn
+
+    def release(self, conn):
+        """归还连接；已断开或超过生命周期的连接直接关闭。"""
+        with self._cond:
+            entry = self._leased.pop(id(conn), None)
+        if entry is None:
+            logger.warning(f"连接池[{self.db_name or '-'}] 收到未登记的连接，直接关闭。")
+            try:
+                conn.close()
+            except Exception:
+                pass
+            return
+        if not conn.open:
+            self._evict(entry, "broken")
+            return
+        now = time.monotonic()
+        if self.max_lifetime > 0 and now - entry.created_at > self.max_lifetime:
+            self._evict(entry, "lifetime")
+            return
+        entry.last_used = now
+        with self._cond:
+            self._idle.append(entry)
+            self._cond.notify()
+
+    def close(self):
+        """关闭所有空闲连接；借出中的连接在归还时按 broken 淘汰。"""
+        with self._cond:
+            idle = list(self._idle)
+            self._idle.clear()
+        for entry in idle:
+            self._evict(entry, "idle")
+        with self._cond:
+            for entry in self._leased.values():
+                try:
+                    entry.conn.close()
+                except Exception:
+                    pass
+
+    def stats(self) -> Dict:
+        with self._cond:
+            stats = dict(self._stats)
+            stats.update({
+                "db_name": self.db_name,
+                "size": self.size,
+                "open": self._total,
+                "idle": len(self._idle),
+                "in_use": len(self._leased),
+                "wait_time": round(stats["wait_time"], 4),
+            })
+        return stats
+
+
+_pools: Dict[Optional[str], ConnectionPool] = {}
+_owners: Dict[int, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_name: Optional[str] = None) -> ConnectionPool:
+    """获取（必要时创建）指定数据库的连接池。"""
+    pool = _pools.get(db_name)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(db_name)
+            if pool is None:
+                pool = ConnectionPool(db_name)
+                _pools[db_name] = pool
+    return pool
+
+
+# 当前 db_task 正在使用的连接，请求被取消时据此发送 KILL QUERY
+_task_connections: contextvars.ContextVar[Optional[set]] = contextvars.ContextVar("db_task_connections", default=None)
+# 保护登记集合和连接上的 _doomed 标记：取消方标记连接与工作线程归还连接互斥
+_tracking_lock = threading.Lock()
+
+
+def track_connection(conn):
+    """把连接登记到当前 db_task 上（不在 db_task 中调用时什么也不做）。"""
+    tracked = _task_connections.get()
+    if tracked is not None:
+        with _tracking_lock:
+            tracked.add(conn)
+
+
+def untrack_connection(conn):
+    tracked = _task_connections.get()
+    if tracked is not None:
+        with _tracking_lock:
+            tracked.discard(conn)
+
+
+def doom_connections(tracked: set) -> List[int]:
+    """
+    把仍登记在 tracked 中的连接标记为待废弃，返回它们的服务端线程 ID。
+    被标记的连接归还时直接关闭而不回到连接池，之后发送的 KILL QUERY 不会误杀其他请求借出的连接。
+    """
+    with _tracking_lock:
+        doomed = [conn for conn in tracked if conn.open]
+        for conn in doomed:
+            conn._doomed = True
+        return [conn.thread_id() for conn in doomed]
+
+
+def kill_query(thread_id: int):
+    """用一条独立的新连接（不占用连接池名额）中止指定线程上正在执行的语句。"""
+    try:
+        conn = _new_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("KILL QUERY %s", (int(thread_id),))
+        finally:
+            conn.close()
+        logger.info(f"已发送 KILL QUERY {thread_id}")
+    except Exception as e:
+        logger.error(f"KILL QUERY {thread_id} 失败: {e}")
+
+
+def acquire_connection(db_name: Optional[str] = None):
+    pool = get_pool(db_name)
+    conn = pool.acquire()
+    with _pools_lock:
+        _owners[id(conn)] = pool
+    track_connection(conn)
+    return conn
+
+
+def release_connection(conn):
+    untrack_connection(conn)
+    with _tracking_lock:
+        doomed = getattr(conn, "_doomed", False)
+    with _pools_lock:
+        pool = _owners.pop(id(conn), None)
+    if doomed:
+        # 已有针对该连接的 KILL QUERY 在途，关闭后由连接池按 broken 淘汰
+        try:
+            conn.close()
+        except Exception:
+            pass
+    if pool is None:
+        try:
+            conn.close()
+        except Exception:
+            pass
+        return
+    pool.release(conn)
+
+
+def pool_stats() -> Dict[str, Dict]:
+    with _pools_lock:
+        pools = list(_pools.values())
+    return {(p.db_name or "<server>"): p.stats() for p in pools}
+
+
+def close_all_pools():
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
+
+
+_executor = ThreadPoolExecutor(max_workers=DB_EXECUTOR_WORKERS, thread_name_prefix="db-worker")
+_slots: Dict[Optional[str], asyncio.Semaphore] = {}
+_slot_stats: Dict[Optional[str], Dict[str, int]] = {}
+_slot_stats_lock = threading.Lock()  # executor_stats() 会在工作线程中读取计数
+
+
+async def run_db_task(group: Optional[str], fn: Callable, /, *args, **kwargs):
+    """
+    在数据库线程池中执行阻塞调用，同一分组（数据库）最多 DB_MAX_CONCURRENCY_PER_DB 个并发。
+    名额在工作线程真正结束时才归还：请求被取消后线程仍可能在执行查询，不能提前让出名额。
+    """
+    slot = _slots.get(group)
+    if slot is None:
+        slot = _slots.setdefault(group, asyncio.Semaphore(DB_MAX_CONCURRENCY_PER_DB))
+    with _slot_stats_lock:
+        stats = _slot_stats.setdefault(group, {"calls": 0, "active": 0, "waiting": 0})
+        stats["waiting"] += 1
+    try:
+        await slot.acquire()
+    finally:
+        with _slot_stats_lock:
+            stats["waiting"] -= 1
+    with _slot_stats_lock:
+        stats["calls"] += 1
+        stats["active"] += 1
+
+    loop = asyncio.get_running_loop()
+
+    def release_slot():
+        with _slot_stats_lock:
+            stats["active"] -= 1
+        slot.release()
+
+    def on_done(_):
+        # 在工作线程中回调（任务排队时被取消则在取消方线程中），asyncio.Semaphore 只能在事件循环线程中操作
+        try:
+            loop.call_soon_threadsafe(release_slot)
+        except RuntimeError:  # 事件循环已关闭
+            pass
+
+    tracked: set = set()
+    ctx = contextvars.copy_context()
+    ctx.run(_task_connections.set, tracked)
+    try:
+        future = _executor.submit(ctx.run, fn, *args, **kwargs)
+    except BaseException:
+        release_slot()
+        raise
+    future.add_done_callback(on_done)
+    try:
+        return await asyncio.wrap_future(future, loop=loop)
+    except asyncio.CancelledError:
+        # 尚未开始执行的任务会被直接取消；已在执行的工作线程无法被取消，
+        # 只能让服务端中止语句，线程随后会因查询出错而返回并归还名额
+        for thread_id in doom_connections(tracked):
+            threading.Thread(target=kill_query, args=(thread_id,), daemon=True).start()
+        raise
+
+
+def db_task(param: Optional[str] = "db_name"):
+    """
+    将同步的数据库工具函数包装为协程函数，签名和文档字符串保持不变，可直接交给 mcp.tool() 注册。
+    param 指定用哪个参数的值作为并发限制的分组（None 表示共用服务器级分组）。
+    """
+    def decorator(fn: Callable) -> Callable:
+        sig = inspect.signature(fn)
+
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            group = sig.bind_partial(*args, **kwargs).arguments.get(param) if param else None
+            return await run_db_task(group, fn, *args, **kwargs)
+
+        return wrapper
+    return decorator
+
+
+def executor_stats() -> Dict[str, Dict[str, int]]:
+    with _slot_stats_lock:
+        return {
+            (group or "<server>"): dict(stats, limit=DB_MAX_CONCURRENCY_PER_DB)
+            for group, stats in _slot_stats.items()
+        }
@@ -0,0 +1,183 @@
+"""
+常见数据问题的确定性快速路径。
+
+行数、列名、描述性统计、缺失值统计、按列取前 N 行、分组聚合、取值分布等操作直接以向量化的 pandas 运算完成，
+毫秒级返回，不经过 LLM Agent。analyze_dataset 工具按结构化参数调用 run_operation；
+analyze_csv_content 先用 route_question 识别简单问题，带筛选条件（where、from、大于、年份等）的问题和无法识别的开放式问题交给 Agent。
+"""
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+OPERATIONS = ("row_count", "columns", "describe", "null_counts", "top_n", "group_by", "value_counts", "head")
+AGGREGATIONS = ("sum", "mean", "count", "min", "max", "median")
+
+_MAX_OUTPUT_ROWS = 200
+
+
+class AnalysisError(ValueError):
+    """参数不合法（未知操作、列不存在、列类型不支持等）。"""
+
+
+def _table(df: pd.DataFrame, index: bool = True) -> str:
+    return df.to_markdown(index=index)
+
+
+def _require_column(df: pd.DataFrame, column: str, numeric: bool = False) -> str:
+    if not column:
+        raise AnalysisError("该操作需要指定 column 参数。")
+    if column not in df.columns:
+        raise AnalysisError(f"列 '{column}' 不存在，可用列: {', '.join(map(str, df.columns))}")
+    if numeric and not pd.api.types.is_numeric_dtype(df[column]):
+        raise AnalysisError(f"列 '{column}' 不是数值类型。")
+    return column
+
+
+def run_operation(df: pd.DataFrame, operation: str, column: str = "", by: str = "", agg: str = "sum",
+                  n: int = 10, ascending: bool = False) -> str:
+    """执行一个结构化分析操作，返回文本或 Markdown 表格。"""
+    n = max(1, min(int(n), _MAX_OUTPUT_ROWS))
+    if operation == "row_count":
+        return f"共 {len(df)} 行，{len(df.columns)} 列。"
+    if operation == "columns":
+        info = pd.DataFrame({
+            "column": [str(c) for c in df.columns],
+            "dtype": [str(t) for t in df.dtypes],
+            "non_null": df.notna().sum().to_numpy(),
+        })
+        return _table(info, index=False)
+    if operation == "describe":
+        if column:
+            return _table(df[_require_column(df, column)].describe().to_frame())
+        numeric = df.select_dtypes("number")
+        return _table((numeric if len(numeric.columns) else df).describe().T)
+    if operation == "null_counts":
+        counts = df.isna().sum()
+        result = pd.DataFrame({"null_count": counts, "null_ratio": (counts / max(len(df), 1)).round(4)})
+        return _table(result[result["null_count"] > 0]) if counts.any() else "所有列均没有缺失值。"
+    if operation == "head":
+        return _table(df.head(n), index=False)
+    if operation == "top_n":
+        column = _require_column(df, column, numeric=True)
+        rows = df.nsmallest(n, column) if ascending else df.nlargest(n, column)
+        return _table(rows, index=False)
+    if operation == "value_counts":
+        counts = df[_require_column(df, column)].value_counts(dropna=False).head(n)
+        return _table(counts.rename("count").to_frame())
+    if operation == "group_by":
+        by = _require_column(df, by)
+        if agg not in AGGREGATIONS:
+            raise AnalysisError(f"不支持的聚合方式: {agg}，可选: {', '.join(AGGREGATIONS)}")
+        if agg == "count" and not column:
+            result = df.groupby(by, observed=True, dropna=False).size().rename("count")
+        else:
+            column = _require_column(df, column, numeric=agg != "count")
+            result = df.groupby(by, observed=True, dropna=False)[column].agg(agg).rename(f"{agg}({column})")
+        result = result.sort_values(ascending=ascending).head(n)
+        return _table(result.to_frame())
+    raise AnalysisError(f"不支持的操作: {operation}，可选: {', '.join(OPERATIONS)}")
+
+
+# ---- 简单问题识别 ----
+
+# 含有这些词的问题涉及筛选条件、绘图、推断等，交给 Agent。英文词加词边界，避免 financial 命中 nan、overview 命中 over
+_OPEN_ENDED = re.compile(
+    r"图|画|绘|筛选|过滤|大于|小于|超过|低于|高于|等于|不等于|之间|以上|以下|并且|同时|以及|除了|排除|不含|不包括|包含|"
+    r"仅|只有|来自|属于|年份|年度|月份|\d+\s*(年|月|日)|[<>=≠≥≤]|相关|预测|趋势|为什么|比较|占比|比例|增长|"
+    r"\b(plot|chart|graph|visuali[sz]|filter|correlat|predict|trend|compar|percent|proportion|growth)|"
+    r"\b(where|why|how does|from|with|without|above|below|over|under|greater|less|more than|fewer|between|"
+    r"after|before|since|during|only|except|excluding|including|contains?|equals?|not|(19|20)\d{2})\b",
+    re.IGNORECASE)
+_ROW_COUNT = re.compile(r"多少(行|条|个记录|条记录)|几(行|条)|行数|记录数|\bhow many (rows|records|entries)\b|"
+                        r"\brow count\b|\bnumber of (rows|records)\b", re.IGNORECASE)
+_COLUMNS = re.compile(r"(哪些|什么|有几)(列|字段)|列名|字段名|\b(list|what are|show)( the| all)? (columns|fields)\b|"
+                      r"\bcolumn names\b", re.IGNORECASE)
+_NULLS = re.compile(r"缺失|空值|\b(nulls?|nans?|missing)\b", re.IGNORECASE)
+_DESCRIBE = re.compile(r"描述性统计|统计摘要|统计信息|数据概况|概览|\bdescribe\b|\bsummary stat|\bstatistical summary\b",
+                       re.IGNORECASE)
+_HEAD = re.compile(r"^\s*(显示|查看|列出)?\s*前\s*(\d+)\s*(行|条)(数据|记录)?\s*[。.?？]?\s*$|"
+                   r"^\s*(show|display|print)( me)?( the)? (first|top) (\d+) rows\s*[.?]?\s*$", re.IGNORECASE)
+_TOP_N = re.compile(r"(前|\btop\s*|最高的\s*|最大的\s*|\bhighest\s*|\blargest\s*)(\d+)|(后|\bbottom\s*|最低的\s*|"
+                    r"最小的\s*|\blowest\s*|\bsmallest\s*)(\d+)", re.IGNORECASE)
+_ASCENDING = re.compile(r"最低|最小|最少|后\s*\d|\b(bottom|lowest|smallest|least|ascending)\b|升序", re.IGNORECASE)
+_AGG_WORDS = [
+    ("mean", re.compile(r"平均|均值|\b(mean|average|avg)\b", re.IGNORECASE)),
+    ("sum", re.compile(r"总和|合计|总计|总额|总量|求和|\bsum\b|\btotal\b", re.IGNORECASE)),
+    ("median", re.compile(r"中位数|\bmedian\b", re.IGNORECASE)),
+    ("max", re.compile(r"最大值|\bmax(imum)?\b", re.IGNORECASE)),
+    ("min", re.compile(r"最小值|\bmin(imum)?\b", re.IGNORECASE)),
+    ("count", re.compile(r"数量|个数|计数|\bcount\b|\bhow many\b", re.IGNORECASE)),
+]
+_GROUP_MARKERS = re.compile(r"按|每个|每一个|各个|各|分组|group(ed)? by|\bby\b|\bper\b|\bfor each\b|\beach\b",
+                            re.IGNORECASE)
+_DISTRIBUTION = re.compile(r"分布|取值|不同的值|\b(distinct|unique values|value counts|distribution)\b", re.IGNORECASE)
+
+
+def _mentioned_columns(question: str, df: pd.DataFrame) -> List[Tuple[int, str]]:
+    """返回问题中出现的列名及其位置，长列名优先，避免 amount 同时匹配 total_amount。"""
+    found: List[Tuple[int, str]] = []
+    lowered = question.lower()
+    taken = [False] * len(lowered)
+    for column in sorted((str(c) for c in df.columns), key=len, reverse=True):
+        name = column.lower()
+        if not name:
+            continue
+        pattern = re.escape(name)
+        if re.fullmatch(r"\w+", name, re.ASCII):
+            pattern = rf"(?<![A-Za-z0-9_]){pattern}(?![A-Za-z0-9_])"
+        for match in re.finditer(pattern, lowered):
+            if not any(taken[match.start():match.end()]):
+                taken[match.start():match.end()] = [True] * (match.end() - match.start())
+                found.append((match.start(), column))
+                break
+    return sorted(found)
+
+
+def route_question(question: str, df: pd.DataFrame) -> Optional[Dict[str, Any]]:
+    """
+    识别可以直接计算的简单问题，返回 run_operation 的参数；无法确定时返回 None，交给 Agent 处理。
+    """
+    if _OPEN_ENDED.search(question):
+        return None
+    columns = _mentioned_columns(question, df)
+    names = [c for _, c in columns]
+    numeric = [c for c in names if pd.api.types.is_numeric_dtype(df[c])]
+
+    head = _HEAD.match(question)
+    if head:
+        return {"operation": "head", "n": int(next(g for g in head.groups() if g and g.isdigit()))}
+    if _ROW_COUNT.search(question) and not names:
+        return {"operation": "row_count"}
+    if _NULLS.search(question) and not names:
+        return {"operation": "null_counts"}
+    if _COLUMNS.search(question) and not names:
+        return {"operation": "columns"}
+    if _DESCRIBE.search(question) and len(names) <= 1:
+        return {"operation": "describe", "column": names[0] if names else ""}
+
+    top = _TOP_N.search(question)
+    if top and len(numeric) == 1 and len(names) == 1:
+        n = int(top.group(2) or top.group(4))
+        return {"operation": "top_n", "column": numeric[0], "n": n,
+                "ascending": bool(top.group(4)) or bool(_ASCENDING.search(question))}
+
+    agg = next((name for name, pattern in _AGG_WORDS if pattern.search(question)), None)
+    marker = _GROUP_MARKERS.search(question)
+    if agg and marker and 1 <= len(names) <= 2:
+        # 分组列取紧跟在“按/每个/by/per”之后出现的列
+        after = [c for pos, c in columns if pos >= marker.start()]
+        by = after[0] if after else None
+        if by is None:
+            return None
+        values = [c for c in names if c != by]
+        if len(values) == 1 and (agg == "count" or values[0] in numeric):
+            return {"operation": "group_by", "by": by, "column": values[0], "agg": agg,
+                    "n": _MAX_OUTPUT_ROWS, "ascending": bool(_ASCENDING.search(question))}
+        if not values and agg == "count":
+            return {"operation": "group_by", "by": by, "agg": "count", "n": _MAX_OUTPUT_ROWS}
+        return None
+
+    if _DISTRIBUTION.search(question) and len(names) == 1:
+        return {"operation": "value_counts", "column": names[0], "n": 50}
+    return None
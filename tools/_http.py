@@ -0,0 +1,232 @@
+"""
+进程内共享的 HTTP 访问层（RAGFlow、Tavily、文件下载共用）。
+
+- 每个上游主机（scheme + host + port）一个 httpx.AsyncClient，按事件循环懒创建。keep-alive 连接在调用之间复用，
+  重复访问同一上游时不再重复 DNS 解析、TCP 建连和 TLS 握手。每个主机的连接数（即并发请求数）
+  上限为 HTTP_MAX_CONNECTIONS_PER_HOST，超出的请求排队等待空闲连接。
+- HTTP_HTTP2=true 时启用 HTTP/2（需要安装 h2，未安装时退回 HTTP/1.1）。
+- 统一的超时：连接 HTTP_CONNECT_TIMEOUT 秒，其余 HTTP_TIMEOUT 秒，调用方可以按请求覆盖。
+- 连接失败由传输层重试 HTTP_CONNECT_RETRIES 次；request() 另外对网络错误和 429/502/503/504
+  按指数退避（带随机抖动，优先使用 Retry-After）重试，最多 HTTP_MAX_RETRIES 次。
+  非幂等请求只在连接尚未建立时重试，避免重复提交。
+- 通过 httpx 事件钩子按主机统计请求数、错误数、重试数和连接池状态，第三方 SDK 经由这里的客户端发出的请求同样计入。
+  每个请求从发出到收到响应头的耗时按上游名（register_upstream 登记，未登记的主机记为 http）计入工具调用指标（metrics）。
+"""
+import asyncio
+import os
+import random
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Optional, Set, Tuple
+
+import httpx
+from dotenv import load_dotenv
+
+from logger import logger
+from metrics import observe_upstream
+
+load_dotenv()
+
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", 30))                                    # 读写和等待连接的超时秒数
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", 5))                     # 建立连接的超时秒数
+HTTP_MAX_CONNECTIONS_PER_HOST = int(os.getenv("HTTP_MAX_CONNECTIONS_PER_HOST", 10))    # 每个上游主机的最大连接数
+HTTP_KEEPALIVE_SECONDS = float(os.getenv("HTTP_KEEPALIVE_SECONDS", 60))                # 空闲连接保持秒数
+HTTP_HTTP2 = os.getenv("HTTP_HTTP2", "false").lower() in ("1", "true", "yes")
+HTTP_CONNECT_RETRIES = int(os.getenv("HTTP_CONNECT_RETRIES", 2))                       # 传输层的连接重试次数
+HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", 3))                               # request() 的最大重试次数
+HTTP_RETRY_BACKOFF = float(os.getenv("HTTP_RETRY_BACKOFF", 0.5))                       # 第一次重试前的基础等待秒数
+
+_RETRY_STATUS = {429, 502, 503, 504}
+_MAX_BACKOFF = 10.0
+
+HostKey = Tuple[str, str, int]
+
+_clients: Dict[HostKey, httpx.AsyncClient] = {}
+_clients_loop = None
+_closing: Set[asyncio.Future] = set()  # 正在关闭的旧客户端，保持引用直到关闭完成
+_stats: Dict[str, Dict[str, int]] = {}
+_upstream_names: Dict[HostKey, str] = {}
+
+
+def _http2_available() -> bool:
+    if not HTTP_HTTP2:
+        return False
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        logger.warning("HTTP_HTTP2=true 但未安装 h2（pip install httpx[http2]），使用 HTTP/1.1。")
+        return False
+
+
+_USE_HTTP2 = _http2_available()
+
+
+def _host_key(url: httpx.URL) -> HostKey:
+    return url.scheme, url.host, url.port or (443 if url.scheme == "https" else 80)
+
+
+def _host_name(key: HostKey) -> str:
+    return f"{key[0]}://{key[1]}:{key[2]}"
+
+
+def register_upstream(url: str, name: str):
+    """登记 url 所在主机在指标中的上游名（如 ragflow、tavily）。"""
+    _upstream_names[_host_key(httpx.URL(url))] = name
+
+
+def _host_stats(name: str) -> Dict[str, int]:
+    stats = _stats.get(name)
+    if stats is None:
+        stats = _stats[name] = {"requests": 0, "responses": 0, "errors": 0, "retries": 0, "in_flight": 0}
+    return stats
+
+
+async def _on_request(request: httpx.Request):
+    stats = _host_stats(_host_name(_host_key(request.url)))
+    stats["requests"] += 1
+    stats["in_flight"] += 1
+    request.extensions["metrics_started"] = time.perf_counter()
+
+
+async def _on_response(response: httpx.Response):
+    key = _host_key(response.request.url)
+    stats = _host_stats(_host_name(key))
+    stats["responses"] += 1
+    stats["in_flight"] -= 1
+    if response.status_code >= 400:
+        stats["errors"] += 1
+    started = response.request.extensions.get("metrics_started")
+    if started is not None:
+        observe_upstream(_upstream_names.get(key, "http"), time.perf_counter() - started, response.status_code >= 400)
+
+
+async def _aclose_quietly(client: httpx.AsyncClient):
+    try:
+        await client.aclose()
+    except Exception as e:  # 旧事件循环已关闭时连接可能无法正常关闭
+        logger.debug(f"关闭旧事件循环上的 HTTP 客户端失败: {e!r}")
+
+
+def _close_clients(clients, old_loop, loop):
+    """关闭事件循环变化前创建的客户端：旧循环仍在其他线程运行时交给它关闭，否则在当前循环上关闭。"""
+    for client in clients:
+        if old_loop is not None and old_loop.is_running() and not old_loop.is_closed():
+            future = asyncio.run_coroutine_threadsafe(_aclose_quietly(client), old_loop)
+        else:
+            future = loop.create_task(_aclose_quietly(client))
+        _closing.add(future)
+        future.add_done_callback(_closing.discard)
+
+
+def client_for(url: str) -> httpx.AsyncClient:
+    """返回 url 所在主机的共享客户端。事件循环变化时（例如测试中多次 asyncio.run）关闭旧客户端并重新创建。"""
+    global _clients_loop
+    loop = asyncio.get_running_loop()
+    if _clients_loop is not loop:
+        _close_clients(list(_clients.values()), _clients_loop, loop)
+        _clients.clear()
+        _clients_loop = loop
+    key = _host_key(httpx.URL(url))
+    client = _clients.get(key)
+    if client is None:
+        limits = httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS_PER_HOST,
+                              max_keepalive_connections=HTTP_MAX_CONNECTIONS_PER_HOST,
+                              keepalive_expiry=HTTP_KEEPALIVE_SECONDS)
+        client = _clients[key] = httpx.AsyncClient(
+            transport=httpx.AsyncHTTPTransport(limits=limits, http2=_USE_HTTP2, retries=HTTP_CONNECT_RETRIES),
+            timeout=httpx.Timeout(HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+            follow_redirects=True,
+            event_hooks={"request": [_on_request], "response": [_on_response]},
+        )
+    return client
+
+
+def _backoff(attempt: int, response: Optional[httpx.Response] = None) -> float:
+    if response is not None:
+        retry_after = response.headers.get("Retry-After", "")
+        if retry_after.isdigit():
+            return min(float(retry_after), _MAX_BACKOFF)
+    return random.uniform(0, min(HTTP_RETRY_BACKOFF * 2 ** attempt, _MAX_BACKOFF))
+
+
+async def request(method: str, url: str, idempotent: bool = True, retries: Optional[int] = None,
+                  **kwargs) -> httpx.Response:
+    """
+    发送请求并按重试策略处理网络错误和可重试的状态码。最终失败时抛出 httpx 异常，
+    非 2xx 响应抛出 httpx.HTTPStatusError。其余参数与 httpx.AsyncClient.request 相同。
+    """
+    client = client_for(url)
+    key = _host_key(httpx.URL(url))
+    stats = _host_stats(_host_name(key))
+    retries = HTTP_MAX_RETRIES if retries is None else retries
+    attempt = 0
+    while True:
+        started = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+        except httpx.TransportError as e:
+            stats["in_flight"] = max(stats["in_flight"] - 1, 0)
+            observe_upstream(_upstream_names.get(key, "http"), time.perf_counter() - started, error=True)
+            retryable = idempotent or isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout))
+            if not retryable or attempt >= retries:
+                raise
+            delay = _backoff(attempt)
+            logger.warning(f"HTTP 请求 {method} {url} 失败: {e!r}，{delay:.2f} 秒后重试")
+        else:
+            if response.status_code not in _RETRY_STATUS or not idempotent or attempt >= retries:
+                response.raise_for_status()
+                return response
+            delay = _backoff(attempt, response)
+            logger.warning(f"HTTP 请求 {method} {url} 返回 {response.status_code}，{delay:.2f} 秒后重试")
+        attempt += 1
+        stats["retries"] += 1
+        await asyncio.sleep(delay)
+
+
+@asynccontextmanager
+async def stream(method: str, url: str, **kwargs) -> AsyncIterator[httpx.Response]:
+    """流式请求（用于下载），非 2xx 响应抛出 httpx.HTTPStatusError。"""
+    client = client_for(url)
+    key = _host_key(httpx.URL(url))
+    stats = _host_stats(_host_name(key))
+    send_options = {name: kwargs.pop(name) for name in ("auth", "follow_redirects") if name in kwargs}
+    request = client.build_request(method, url, **kwargs)
+    response = None
+    started = time.perf_counter()
+    try:
+        response = await client.send(request, stream=True, **send_options)
+    except httpx.TransportError:
+        observe_upstream(_upstream_names.get(key, "http"), time.perf_counter() - started, error=True)
+        raise
+    finally:
+        # 没有收到响应头（连接失败、超时、被取消）时响应钩子不会执行，请求钩子已计入的在途请求在这里扣减
+        if response is None and "metrics_started" in request.extensions:
+            stats["in_flight"] = max(stats["in_flight"] - 1, 0)
+    try:
+        response.raise_for_status()
+        yield response
+    finally:
+        await response.aclose()
+
+
+def _pool_state(client: httpx.AsyncClient) -> Dict[str, Any]:
+    # httpx 没有公开连接池状态，这里读取 httpcore 连接池的内部属性，取不到时只返回空字典
+    try:
+        connections = client._transport._pool.connections
+        return {"connections": len(connections), "idle_connections": sum(c.is_idle() for c in connections)}
+    except AttributeError:
+        return {}
+
+
+def http_stats() -> Dict[str, Any]:
+    hosts = {name: dict(stats) for name, stats in _stats.items()}
+    for key, client in list(_clients.items()):
+        hosts.setdefault(_host_name(key), {}).update(_pool_state(client))
+    return {"http2": _USE_HTTP2, "max_connections_per_host": HTTP_MAX_CONNECTIONS_PER_HOST, "hosts": hosts}
+
+
+async def aclose_all():
+    for client in list(_clients.values()):
+        await client.aclose()
+    _clients.clear()
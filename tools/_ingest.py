@@ -0,0 +1,265 @@
+"""
+论文批量导入流水线：解析链接 → 流式下载 → 上传到 RAGFlow 数据集 → 触发解析。
+
+四个阶段各有若干并发 worker，阶段之间用有界队列（INGEST_QUEUE_SIZE）连接：下载慢时解析链接的阶段会被队列挡住，
+不会无限堆积待下载的链接；上传慢时下载好的文件最多在队列中积压 INGEST_QUEUE_SIZE 个。
+- 下载直接流式读入内存并同时计算 sha256，不落临时文件；超过 INGEST_MAX_FILE_BYTES 或内容不是 PDF 时放弃。
+- 上传的文档名中带有内容哈希前缀（<名称>.<sha256 前 12 位>.pdf）。开始时列出数据集已有文档，
+  哈希或文件名已存在的论文（以及同一批次中内容重复的论文）直接跳过，不再上传和解析。
+- 上传成功的文档按 INGEST_PARSE_BATCH_SIZE 个（或等待 INGEST_PARSE_BATCH_WAIT 秒）一批交给解析跟踪器（tools._parse_tracker）。
+- 每个阶段统计处理数量、失败数量、累计处理耗时和吞吐量。
+"""
+import asyncio
+import hashlib
+import os
+import re
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from dotenv import load_dotenv
+
+from logger import logger
+from tools import _http
+from tools._parse_tracker import ParseJob, parse_tracker
+from tools._ragflow import ragflow
+
+load_dotenv()
+
+INGEST_RESOLVE_CONCURRENCY = int(os.getenv("INGEST_RESOLVE_CONCURRENCY", 4))     # 解析链接的并发数
+INGEST_DOWNLOAD_CONCURRENCY = int(os.getenv("INGEST_DOWNLOAD_CONCURRENCY", 4))   # 下载的并发数
+INGEST_UPLOAD_CONCURRENCY = int(os.getenv("INGEST_UPLOAD_CONCURRENCY", 2))       # 上传的并发数
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", 8))                       # 阶段之间队列的容量
+INGEST_MAX_FILE_BYTES = int(os.getenv("INGEST_MAX_FILE_BYTES", 100 * 1024 * 1024))  # 单个文件的大小上限
+INGEST_PARSE_BATCH_SIZE = int(os.getenv("INGEST_PARSE_BATCH_SIZE", 10))          # 每次触发解析的文档数
+INGEST_PARSE_BATCH_WAIT = float(os.getenv("INGEST_PARSE_BATCH_WAIT", 2))         # 凑满一批解析的最长等待秒数
+
+_HASH_PREFIX = 12
+_HASH_NAME_RE = re.compile(r"\.([0-9a-f]{%d})\.pdf$" % _HASH_PREFIX)
+_DONE = object()
+
+
+class IngestError(Exception):
+    """单篇论文在某个阶段失败（链接无效、文件过大、不是 PDF、上传失败等）。"""
+
+
+class _StageStats:
+    def __init__(self, name: str):
+        self.name = name
+        self.items = 0
+        self.failed = 0
+        self.bytes = 0
+        self.busy = 0.0
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+
+    def report(self) -> Dict[str, Any]:
+        wall = (self.finished or time.perf_counter()) - self.started if self.started else 0.0
+        report = {"items": self.items, "failed": self.failed, "busy_seconds": round(self.busy, 3),
+                  "wall_seconds": round(wall, 3),
+                  "items_per_second": round(self.items / wall, 3) if wall > 0 else None}
+        if self.bytes:
+            report["bytes"] = self.bytes
+            report["mb_per_second"] = round(self.bytes / 1024 / 1024 / wall, 3) if wall > 0 else None
+        return report
+
+
+def ingest_filename(url: str, sha256: str) -> str:
+    stem = os.path.basename(url.split("?")[0].rstrip("/")) or "document"
+    stem = re.sub(r"\.pdf$", "", stem, flags=re.IGNORECASE)
+    stem = re.sub(r"[^\w.\-]+", "_", stem)[:80]
+    return f"{stem}.{sha256[:_HASH_PREFIX]}.pdf"
+
+
+async def download(url: str, max_bytes: int = INGEST_MAX_FILE_BYTES) -> Tuple[bytes, str]:
+    """流式下载到内存，返回 (内容, sha256)。超过 max_bytes 或内容不是 PDF 时抛出 IngestError。"""
+    digest = hashlib.sha256()
+    buffer = bytearray()
+    async with _http.stream("GET", url) as response:
+        declared = int(response.headers.get("content-length") or 0)
+        if declared > max_bytes:
+            raise IngestError(f"文件过大: {declared} 字节，上限 {max_bytes} 字节")
+        async for chunk in response.aiter_bytes(chunk_size=65536):
+            digest.update(chunk)
+            buffer += chunk
+            if len(buffer) > max_bytes:
+                raise IngestError(f"文件过大: 超过 {max_bytes} 字节")
+    if not buffer.startswith(b"%PDF"):
+        raise IngestError("下载的内容不是 PDF（可能是网页或需要登录的链接）")
+    return bytes(buffer), digest.hexdigest()
+
+
+async def _existing_documents(dataset_id: str) -> Tuple[Set[str], Set[str]]:
+    """返回数据集中已有文档的 (内容哈希前缀集合, 文件名集合)；列出失败时不做去重。"""
+    hashes, names, page, page_size = set(), set(), 1, 100
+    while True:
+        try:
+            data = await ragflow.list_documents(dataset_id, page=page, page_size=page_size)
+        except Exception as e:
+            logger.warning(f"列出数据集 {dataset_id} 的已有文档失败，不跳过已导入的论文: {e}")
+            return hashes, names
+        docs = data.get("docs") or []
+        for doc in docs:
+            name = doc.get("name") or ""
+            names.add(name)
+            match = _HASH_NAME_RE.search(name)
+            if match:
+                hashes.add(match.group(1))
+        if len(docs) < page_size:
+            return hashes, names
+        page += 1
+
+
+class IngestPipeline:
+    def __init__(self, dataset_id: str, resolve: Callable[[str], Awaitable[str]],
+                 on_item_done: Optional[Callable[[Dict[str, Any]], Awaitable[None]]] = None):
+        self.dataset_id = dataset_id
+        self.resolve = resolve
+        self.on_item_done = on_item_done
+        self.stats = {name: _StageStats(name) for name in ("resolve", "download", "upload", "parse")}
+        self.jobs: List[ParseJob] = []
+        self._existing: Optional[asyncio.Task] = None
+        self._seen_hashes: Set[str] = set()
+
+    async def _finish(self, record: Dict[str, Any], status: str, error: Optional[str] = None):
+        record["status"] = status
+        if error:
+            record["error"] = error
+        if self.on_item_done is not None:
+            try:
+                await self.on_item_done(record)
+            except Exception as e:
+                logger.debug(f"发送导入进度失败: {e}")
+
+    async def _resolve(self, record):
+        record["url"] = await self.resolve(record["input"])
+        return record
+
+    async def _download(self, record):
+        content, sha256 = await download(record["url"])
+        record.update(sha256=sha256, bytes=len(content), filename=ingest_filename(record["url"], sha256))
+        self.stats["download"].bytes += len(content)
+        return record, content
+
+    async def _upload(self, item):
+        record, content = item
+        hashes, names = await self._existing
+        short = record["sha256"][:_HASH_PREFIX]
+        if short in hashes or record["filename"] in names or short in self._seen_hashes:
+            await self._finish(record, "skipped", "数据集或本批次中已有相同内容的文档")
+            return None
+        self._seen_hashes.add(short)
+        try:
+            docs = await ragflow.upload_document(self.dataset_id, record["filename"], content)
+            if not docs or not docs[0].get("id"):
+                raise IngestError(f"上传失败，返回信息: {docs}")
+        except Exception:
+            self._seen_hashes.discard(short)
+            raise
+        record["doc_id"] = docs[0]["id"]
+        self.stats["upload"].bytes += len(content)
+        return record
+
+    async def _stage(self, name: str, fn, inbox: asyncio.Queue, outbox: Optional[asyncio.Queue],
+                     workers: int, next_workers: int):
+        stats = self.stats[name]
+
+        async def worker():
+            while True:
+                item = await inbox.get()
+                if item is _DONE:
+                    return
+                started = time.perf_counter()
+                stats.started = stats.started or started
+                record = item[0] if isinstance(item, tuple) else item
+                try:
+                    result = await fn(item)
+                except Exception as e:
+                    stats.failed += 1
+                    logger.warning(f"导入 {record['input']} 在 {name} 阶段失败: {e}")
+                    await self._finish(record, "failed", f"{name}: {e}")
+                    continue
+                finally:
+                    stats.busy += time.perf_counter() - started
+                    stats.finished = time.perf_counter()
+                if result is None:
+                    continue
+                stats.items += 1
+                if outbox is not None:
+                    await outbox.put(result)
+
+        await asyncio.gather(*(worker() for _ in range(max(workers, 1))))
+        if outbox is not None:
+            for _ in range(next_workers):
+                await outbox.put(_DONE)
+
+    async def _parse(self, inbox: asyncio.Queue):
+        stats = self.stats["parse"]
+        batch: List[Dict[str, Any]] = []
+
+        async def flush():
+            if not batch:
+                return
+            started = time.perf_counter()
+            stats.started = stats.started or started
+            try:
+                job = await parse_tracker.start(self.dataset_id, [r["doc_id"] for r in batch])
+                self.jobs.append(job)
+                stats.items += len(batch)
+                for record in batch:
+                    record["parse_job_id"] = job.job_id
+                    await self._finish(record, "uploaded")
+            except Exception as e:
+                stats.failed += len(batch)
+                for record in batch:
+                    await self._finish(record, "uploaded", f"parse: {e}")
+            finally:
+                stats.busy += time.perf_counter() - started
+                stats.finished = time.perf_counter()
+            batch.clear()
+
+        loop = asyncio.get_running_loop()
+        while True:
+            record = await inbox.get()
+            if record is _DONE:
+                return
+            batch.append(record)
+            # 收到第一个文档后最多再等 INGEST_PARSE_BATCH_WAIT 秒凑满一批，减少解析任务和状态轮询的数量
+            deadline = loop.time() + INGEST_PARSE_BATCH_WAIT
+            while len(batch) < INGEST_PARSE_BATCH_SIZE:
+                try:
+                    record = await asyncio.wait_for(inbox.get(), max(deadline - loop.time(), 0))
+                except asyncio.TimeoutError:
+                    break
+                if record is _DONE:
+                    await flush()
+                    return
+                batch.append(record)
+            await flush()
+
+    async def run(self, inputs: List[str]) -> List[Dict[str, Any]]:
+        records = [{"input": item, "status": "pending"} for item in inputs]
+        self._existing = asyncio.create_task(_existing_documents(self.dataset_id))
+        queues = [asyncio.Queue(maxsize=INGEST_QUEUE_SIZE) for _ in range(4)]
+        workers = (INGEST_RESOLVE_CONCURRENCY, INGEST_DOWNLOAD_CONCURRENCY, INGEST_UPLOAD_CONCURRENCY, 1)
+
+        async def feed():
+            for record in records:
+                await queues[0].put(record)
+            for _ in range(workers[0]):
+                await queues[0].put(_DONE)
+
+        try:
+            await asyncio.gather(
+                feed(),
+                self._stage("resolve", self._resolve, queues[0], queues[1], workers[0], workers[1]),
+                self._stage("download", self._download, queues[1], queues[2], workers[1], workers[2]),
+                self._stage("upload", self._upload, queues[2], queues[3], workers[2], workers[3]),
+                self._parse(queues[3]),
+            )
+        finally:
+            if not self._existing.done():
+                self._existing.cancel()
+        return records
+
+    def report(self) -> Dict[str, Any]:
+        return {name: stats.report() for name, stats in self.stats.items()}
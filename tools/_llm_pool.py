@@ -0,0 +1,146 @@
+"""
+analyze_csv_content 共用的 LLM 客户端和 Agent 执行器池。
+
+- 进程内只创建一个 ChatOpenAI，底层 httpx 客户端保持长连接（keep-alive）并复用连接池，
+  后续调用不再重复建立连接和 TLS 握手。
+- 同时进行的 LLM 分析数量由 LLM_MAX_CONCURRENCY 限制，超出的调用排队等待。
+- Pandas Agent 执行器按数据集句柄缓存，再次使用时由调用方重新绑定代码执行环境（沙箱会话或 df 副本），
+  不再重新构造提示词和执行器。同一数据集的并发调用各自借用不同的执行器。
+"""
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Any, Callable, Dict, List, Optional
+
+import httpx
+from dotenv import load_dotenv
+
+from metrics import httpx_event_hooks
+
+load_dotenv()
+
+API_KEY = os.getenv("OPENAI_API_KEY")
+ENDPOINT = os.getenv("OPENAI_API_BASE")
+LLM_MODEL = os.getenv("LLM_MODEL", "google/gemini-2.5-pro")
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 4))              # 同时进行的 LLM 分析数
+LLM_HTTP_MAX_CONNECTIONS = int(os.getenv("LLM_HTTP_MAX_CONNECTIONS", 20))   # 连接池最大连接数
+LLM_HTTP_KEEPALIVE_SECONDS = float(os.getenv("LLM_HTTP_KEEPALIVE_SECONDS", 60))  # 空闲连接保持秒数
+LLM_REQUEST_TIMEOUT = float(os.getenv("LLM_REQUEST_TIMEOUT", 120))
+AGENT_POOL_MAX_DATASETS = int(os.getenv("AGENT_POOL_MAX_DATASETS", 16))     # 缓存执行器的数据集数量上限
+AGENT_POOL_MAX_PER_DATASET = int(os.getenv("AGENT_POOL_MAX_PER_DATASET", 2))  # 每个数据集保留的空闲执行器数
+
+_llm = None
+_llm_lock = threading.Lock()
+_semaphore: Optional[asyncio.Semaphore] = None
+_semaphore_loop = None
+_stats = {"calls": 0, "waits": 0, "wait_time": 0.0, "in_flight": 0}
+
+
+def _http_limits() -> httpx.Limits:
+    return httpx.Limits(max_connections=LLM_HTTP_MAX_CONNECTIONS,
+                        max_keepalive_connections=LLM_HTTP_MAX_CONNECTIONS,
+                        keepalive_expiry=LLM_HTTP_KEEPALIVE_SECONDS)
+
+
+def get_llm():
+    """返回进程内共享的 ChatOpenAI 实例（首次调用时创建）。"""
+    global _llm
+    if _llm is None:
+        with _llm_lock:
+            if _llm is None:
+                from langchain_openai import ChatOpenAI
+                timeout = httpx.Timeout(LLM_REQUEST_TIMEOUT, connect=10)
+                _llm = ChatOpenAI(
+                    model=LLM_MODEL,
+                    temperature=0.1,
+                    api_key=API_KEY,
+                    base_url=ENDPOINT,
+                    timeout=LLM_REQUEST_TIMEOUT,
+                    http_client=httpx.Client(limits=_http_limits(), timeout=timeout,
+                                             event_hooks=httpx_event_hooks("llm")),
+                    http_async_client=httpx.AsyncClient(limits=_http_limits(), timeout=timeout,
+                                                        event_hooks=httpx_event_hooks("llm", asynchronous=True)),
+                )
+    return _llm
+
+
+def _get_semaphore() -> asyncio.Semaphore:
+    global _semaphore, _semaphore_loop
+    loop = asyncio.get_running_loop()
+    if _semaphore is None or _semaphore_loop is not loop:
+        _semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+        _semaphore_loop = loop
+    return _semaphore
+
+
+@asynccontextmanager
+async def llm_slot():
+    """占用一个 LLM 并发名额，名额用完时排队等待。"""
+    semaphore = _get_semaphore()
+    started = time.perf_counter()
+    if semaphore.locked():
+        _stats["waits"] += 1
+    async with semaphore:
+        _stats["wait_time"] += time.perf_counter() - started
+        _stats["calls"] += 1
+        _stats["in_flight"] += 1
+        try:
+            yield
+        finally:
+            _stats["in_flight"] -= 1
+
+
+class AgentPool:
+    """按数据集句柄缓存空闲的 Agent 执行器，数据集数量超过上限时淘汰最久未使用的。"""
+
+    def __init__(self, max_datasets: int, max_per_dataset: int):
+        self.max_datasets = max_datasets
+        self.max_per_dataset = max_per_dataset
+        self._idle: "OrderedDict[str, List[Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"created": 0, "reused": 0, "evicted": 0}
+
+    def acquire(self, handle: str, factory: Callable[[], Any]):
+        """借出一个执行器；没有空闲执行器时调用 factory 创建。"""
+        with self._lock:
+            idle = self._idle.get(handle)
+            executor = idle.pop() if idle else None
+            if executor is not None:
+                self._idle.move_to_end(handle)
+                self._stats["reused"] += 1
+        if executor is None:
+            executor = factory()
+            with self._lock:
+                self._stats["created"] += 1
+        return executor
+
+    def release(self, handle: str, executor):
+        """归还执行器，调用方应先解除其与本次调用的数据和会话的绑定。"""
+        with self._lock:
+            idle = self._idle.setdefault(handle, [])
+            self._idle.move_to_end(handle)
+            if len(idle) < self.max_per_dataset:
+                idle.append(executor)
+            while len(self._idle) > self.max_datasets:
+                self._idle.popitem(last=False)
+                self._stats["evicted"] += 1
+
+    def discard(self, handle: str):
+        with self._lock:
+            self._idle.pop(handle, None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._stats, datasets=len(self._idle),
+                        idle_executors=sum(len(v) for v in self._idle.values()))
+
+
+agent_pool = AgentPool(AGENT_POOL_MAX_DATASETS, AGENT_POOL_MAX_PER_DATASET)
+
+
+def llm_stats() -> Dict[str, Any]:
+    return dict(_stats, wait_time=round(_stats["wait_time"], 3), max_concurrency=LLM_MAX_CONCURRENCY,
+                agent_pool=agent_pool.stats())
@@ -0,0 +1,240 @@
+"""
+RAGFlow 文档解析任务跟踪。
+
+触发解析后为每批文档创建一个任务（job），在后台协程中轮询解析状态，调用方可以等待任务完成并接收进度，
+也可以立即拿到 job_id 之后再查询：
+- 每轮只发起一次批量查询：待解析文档较少时按 ID 并发查询，较多时按 update_time 倒序分页列出数据集文档，
+  找齐所有待解析文档即停止翻页；翻页期间因 update_time 变化而漏掉的文档再按 ID 查询，确认不存在才标记为失败。
+- 轮询间隔从 PARSE_POLL_INITIAL_INTERVAL 开始，状态没有变化时按 PARSE_POLL_BACKOFF 倍增，
+  最长 PARSE_POLL_MAX_INTERVAL；有文档状态变化时恢复为初始间隔。
+- 任务最长跟踪 PARSE_JOB_MAX_SECONDS 秒；结束的任务保留 PARSE_JOB_RETENTION 秒供查询。
+"""
+import asyncio
+import os
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import httpx
+from dotenv import load_dotenv
+
+from logger import logger
+from tools._ragflow import RAGFlowError, ragflow
+from tools._retrieval_cache import invalidate_dataset
+
+load_dotenv()
+
+PARSE_POLL_INITIAL_INTERVAL = float(os.getenv("PARSE_POLL_INITIAL_INTERVAL", 1))   # 初始轮询间隔秒数
+PARSE_POLL_MAX_INTERVAL = float(os.getenv("PARSE_POLL_MAX_INTERVAL", 15))          # 最长轮询间隔秒数
+PARSE_POLL_BACKOFF = float(os.getenv("PARSE_POLL_BACKOFF", 1.5))                   # 状态无变化时间隔的增长倍数
+PARSE_POLL_PAGE_SIZE = int(os.getenv("PARSE_POLL_PAGE_SIZE", 100))                 # 分页列出文档时的每页数量
+PARSE_JOB_MAX_SECONDS = float(os.getenv("PARSE_JOB_MAX_SECONDS", 3600))            # 单个任务的最长跟踪秒数
+PARSE_JOB_RETENTION = float(os.getenv("PARSE_JOB_RETENTION", 3600))                # 结束的任务保留秒数
+
+_TERMINAL = {"DONE", "FAIL", "CANCEL"}
+_BY_ID_THRESHOLD = 3       # 待解析文档不超过该数量时按 ID 查询，否则分页列出
+_MAX_POLL_ERRORS = 5       # 连续轮询失败次数上限
+_MAX_JOBS = 500
+
+
+class ParseJob:
+    def __init__(self, dataset_id: str, document_ids: List[str]):
+        self.job_id = f"parse_{uuid.uuid4().hex[:16]}"
+        self.dataset_id = dataset_id
+        self.document_ids = list(document_ids)
+        self.documents: Dict[str, Dict[str, Any]] = {
+            doc_id: {"run": "UNSTART", "progress": 0.0, "message": ""} for doc_id in self.document_ids
+        }
+        self.state = "running"          # running / success / failed / timeout / error
+        self.error: Optional[str] = None
+        self.polls = 0
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+
+    @property
+    def done(self) -> bool:
+        return self.state != "running"
+
+    def pending(self) -> List[str]:
+        return [doc_id for doc_id, doc in self.documents.items() if doc["run"] not in _TERMINAL]
+
+    def progress(self) -> float:
+        return sum(1.0 if doc["run"] in _TERMINAL else doc["progress"] for doc in self.documents.values())
+
+    def _notify(self):
+        # 替换事件而不是 clear，保证每个等待方都能收到这次变化
+        event, self._changed = self._changed, asyncio.Event()
+        event.set()
+
+    def _finish(self, state: str, error: Optional[str] = None):
+        self.state = state
+        self.error = error
+        self.finished_at = time.time()
+        self._notify()
+
+    def snapshot(self) -> Dict[str, Any]:
+        counts: Dict[str, int] = {}
+        for doc in self.documents.values():
+            counts[doc["run"]] = counts.get(doc["run"], 0) + 1
+        end = self.finished_at or time.time()
+        return {
+            "job_id": self.job_id,
+            "dataset_id": self.dataset_id,
+            "state": self.state,
+            "error": self.error,
+            "progress": round(self.progress() / max(len(self.documents), 1), 4),
+            "status_counts": counts,
+            "documents": {doc_id: dict(doc) for doc_id, doc in self.documents.items()},
+            "polls": self.polls,
+            "elapsed_seconds": round(end - self.created_at, 1),
+        }
+
+
+class ParseTracker:
+    def __init__(self):
+        self._jobs: "OrderedDict[str, ParseJob]" = OrderedDict()
+        self._stats = {"jobs": 0, "polls": 0, "poll_errors": 0}
+
+    async def start(self, dataset_id: str, document_ids: List[str]) -> ParseJob:
+        """触发解析并在后台开始跟踪，返回任务对象。触发失败时抛出异常。"""
+        await ragflow.parse_documents(dataset_id, document_ids)
+        # 文档重新解析后分块会变化，该数据集已缓存的检索结果作废
+        invalidate_dataset(dataset_id)
+        logger.info(f"Parsing triggered for documents: {document_ids}")
+        job = ParseJob(dataset_id, document_ids)
+        self._prune()
+        self._jobs[job.job_id] = job
+        self._stats["jobs"] += 1
+        job.task = asyncio.get_running_loop().create_task(self._track(job))
+        return job
+
+    def get(self, job_id: str) -> Optional[ParseJob]:
+        return self._jobs.get(job_id)
+
+    async def wait(self, job: ParseJob, timeout: float,
+                   on_progress: Optional[Callable[[ParseJob], Awaitable[None]]] = None) -> bool:
+        """等待任务结束，最多 timeout 秒；每次状态变化时调用 on_progress。返回任务是否已结束。"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while not job.done:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return False
+            try:
+                await asyncio.wait_for(job._changed.wait(), remaining)
+            except asyncio.TimeoutError:
+                return job.done
+            if on_progress is not None:
+                try:
+                    await on_progress(job)
+                except Exception as e:
+                    logger.debug(f"发送解析进度失败: {e}")
+        return True
+
+    async def _poll(self, dataset_id: str, pending: List[str]) -> Dict[str, Dict[str, Any]]:
+        """
+        批量查询待解析文档的状态，返回 {文档ID: 文档信息}。不在结果中的文档已经按 ID 确认不存在：
+        分页列出时解析中的文档会因 update_time 更新在页之间移动而被漏掉，这些文档再按 ID 单独查询一次。
+        """
+        if len(pending) <= _BY_ID_THRESHOLD:
+            return await self._poll_by_id(dataset_id, pending)
+        wanted, found, page = set(pending), {}, 1
+        while wanted - found.keys():
+            data = await ragflow.list_documents(dataset_id, page=page, page_size=PARSE_POLL_PAGE_SIZE,
+                                                orderby="update_time", desc=True)
+            self._stats["polls"] += 1
+            docs = data.get("docs") or []
+            found.update((doc["id"], doc) for doc in docs if doc.get("id") in wanted)
+            if len(docs) < PARSE_POLL_PAGE_SIZE:
+                break
+            page += 1
+        missed = [doc_id for doc_id in pending if doc_id not in found]
+        if missed:
+            found.update(await self._poll_by_id(dataset_id, missed))
+        return found
+
+    async def _poll_by_id(self, dataset_id: str, document_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        pages = await asyncio.gather(*(ragflow.list_documents(dataset_id, id=doc_id) for doc_id in document_ids))
+        self._stats["polls"] += len(document_ids)
+        return {doc["id"]: doc for page in pages for doc in page.get("docs") or []}
+
+    async def _track(self, job: ParseJob):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + PARSE_JOB_MAX_SECONDS
+        interval = PARSE_POLL_INITIAL_INTERVAL
+        errors = 0
+        try:
+            while True:
+                await asyncio.sleep(interval)
+                pending = job.pending()
+                try:
+                    statuses = await self._poll(job.dataset_id, pending)
+                    errors = 0
+                except (httpx.HTTPError, RAGFlowError) as e:
+                    errors += 1
+                    self._stats["poll_errors"] += 1
+                    logger.warning(f"查询解析状态失败（第 {errors} 次）: {e}")
+                    if errors >= _MAX_POLL_ERRORS:
+                        job._finish("error", f"查询解析状态连续失败 {errors} 次: {e}")
+                        return
+                    interval = min(interval * PARSE_POLL_BACKOFF, PARSE_POLL_MAX_INTERVAL)
+                    continue
+                job.polls += 1
+
+                changed = finished = False
+                for doc_id in pending:
+                    doc = statuses.get(doc_id)
+                    if doc is None:  # _poll 已按 ID 确认文档不存在
+                        update = {"run": "FAIL", "progress": 0.0, "message": "文档不存在"}
+                    else:
+                        update = {"run": doc.get("run") or "UNSTART", "progress": float(doc.get("progress") or 0.0),
+                                  "message": doc.get("progress_msg") or ""}
+                    if update != job.documents[doc_id]:
+                        changed = True
+                        finished = finished or update["run"] in _TERMINAL
+                        job.documents[doc_id] = update
+                if finished:
+                    invalidate_dataset(job.dataset_id)
+
+                if not job.pending():
+                    failed = [d for d, doc in job.documents.items() if doc["run"] != "DONE"]
+                    if failed:
+                        job._finish("failed", f"Document parsing failed for {failed}.")
+                    else:
+                        job._finish("success")
+                    logger.success(f"解析任务 {job.job_id} 结束: {job.state}，轮询 {job.polls} 次")
+                    return
+                if loop.time() >= deadline:
+                    job._finish("timeout", f"Document parsing exceeded time limit: {PARSE_JOB_MAX_SECONDS:.0f} s.")
+                    return
+                if changed:
+                    job._notify()
+                    interval = PARSE_POLL_INITIAL_INTERVAL
+                else:
+                    interval = min(interval * PARSE_POLL_BACKOFF, PARSE_POLL_MAX_INTERVAL)
+        except asyncio.CancelledError:
+            job._finish("error", "任务已取消")
+            raise
+        except Exception as e:
+            logger.error(f"解析任务 {job.job_id} 异常: {e}")
+            job._finish("error", str(e))
+
+    def _prune(self):
+        now = time.time()
+        for job_id, job in list(self._jobs.items()):
+            if job.done and now - job.finished_at > PARSE_JOB_RETENTION:
+                del self._jobs[job_id]
+        while len(self._jobs) >= _MAX_JOBS:
+            oldest = next((j for j in self._jobs.values() if j.done), None)
+            if oldest is None:
+                break
+            del self._jobs[oldest.job_id]
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(self._stats, active=sum(not j.done for j in self._jobs.values()), retained=len(self._jobs))
+
+
+parse_tracker = ParseTracker()
@@ -0,0 +1,103 @@
+"""
+只读查询结果缓存（可选开启）。
+
+以 (数据库名, 规范化后的 SQL 指纹) 为键缓存单页即可放下的完整结果。规范化会去掉普通注释、
+合并字符串字面量之外的空白和末尾分号，但保留大小写（Linux 上 MySQL 表名区分大小写），
+也保留 MySQL 会执行的 /*! */ 版本注释和 /*+ */ 优化器提示。
+包含 NOW()、RAND() 等非确定性函数、用户变量或加锁读的语句不会进入缓存。
+"""
+import hashlib
+import os
+import re
+from typing import Optional
+
+from dotenv import load_dotenv
+
+from tools._cache import TTLCache
+
+load_dotenv()
+
+QUERY_CACHE_ENABLED = os.getenv("QUERY_CACHE_ENABLED", "false").lower() in ("1", "true", "yes")
+QUERY_CACHE_MAX_BYTES = int(os.getenv("QUERY_CACHE_MAX_BYTES", 64 * 1024 * 1024))   # 缓存总容量（字节）
+QUERY_CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", 30))                          # 每个条目的有效秒数
+
+_NON_DETERMINISTIC = re.compile(
+    # 必须带括号调用的函数（避免误伤名为 user 等的表或字段）
+    r"\b(NOW|SYSDATE|CURDATE|CURTIME|UNIX_TIMESTAMP|RAND|RANDOM_BYTES|UUID|UUID_SHORT|CONNECTION_ID"
+    r"|LAST_INSERT_ID|FOUND_ROWS|ROW_COUNT|USER|SESSION_USER|SYSTEM_USER|SLEEP|BENCHMARK"
+    r"|GET_LOCK|RELEASE_LOCK|IS_FREE_LOCK|IS_USED_LOCK)\s*\("
+    # 可以不带括号使用的关键字
+    r"|\b(CURRENT_DATE|CURRENT_TIME|CURRENT_TIMESTAMP|LOCALTIME|LOCALTIMESTAMP|CURRENT_USER"
+    r"|UTC_DATE|UTC_TIME|UTC_TIMESTAMP)\b"
+    r"|@"
+    r"|\bFOR\s+(UPDATE|SHARE)\b|\bLOCK\s+IN\s+SHARE\s+MODE\b",
+    re.IGNORECASE,
+)
+
+query_cache = TTLCache(QUERY_CACHE_MAX_BYTES, QUERY_CACHE_TTL, name="query_cache")
+
+
+def normalize_sql(sql: str) -> str:
+    """去掉注释、合并字面量之外的空白、去掉末尾分号。字符串、反引号标识符以及 /*! */、/*+ */ 注释保持原样。"""
+    out = []
+    i, n = 0, len(sql)
+    pending_space = False
+    while i < n:
+        ch = sql[i]
+        if ch in ("'", '"', "`"):
+            j = i + 1
+            while j < n:
+                if sql[j] == "\\" and ch != "`":
+                    j += 2
+                    continue
+                if sql[j] == ch:
+                    if j + 1 < n and sql[j + 1] == ch:  # 连写两个引号表示转义
+                        j += 2
+                        continue
+                    break
+                j += 1
+            token = sql[i:j + 1]
+            i = j + 1
+        elif sql.startswith("/*", i):
+            end = sql.find("*/", i + 2)
+            end = n if end < 0 else end + 2
+            if sql[i + 2:i + 3] in ("!", "+"):
+                # /*! ... */ 会被 MySQL 当作语句执行，/*+ ... */ 是优化器提示，都会影响结果或执行方式，原样保留
+                token = sql[i:end]
+                i = end
+            else:
+                i = end
+                pending_space = True
+                continue
+        elif sql.startswith("--", i) and (i + 2 >= n or sql[i + 2].isspace()) or ch == "#":
+            end = sql.find("\n", i)
+            i = n if end < 0 else end + 1
+            pending_space = True
+            continue
+        elif ch.isspace():
+            pending_space = True
+            i += 1
+            continue
+        else:
+            token = ch
+            i += 1
+        if pending_space and out:
+            out.append(" ")
+        pending_space = False
+        out.append(token)
+    return "".join(out).rstrip("; ")
+
+
+def _strip_literals(normalized_sql: str) -> str:
+    return re.sub(r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.|\"\")*\"|`(?:[^`]|``)*`", "''", normalized_sql)
+
+
+def cache_key(db_name: str, query: str) -> Optional[str]:
+    """返回缓存键；语句不适合缓存时返回 None。"""
+    normalized = normalize_sql(query)
+    if not re.match(r"^\(*\s*(SELECT|WITH)\b", normalized, re.IGNORECASE):
+        return None
+    if _NON_DETERMINISTIC.search(_strip_literals(normalized)):
+        return None
+    digest = hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+    return f"{db_name}:{digest}"
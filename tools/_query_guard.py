@@ -0,0 +1,194 @@
+"""
+只读查询的代价守卫。
+
+- 执行前对 SELECT / WITH 语句做一次 EXPLAIN，按计划估算扫描行数，超过 QUERY_MAX_ESTIMATED_ROWS
+  时拒绝（reject）或以更短的执行时间上限放行（cap）。拒绝信息是结构化的，包含计划摘要和改写建议。
+- 为顶层 SELECT 注入 MAX_EXECUTION_TIME 优化器提示，由 MySQL 服务端自行中止超时语句；
+  语句中自带的该提示会被替换，只能收紧上限。
+- EXPLAIN、每次执行/读取都有客户端截止时间，超时后通过独立连接发送 KILL QUERY。
+  MCP 请求被取消时的 KILL QUERY 由 _db_pool.run_db_task 负责。
+"""
+import json
+import os
+import re
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+import pymysql
+from loguru import logger
+from dotenv import load_dotenv
+
+from tools._db_pool import kill_query
+
+load_dotenv()
+
+QUERY_GUARD_ENABLED = os.getenv("QUERY_GUARD_ENABLED", "true").lower() in ("1", "true", "yes")
+QUERY_MAX_ESTIMATED_ROWS = int(os.getenv("QUERY_MAX_ESTIMATED_ROWS", 5_000_000))     # EXPLAIN 估算行数上限
+QUERY_GUARD_ACTION = os.getenv("QUERY_GUARD_ACTION", "reject").lower()                # 超限时 reject 或 cap
+QUERY_MAX_EXECUTION_MS = int(os.getenv("QUERY_MAX_EXECUTION_MS", 30_000))             # 服务端 MAX_EXECUTION_TIME
+QUERY_CAPPED_EXECUTION_MS = int(os.getenv("QUERY_CAPPED_EXECUTION_MS", 5_000))        # cap 模式下的执行时间上限
+QUERY_DEADLINE_SECONDS = float(os.getenv("QUERY_DEADLINE_SECONDS", 60))               # 客户端截止时间
+
+# MySQL 因 MAX_EXECUTION_TIME 或 KILL QUERY 中止语句时的错误码
+_ER_QUERY_TIMEOUT = 3024
+_ER_QUERY_INTERRUPTED = 1317
+
+
+class QueryGuardError(Exception):
+    """守卫拦截或中止了查询。details 是返回给调用方的结构化信息。"""
+
+    def __init__(self, details: Dict[str, Any]):
+        super().__init__(details.get("message", ""))
+        self.details = details
+
+    def to_json(self) -> str:
+        return json.dumps(self.details, ensure_ascii=False, indent=2, default=str)
+
+
+class QueryRejectedError(QueryGuardError):
+    pass
+
+
+class QueryTimeoutError(QueryGuardError):
+    pass
+
+
+def is_guarded(query: str) -> bool:
+    return re.match(r"^\s*(\(\s*)*(SELECT|WITH)\b", query, re.IGNORECASE) is not None
+
+
+_HINT_COMMENT = re.compile(r"/\*\+(.*?)\*/", re.DOTALL)
+_EXECUTION_TIME_HINT = re.compile(r"\bMAX_EXECUTION_TIME\s*\(\s*(\d+)\s*\)", re.IGNORECASE)
+
+
+def with_execution_hint(query: str, max_ms: int) -> str:
+    """
+    在顶层 SELECT 后插入 MAX_EXECUTION_TIME 提示。调用方自带的 MAX_EXECUTION_TIME 提示会被移除，
+    其值只能收紧上限（取两者较小值），不能放宽；不是 SELECT 开头（如 WITH）时只移除自带提示，由客户端截止时间兜底。
+    """
+    if max_ms <= 0:
+        return query
+    limit = int(max_ms)
+
+    def strip_hint(match: re.Match) -> str:
+        nonlocal limit
+        for value in _EXECUTION_TIME_HINT.findall(match.group(1)):
+            if int(value) > 0:  # MAX_EXECUTION_TIME(0) 表示不限时，不能用来放宽上限
+                limit = min(limit, int(value))
+        body = _EXECUTION_TIME_HINT.sub("", match.group(1))
+        return f"/*+{body}*/" if body.strip() else ""
+
+    query = _HINT_COMMENT.sub(strip_hint, query)
+    # 一个查询块只认紧跟 SELECT 的第一段提示注释，已有其他提示时并入同一段
+    query, merged = re.subn(r"^(\s*(?:\(\s*)*)SELECT\s*/\*\+", rf"\1SELECT /*+ MAX_EXECUTION_TIME({limit})", query,
+                            count=1, flags=re.IGNORECASE)
+    if merged:
+        return query
+    return re.sub(r"^(\s*(?:\(\s*)*)SELECT\b", rf"\1SELECT /*+ MAX_EXECUTION_TIME({limit}) */", query,
+                  count=1, flags=re.IGNORECASE)
+
+
+def _estimate(plan: List[Dict[str, Any]]) -> int:
+    """同一 id 的计划行按嵌套循环相乘（rows * filtered%），不同 id 相加。"""
+    groups: Dict[Any, float] = {}
+    for step in plan:
+        rows = float(step.get("rows") or 1)
+        filtered = float(step.get("filtered") or 100) / 100
+        groups[step.get("id")] = groups.get(step.get("id"), 1.0) * max(rows * filtered, 1.0)
+    return int(sum(groups.values())) if groups else 0
+
+
+def _suggestions(query: str, plan: List[Dict[str, Any]]) -> List[str]:
+    tips = []
+    for step in plan:
+        table = step.get("table")
+        extra = step.get("Extra") or ""
+        if step.get("type") == "ALL":
+            if step.get("possible_keys"):
+                tips.append(f"表 {table} 为全表扫描，可在 WHERE 中使用可用索引列: {step['possible_keys']}。")
+            else:
+                tips.append(f"表 {table} 为全表扫描且没有可用索引，请增加对索引列的过滤条件。")
+        if "join buffer" in extra.lower():
+            tips.append(f"表 {table} 的连接条件没有使用索引，请检查 JOIN ... ON 是否遗漏或使用了非索引列。")
+        if "filesort" in extra.lower() and "temporary" in extra.lower():
+            tips.append(f"表 {table} 需要临时表加文件排序，考虑减少 GROUP BY / ORDER BY 的列或先缩小范围。")
+    if not re.search(r"\bLIMIT\b", query, re.IGNORECASE):
+        tips.append("添加 LIMIT 限制返回行数。")
+    return list(dict.fromkeys(tips))
+
+
+def preflight(conn, query: str) -> Optional[int]:
+    """
+    对查询做 EXPLAIN，返回应使用的 MAX_EXECUTION_TIME（毫秒）；超过估算行数上限且为 reject 模式时抛出 QueryRejectedError。
+    不受守卫的语句（SHOW / DESCRIBE / EXPLAIN 等）返回 None。
+    """
+    if not QUERY_GUARD_ENABLED or not is_guarded(query):
+        return None
+    # 调用方应在 deadline() 内调用，EXPLAIN 本身（如派生表需要物化时）也可能很慢
+    with conn.cursor() as cursor:
+        cursor.execute("EXPLAIN " + query)
+        plan = cursor.fetchall()
+    estimated = _estimate(plan)
+    if estimated <= QUERY_MAX_ESTIMATED_ROWS:
+        return QUERY_MAX_EXECUTION_MS
+    summary = [
+        {k: step.get(k) for k in ("id", "table", "type", "possible_keys", "key", "rows", "filtered", "Extra")}
+        for step in plan[:20]
+    ]
+    if QUERY_GUARD_ACTION == "cap":
+        logger.warning(f"查询估算扫描 {estimated} 行，超过上限 {QUERY_MAX_ESTIMATED_ROWS}，"
+                       f"以 {QUERY_CAPPED_EXECUTION_MS}ms 执行时间上限放行。")
+        return QUERY_CAPPED_EXECUTION_MS
+    raise QueryRejectedError({
+        "status": "rejected",
+        "reason": "estimated_rows_exceeded",
+        "message": f"查询预计扫描约 {estimated} 行，超过上限 {QUERY_MAX_ESTIMATED_ROWS} 行，已拒绝执行。请按建议改写查询。",
+        "estimated_rows": estimated,
+        "max_estimated_rows": QUERY_MAX_ESTIMATED_ROWS,
+        "plan": summary,
+        "suggestions": _suggestions(query, plan),
+    })
+
+
+def _timeout_error(reason: str, message: str) -> QueryTimeoutError:
+    return QueryTimeoutError({
+        "status": "timeout",
+        "reason": reason,
+        "message": message,
+        "deadline_seconds": QUERY_DEADLINE_SECONDS,
+        "max_execution_ms": QUERY_MAX_EXECUTION_MS,
+        "suggestions": ["缩小查询范围（增加索引列上的过滤条件或 LIMIT），或先用聚合查询确认数据量。"],
+    })
+
+
+@contextmanager
+def deadline(conn, seconds: float = QUERY_DEADLINE_SECONDS):
+    """在 seconds 秒内未完成时对该连接发送 KILL QUERY，并把中断错误转换为 QueryTimeoutError。"""
+    fired = threading.Event()
+    timer = None
+    if seconds > 0:
+        thread_id = conn.thread_id()
+
+        def on_timeout():
+            fired.set()
+            logger.warning(f"查询超过客户端截止时间 {seconds}s，发送 KILL QUERY {thread_id}")
+            kill_query(thread_id)
+
+        timer = threading.Timer(seconds, on_timeout)
+        timer.daemon = True
+        timer.start()
+    try:
+        yield
+    except pymysql.err.MySQLError as e:
+        code = e.args[0] if e.args else None
+        if fired.is_set():
+            raise _timeout_error("deadline_exceeded", f"查询超过 {seconds}s 截止时间，已在服务端中止。") from e
+        if code == _ER_QUERY_TIMEOUT:
+            raise _timeout_error("max_execution_time_exceeded", "查询超过服务端 MAX_EXECUTION_TIME 上限，已被中止。") from e
+        if code == _ER_QUERY_INTERRUPTED:
+            raise _timeout_error("interrupted", "查询已在服务端被中止。") from e
+        raise
+    finally:
+        if timer is not None:
+            timer.cancel()
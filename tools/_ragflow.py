@@ -0,0 +1,82 @@
+"""
+异步的 RAGFlow HTTP API 访问层。
+
+ragflow_sdk 基于 requests 同步调用，在工具中直接使用会阻塞事件循环：一个慢的 RAGFlow 请求会拖住整个 MCP 服务。
+这里改为通过共享的 HTTP 访问层（tools._http）直接调用 RAGFlow 的 REST API，连接池、超时和重试策略与其他上游一致；
+单个请求的总超时为 RAGFLOW_TIMEOUT。RAGFlow 以 HTTP 200 + 非零 code 表示业务错误，此时抛出 RAGFlowError。
+"""
+import os
+from typing import Any, Dict, List
+
+import httpx
+from dotenv import load_dotenv
+
+from tools import _http
+
+load_dotenv()
+
+RAGFLOW_BASE_URL = os.getenv("RAGFLOW_BASE_URL", "http://localhost:8000")
+RAGFLOW_API_KEY = os.getenv("RAGFLOW_API_KEY", "YOUR_API_KEY_HERE")
+RAGFLOW_TIMEOUT = float(os.getenv("RAGFLOW_TIMEOUT", 30))     # 单个请求的超时秒数（检索较慢时调大）
+
+_http.register_upstream(RAGFLOW_BASE_URL, "ragflow")
+
+
+class RAGFlowError(Exception):
+    """RAGFlow 返回了非零的业务错误码。"""
+
+    def __init__(self, message: str, code: Any = None):
+        super().__init__(message)
+        self.code = code
+
+
+class AsyncRAGFlow:
+    """RAGFlow REST API 的异步客户端。"""
+
+    def __init__(self, base_url: str, api_key: str):
+        self.base_url = base_url.rstrip("/")
+        self.api_url = f"{self.base_url}/api/v1"
+        self.headers = {"Authorization": f"Bearer {api_key}"}
+
+    async def request(self, method: str, path: str, idempotent: bool = True, **kwargs) -> httpx.Response:
+        """path 为 /api/v1 下的相对路径，也可以是完整 URL。最终失败时抛出 httpx 异常。"""
+        url = path if path.startswith(("http://", "https://")) else self.api_url + path
+        kwargs.setdefault("timeout", httpx.Timeout(RAGFLOW_TIMEOUT, connect=_http.HTTP_CONNECT_TIMEOUT))
+        return await _http.request(method, url, idempotent=idempotent, headers=self.headers, **kwargs)
+
+    async def call(self, method: str, path: str, idempotent: bool = True, **kwargs) -> Any:
+        """发送请求并返回响应中的 data 字段；code 非零时抛出 RAGFlowError。"""
+        response = await self.request(method, path, idempotent=idempotent, **kwargs)
+        body = response.json()
+        if body.get("code") != 0:
+            raise RAGFlowError(body.get("message") or f"RAGFlow 返回错误码 {body.get('code')}", body.get("code"))
+        return body.get("data")
+
+    @staticmethod
+    def _params(params: Dict[str, Any]) -> Dict[str, Any]:
+        return {k: (str(v).lower() if isinstance(v, bool) else v) for k, v in params.items() if v is not None}
+
+    async def retrieve(self, question: str, dataset_ids: List[str], **options) -> List[Dict[str, Any]]:
+        """检索分块，返回 chunks 列表（每个分块为 RAGFlow 返回的字典）。options 对应 /retrieval 的其余参数。"""
+        payload = dict(options, question=question, dataset_ids=list(dataset_ids))
+        data = await self.call("POST", "/retrieval", json=payload)
+        return (data or {}).get("chunks") or []
+
+    async def list_datasets(self, **params) -> List[Dict[str, Any]]:
+        return await self.call("GET", "/datasets", params=self._params(params)) or []
+
+    async def list_documents(self, dataset_id: str, **params) -> Dict[str, Any]:
+        """返回 {"docs": [...], "total": n}。"""
+        return await self.call("GET", f"/datasets/{dataset_id}/documents", params=self._params(params)) or {}
+
+    async def upload_document(self, dataset_id: str, filename: str, content: bytes) -> List[Dict[str, Any]]:
+        """上传文件内容到数据集，返回新建的文档列表。"""
+        return await self.call("POST", f"/datasets/{dataset_id}/documents", idempotent=False,
+                               files={"file": (filename, content)}) or []
+
+    async def parse_documents(self, dataset_id: str, document_ids: List[str]):
+        await self.call("POST", f"/datasets/{dataset_id}/chunks", idempotent=False,
+                        json={"document_ids": list(document_ids)})
+
+
+ragflow = AsyncRAGFlow(RAGFLOW_BASE_URL, RAGFLOW_API_KEY)
@@ -0,0 +1,210 @@
+"""
+查询结果的编码与解码。
+
+run_readonly_query_in_database 可以按以下格式输出结果：
+- json：行字典列表（原有格式）
+- columnar：{"columns": [...], "rows": [[...], ...]}，列名只出现一次，紧凑 JSON
+- csv：带表头的 CSV 文本
+- arrow：Arrow IPC 流的 base64 文本，保留 Decimal / 时间 / 二进制等原始类型
+
+json_to_markdown_table 和 analyze_csv_content 通过 iter_table / decode_table 直接接受以上任意格式。
+"""
+import base64
+import csv
+import datetime
+import decimal
+import io
+import json
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+FORMATS = ("json", "columnar", "csv", "arrow")
+
+# Arrow IPC 流以 0xFFFFFFFF 续传标记开头，base64 后固定为 "/////"
+_ARROW_B64_PREFIX = "/////"
+
+
+class ResultFormatError(ValueError):
+    """不支持的格式，或无法解析的输入。"""
+
+
+def to_jsonable(value: Any) -> Any:
+    """把 MySQL 返回的值转换为 JSON/CSV 可表示的值。"""
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    if isinstance(value, decimal.Decimal):
+        # 能精确表示时输出数字，否则保留字符串以免丢失精度
+        if value == value.to_integral_value() and abs(value) < 2 ** 53:
+            return int(value)
+        as_float = float(value)
+        return as_float if decimal.Decimal(repr(as_float)) == value else str(value)
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, datetime.timedelta):
+        return str(value)
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        raw = bytes(value)
+        try:
+            return raw.decode("utf-8")
+        except UnicodeDecodeError:
+            return "base64:" + base64.b64encode(raw).decode("ascii")
+    if isinstance(value, set):
+        return ",".join(sorted(str(v) for v in value))  # MySQL SET 类型
+    return str(value)
+
+
+def _json_default(value: Any) -> Any:
+    return to_jsonable(value)
+
+
+def _arrow_table(columns: Sequence[str], rows: List[Dict[str, Any]]):
+    try:
+        import pyarrow as pa
+    except ImportError as e:
+        raise ResultFormatError("arrow 格式需要安装 pyarrow。") from e
+    arrays = []
+    for name in columns:
+        values = [row.get(name) for row in rows]
+        try:
+            arrays.append(pa.array(values))
+        except (pa.ArrowInvalid, pa.ArrowTypeError, TypeError, OverflowError):
+            # 同一列混合了多种类型时退化为字符串列
+            arrays.append(pa.array([None if v is None else str(to_jsonable(v)) for v in values], type=pa.string()))
+    return pa.Table.from_arrays(arrays, names=list(columns))
+
+
+def _arrow_b64(columns: Sequence[str], rows: List[Dict[str, Any]]) -> str:
+    import pyarrow as pa
+    table = _arrow_table(columns, rows)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return base64.b64encode(sink.getvalue().to_pybytes()).decode("ascii")
+
+
+def _csv_text(columns: Sequence[str], rows: List[Dict[str, Any]]) -> str:
+    buf = io.StringIO()
+    writer = csv.writer(buf, lineterminator="\n")
+    writer.writerow(columns)
+    for row in rows:
+        writer.writerow(["" if row.get(c) is None else to_jsonable(row.get(c)) for c in columns])
+    return buf.getvalue()
+
+
+def encode_rows(rows: List[Dict[str, Any]], columns: Sequence[str], fmt: str = "json") -> str:
+    """把一个完整结果编码为指定格式的字符串。"""
+    if fmt == "json":
+        return json.dumps(rows, ensure_ascii=False, indent=2, default=_json_default)
+    if fmt == "columnar":
+        payload = {"columns": list(columns), "rows": [[row.get(c) for c in columns] for row in rows]}
+        return json.dumps(payload, ensure_ascii=False, separators=(",", ":"), default=_json_default)
+    if fmt == "csv":
+        return _csv_text(columns, rows)
+    if fmt == "arrow":
+        return _arrow_b64(columns, rows)
+    raise ResultFormatError(f"不支持的格式: {fmt}，可选: {', '.join(FORMATS)}")
+
+
+def encode_page(rows: List[Dict[str, Any]], columns: Sequence[str], fmt: str, meta: Dict[str, Any]) -> str:
+    """编码分页结果：在 meta（has_more、cursor_id 等）之外附带本页数据。"""
+    page: Dict[str, Any] = {"format": fmt}
+    if fmt == "json":
+        page["rows"] = rows
+    elif fmt == "columnar":
+        page["columns"] = list(columns)
+        page["rows"] = [[row.get(c) for c in columns] for row in rows]
+    elif fmt == "csv":
+        page["data"] = _csv_text(columns, rows)
+    elif fmt == "arrow":
+        page["data"] = _arrow_b64(columns, rows)
+    else:
+        raise ResultFormatError(f"不支持的格式: {fmt}，可选: {', '.join(FORMATS)}")
+    page.update(meta)
+    if fmt == "json":
+        return json.dumps(page, ensure_ascii=False, indent=2, default=_json_default)
+    return json.dumps(page, ensure_ascii=False, separators=(",", ":"), default=_json_default)
+
+
+def detect_format(text: str) -> str:
+    stripped = text.lstrip()
+    if stripped.startswith(("[", "{")):
+        return "json"
+    if stripped.startswith(_ARROW_B64_PREFIX):
+        return "arrow"
+    return "csv"
+
+
+def _iter_arrow(data: str) -> Tuple[List[str], Iterator[List[Any]]]:
+    table = decode_arrow_table(data)
+
+    def rows():
+        for batch in table.to_batches():
+            for row in batch.to_pylist():
+                yield [to_jsonable(v) for v in row.values()]
+
+    return table.column_names, rows()
+
+
+def decode_arrow_table(data: str):
+    """把 base64 Arrow IPC 文本还原为 pyarrow.Table。"""
+    try:
+        import pyarrow as pa
+    except ImportError as e:
+        raise ResultFormatError("解析 arrow 格式需要安装 pyarrow。") from e
+    try:
+        raw = base64.b64decode(data.strip(), validate=True)
+        return pa.ipc.open_stream(raw).read_all()
+    except Exception as e:
+        raise ResultFormatError(f"无效的 Arrow 数据: {e}") from e
+
+
+def _iter_csv(data: str) -> Tuple[List[str], Iterator[List[Any]]]:
+    reader = csv.reader(io.StringIO(data))
+    return next(reader, []), reader
+
+
+def _iter_json_payload(payload: Any) -> Tuple[List[str], Iterator[List[Any]]]:
+    if isinstance(payload, list):
+        if not all(isinstance(row, dict) for row in payload):
+            raise ResultFormatError("JSON数据必须是字典列表。")
+        columns: List[str] = []
+        seen = set()
+        for row in payload:
+            for key in row:
+                if key not in seen:
+                    seen.add(key)
+                    columns.append(key)
+        return columns, ([row.get(c, "") for c in columns] for row in payload)
+    if isinstance(payload, dict):
+        fmt = payload.get("format")
+        if "data" in payload and fmt in ("csv", "arrow"):
+            return _iter_arrow(payload["data"]) if fmt == "arrow" else _iter_csv(payload["data"])
+        if "columns" in payload and isinstance(payload.get("rows"), list):
+            return list(payload["columns"]), (list(r) for r in payload["rows"])
+        if isinstance(payload.get("rows"), list):
+            return _iter_json_payload(payload["rows"])
+    raise ResultFormatError("无法识别的JSON结构，应为字典列表或 {\"columns\": [...], \"rows\": [...]}。")
+
+
+def iter_table(data: str, fmt: Optional[str] = "auto") -> Tuple[List[str], Iterator[List[Any]]]:
+    """
+    把任意支持的格式解析为 (columns, rows)，rows 是按列顺序排列的值列表的迭代器，逐行产生，
+    不会复制整份数据。fmt 为 auto 时根据内容自动识别。
+    """
+    fmt = detect_format(data) if not fmt or fmt == "auto" else fmt
+    if fmt in ("json", "columnar"):
+        try:
+            payload = json.loads(data)
+        except json.JSONDecodeError as e:
+            raise ResultFormatError(f"无效的JSON数据: {e}") from e
+        return _iter_json_payload(payload)
+    if fmt == "csv":
+        return _iter_csv(data)
+    if fmt == "arrow":
+        return _iter_arrow(data)
+    raise ResultFormatError(f"不支持的格式: {fmt}，可选: auto, {', '.join(FORMATS)}")
+
+
+def decode_table(data: str, fmt: Optional[str] = "auto") -> Tuple[List[str], List[List[Any]]]:
+    """与 iter_table 相同，但一次性返回全部行。"""
+    columns, rows = iter_table(data, fmt)
+    return columns, list(rows)
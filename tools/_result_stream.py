@@ -0,0 +1,199 @@
+"""
+只读查询的流式分页结果。
+
+查询使用服务端游标（SSDictCursor，不在客户端缓冲整个结果集）执行，每次只按行数/字节数上限
+读取一页。结果未读完时，游标和它占用的连接会保存在进程内的注册表中，并返回一个 cursor_id，
+调用方可以凭它继续读取下一页而无需重新执行查询。空闲超时或超出数量上限的游标会被关闭。
+执行和每次读取都受 _query_guard 的客户端截止时间约束。
+"""
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import pymysql
+from loguru import logger
+from dotenv import load_dotenv
+
+from tools._db_pool import acquire_connection, release_connection, track_connection
+from tools import _query_guard as query_guard
+
+load_dotenv()
+
+QUERY_PAGE_MAX_ROWS = int(os.getenv("QUERY_PAGE_MAX_ROWS", 500))                    # 每页默认最大行数
+QUERY_PAGE_MAX_BYTES = int(os.getenv("QUERY_PAGE_MAX_BYTES", 256 * 1024))           # 每页默认最大字节数
+QUERY_CURSOR_IDLE_TIMEOUT = float(os.getenv("QUERY_CURSOR_IDLE_TIMEOUT", 120))      # 游标空闲超过该秒数即关闭
+QUERY_MAX_OPEN_CURSORS = int(os.getenv("QUERY_MAX_OPEN_CURSORS", 8))                # 同时保留的游标上限
+
+
+def row_size(row: Dict[str, Any]) -> int:
+    """估算一行结果序列化后的字节数。"""
+    return len(json.dumps(row, ensure_ascii=False, default=str).encode("utf-8"))
+
+
+class QueryStream:
+    """一个正在读取中的服务端游标及其占用的连接。"""
+
+    def __init__(self, db_name: str, query: str, guard: bool = True):
+        self.db_name = db_name
+        self.query = query
+        self.rows_read = 0
+        self.last_page_bytes = 0
+        self.exhausted = False
+        self.last_used = time.monotonic()
+        self.lock = threading.Lock()
+        self._pending: Optional[Dict[str, Any]] = None  # 上一页因字节上限没放下的行
+        self.columns: List[str] = []
+        self._conn = acquire_connection(db_name)
+        try:
+            # EXPLAIN 预检与查询执行共用同一个客户端截止时间
+            with query_guard.deadline(self._conn):
+                max_execution_ms = query_guard.preflight(self._conn, query) if guard else None
+                if max_execution_ms:
+                    query = query_guard.with_execution_hint(query, max_execution_ms)
+                self._cursor = self._conn.cursor(pymysql.cursors.SSDictCursor)
+                self._cursor.execute(query)
+            # DictCursor 会把重名的列改名为 "表名.列名" 作为行字典的键（如 JOIN 两表的 id），
+            # 列名取这份改名后的 _fields，保证与行字典的键一一对应
+            self.columns = list(getattr(self._cursor, "_fields", None)
+                                or [col[0] for col in self._cursor.description or ()])
+        except Exception:
+            # 执行失败时没有待读取的结果集，连接本身仍可归还复用
+            self.exhausted = True
+            self.close()
+            raise
+
+    def fetch_page(self, max_rows: int = QUERY_PAGE_MAX_ROWS,
+                   max_bytes: int = QUERY_PAGE_MAX_BYTES) -> Tuple[List[Dict[str, Any]], bool]:
+        """读取一页，返回 (rows, has_more)。每页至少包含一行，即使该行本身超过字节上限。"""
+        track_connection(self._conn)
+        with query_guard.deadline(self._conn):
+            return self._fetch_page(max(1, max_rows), max_bytes)
+
+    def _fetch_page(self, max_rows: int, max_bytes: int) -> Tuple[List[Dict[str, Any]], bool]:
+        rows: List[Dict[str, Any]] = []
+        size = 0
+        self.last_used = time.monotonic()
+        while len(rows) < max_rows:
+            if self._pending is not None:
+                row, self._pending = self._pending, None
+            else:
+                row = self._cursor.fetchone()
+                if row is None:
+                    self.exhausted = True
+                    break
+            row_bytes = row_size(row)
+            if rows and size + row_bytes > max_bytes:
+                self._pending = row
+                break
+            rows.append(row)
+            size += row_bytes
+        self.rows_read += len(rows)
+        self.last_page_bytes = size
+        if self.exhausted:
+            self.close()
+            return rows, False
+        if self._pending is None:
+            # 恰好读满 max_rows 时再探测一行，避免返回一个实际上已经没有数据的续读句柄
+            self._pending = self._cursor.fetchone()
+            if self._pending is None:
+                self.exhausted = True
+                self.close()
+                return rows, False
+        return rows, True
+
+    def drain(self, limit: int) -> Tuple[int, bool]:
+        """
+        读取并丢弃剩余的行（最多 limit 行）用于计数，不保留任何数据，返回 (count, exhausted)。
+        未读完时调用方应随后 close()。
+        """
+        track_connection(self._conn)
+        count = 0
+        with query_guard.deadline(self._conn):
+            if self._pending is not None:
+                self._pending = None
+                count += 1
+            while not self.exhausted and count < limit:
+                if self._cursor.fetchone() is None:
+                    self.exhausted = True
+                    break
+                count += 1
+        self.rows_read += count
+        if self.exhausted:
+            self.close()
+        return count, self.exhausted
+
+    def close(self):
+        """释放游标和连接。未读完的结果集通过关闭连接来丢弃，避免逐行读完剩余数据。"""
+        conn, self._conn = self._conn, None
+        cursor, self._cursor = getattr(self, "_cursor", None), None
+        if conn is None:
+            return
+        if self.exhausted and cursor is not None:
+            try:
+                cursor.close()
+            except Exception:
+                pass
+        else:
+            try:
+                conn.close()
+            except Exception:
+                pass
+        release_connection(conn)
+
+
+_streams: "OrderedDict[str, QueryStream]" = OrderedDict()
+_streams_lock = threading.Lock()
+
+
+def _sweep(now: float) -> List[QueryStream]:
+    """取出所有空闲超时的游标（调用方持有锁，关闭操作在锁外进行）。"""
+    expired = [cid for cid, s in _streams.items() if now - s.last_used > QUERY_CURSOR_IDLE_TIMEOUT]
+    return [_streams.pop(cid) for cid in expired]
+
+
+def register(stream: QueryStream) -> str:
+    """保存一个未读完的游标，返回续读用的 cursor_id。"""
+    cursor_id = uuid.uuid4().hex
+    with _streams_lock:
+        to_close = _sweep(time.monotonic())
+        while len(_streams) >= QUERY_MAX_OPEN_CURSORS:
+            _, oldest = _streams.popitem(last=False)
+            to_close.append(oldest)
+        _streams[cursor_id] = stream
+    for old in to_close:
+        logger.info(f"关闭过期的查询游标: db='{old.db_name}', 已读取 {old.rows_read} 行")
+        with old.lock:
+            old.close()
+    return cursor_id
+
+
+def take(cursor_id: str) -> Optional[QueryStream]:
+    """按 cursor_id 取回游标；不存在或已过期时返回 None。"""
+    with _streams_lock:
+        to_close = _sweep(time.monotonic())
+        stream = _streams.get(cursor_id)
+        if stream is not None:
+            stream.last_used = time.monotonic()
+            _streams.move_to_end(cursor_id)
+    for old in to_close:
+        with old.lock:
+            old.close()
+    return stream
+
+
+def discard(cursor_id: str) -> bool:
+    with _streams_lock:
+        stream = _streams.pop(cursor_id, None)
+    if stream is None:
+        return False
+    with stream.lock:
+        stream.close()
+    return True
+
+
+def open_cursor_count() -> int:
+    return len(_streams)
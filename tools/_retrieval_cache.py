@@ -0,0 +1,86 @@
+"""
+知识库检索结果缓存。
+
+以 (规范化后的问题, 数据集 ID 列表, 检索参数) 为键缓存 RAGFlow 的检索结果，按 RETRIEVAL_CACHE_TTL 过期、
+按 RETRIEVAL_CACHE_MAX_BYTES 做 LRU 淘汰。并发的相同请求通过 AsyncSingleFlight 合并为一次上游调用。
+数据集中有文档重新解析时调用 invalidate_dataset：每个数据集有一个代数（generation），
+代数递增后旧的缓存条目不会再被命中，随后自然过期淘汰。
+"""
+import json
+import os
+import re
+import threading
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, Tuple
+
+from dotenv import load_dotenv
+
+from tools._cache import AsyncSingleFlight, TTLCache
+
+load_dotenv()
+
+RETRIEVAL_CACHE_ENABLED = os.getenv("RETRIEVAL_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+RETRIEVAL_CACHE_TTL = float(os.getenv("RETRIEVAL_CACHE_TTL", 300))                           # 缓存条目的有效秒数
+RETRIEVAL_CACHE_MAX_BYTES = int(os.getenv("RETRIEVAL_CACHE_MAX_BYTES", 32 * 1024 * 1024))   # 缓存总容量（字节）
+
+retrieval_cache = TTLCache(RETRIEVAL_CACHE_MAX_BYTES, RETRIEVAL_CACHE_TTL, name="retrieval")
+_flight = AsyncSingleFlight()
+_generations: Dict[str, int] = {}
+_generations_lock = threading.Lock()
+
+
+def normalize_query(query: str) -> str:
+    return re.sub(r"\s+", " ", query).strip()
+
+
+def _generation(dataset_id: str) -> int:
+    return _generations.get(dataset_id, 0)
+
+
+def invalidate_dataset(dataset_id: str):
+    """使某个数据集的全部检索缓存失效（文档重新解析后调用）。"""
+    with _generations_lock:
+        _generations[dataset_id] = _generations.get(dataset_id, 0) + 1
+
+
+def cache_key(query: str, dataset_ids: Iterable[str], **params) -> Hashable:
+    ids = tuple(sorted(set(dataset_ids)))
+    return (
+        normalize_query(query),
+        ids,
+        tuple(_generation(d) for d in ids),
+        tuple(sorted((k, repr(v)) for k, v in params.items())),
+    )
+
+
+def _result_size(result: Any) -> int:
+    return len(json.dumps(result, ensure_ascii=False, default=str).encode("utf-8"))
+
+
+async def cached_retrieve(query: str, dataset_ids: Iterable[str], fetch: Callable[[], Awaitable[Any]],
+                          cacheable: Callable[[Any], bool] = lambda result: True, **params) -> Tuple[Any, bool]:
+    """
+    返回 (检索结果, 是否来自缓存或合并的并发请求)。未命中时通过 await fetch() 检索；
+    cacheable(result) 为 False 的结果（如错误）不写入缓存。fetch 抛出的异常会传给所有等待的调用方。
+    """
+    if not RETRIEVAL_CACHE_ENABLED:
+        return await fetch(), False
+    key = cache_key(query, dataset_ids, **params)
+    cached = retrieval_cache.get(key)
+    if cached is not None:
+        return cached, True
+
+    leader = []
+
+    async def load():
+        leader.append(True)
+        result = await fetch()
+        if cacheable(result):
+            retrieval_cache.set(key, result, _result_size(result))
+        return result
+
+    result = await _flight.do(key, load)
+    return result, not leader
+
+
+def cache_stats() -> Dict[str, Any]:
+    return dict(retrieval_cache.stats(), enabled=RETRIEVAL_CACHE_ENABLED, single_flight=_flight.stats())
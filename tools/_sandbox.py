@@ -0,0 +1,283 @@
+"""
+Agent 生成代码的进程池沙箱。
+
+analyze_csv_content 的 Agent 生成的 pandas / matplotlib 代码不在服务进程中执行，而是交给预先启动的
+工作进程（tools._sandbox_worker）。这样 CPU 密集的计算和绘图不会占用服务进程的 GIL，
+matplotlib 的全局状态也不会在并发调用之间共享。
+
+- 工作进程数量为 SANDBOX_WORKERS，首次导入时在后台预热。每次分析借出一个进程作为会话，
+  同一会话内多段代码共享变量，分析结束后归还。同时进行的分析数由 LLM_MAX_CONCURRENCY 限制，
+  SANDBOX_WORKERS 默认与之相同；设得更小时，多出的分析会在借出进程时排队。
+- 单段代码的 CPU 时间上限为 SANDBOX_CPU_SECONDS，进程内存上限为 SANDBOX_MEMORY_MB。
+  超过 SANDBOX_TASK_TIMEOUT 秒仍未返回时直接终止该进程并补充一个新进程。
+- DataFrame 以 Arrow IPC 文件的形式写入共享内存目录（/dev/shm，没有时使用临时目录），每个数据集只导出一次，
+  导出文件按 SANDBOX_EXPORT_MAX_BYTES 做 LRU 淘汰。工作进程内存映射读取文件后用 to_pandas() 转换并缓存，
+  每个会话再复制一份 df，因此每个工作进程仍持有数据的副本。
+"""
+import atexit
+import os
+import queue
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from dotenv import load_dotenv
+
+from logger import logger
+from tools._sandbox_worker import recv_message, send_message
+
+load_dotenv()
+
+SANDBOX_ENABLED = os.getenv("SANDBOX_ENABLED", "true").lower() in ("1", "true", "yes")
+# 预热的工作进程数，默认与 LLM_MAX_CONCURRENCY 相同，保证每个并发分析都能借到进程
+SANDBOX_WORKERS = int(os.getenv("SANDBOX_WORKERS", os.getenv("LLM_MAX_CONCURRENCY", 4)))
+SANDBOX_CPU_SECONDS = float(os.getenv("SANDBOX_CPU_SECONDS", 60))              # 单段代码的 CPU 时间上限
+SANDBOX_MEMORY_MB = int(os.getenv("SANDBOX_MEMORY_MB", 4096))                  # 工作进程的内存上限（0 表示不限制）
+SANDBOX_TASK_TIMEOUT = float(os.getenv("SANDBOX_TASK_TIMEOUT", 120))           # 单段代码的墙钟时间上限
+SANDBOX_CHECKOUT_TIMEOUT = float(os.getenv("SANDBOX_CHECKOUT_TIMEOUT", 60))    # 等待空闲进程的最长秒数
+SANDBOX_EXPORT_MAX_BYTES = int(os.getenv("SANDBOX_EXPORT_MAX_BYTES", 1024 * 1024 * 1024))  # 导出的 Arrow 文件总大小上限
+
+_PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class SandboxError(RuntimeError):
+    """工作进程启动失败、意外退出或执行超时。"""
+
+
+class _Worker:
+    def __init__(self):
+        self.proc = subprocess.Popen(
+            [sys.executable, "-m", "tools._sandbox_worker", "--memory-mb", str(SANDBOX_MEMORY_MB)],
+            cwd=_PROJECT_ROOT, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            env=dict(os.environ, MPLBACKEND="Agg"),
+        )
+        self.ready = False
+
+    def request(self, message, timeout: Optional[float] = None):
+        """发送一条消息并等待回复；超时则终止进程并抛出 SandboxError。"""
+        timer = None
+        fired = threading.Event()
+        if timeout:
+            def on_timeout():
+                fired.set()
+                self.kill()
+            timer = threading.Timer(timeout, on_timeout)
+            timer.daemon = True
+            timer.start()
+        try:
+            if not self.ready:
+                recv_message(self.proc.stdout)  # 启动完成信号
+                self.ready = True
+            send_message(self.proc.stdin, message)
+            status, value = recv_message(self.proc.stdout)
+        except (EOFError, OSError) as e:
+            self.kill()
+            if fired.is_set():
+                raise SandboxError(f"代码执行超过 {timeout:.0f} 秒，已终止沙箱进程。") from e
+            raise SandboxError(f"沙箱进程意外退出（退出码 {self.proc.poll()}），可能超过了内存上限。") from e
+        finally:
+            if timer is not None:
+                timer.cancel()
+        if status != "ok":
+            raise SandboxError(value)
+        return value
+
+    def alive(self) -> bool:
+        return self.proc.poll() is None
+
+    def kill(self):
+        if self.proc.poll() is None:
+            self.proc.kill()
+        try:
+            self.proc.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            pass
+        for stream in (self.proc.stdin, self.proc.stdout):
+            try:
+                stream.close()
+            except OSError:
+                pass
+
+
+class _ArrowExports:
+    """把数据集导出为共享内存目录中的 Arrow IPC 文件，按总大小做 LRU 淘汰。"""
+
+    def __init__(self, max_bytes: int):
+        base = "/dev/shm" if os.path.isdir("/dev/shm") else None
+        self.dir = tempfile.mkdtemp(prefix="mcp_sandbox_", dir=base)
+        self.max_bytes = max_bytes
+        self._files: "OrderedDict[str, int]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def path_for(self, handle: str, df) -> str:
+        path = os.path.join(self.dir, f"{handle}.arrow")
+        with self._lock:
+            if handle in self._files:
+                self._files.move_to_end(handle)
+                return path
+            import pyarrow as pa
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            tmp_path = path + ".tmp"
+            with pa.OSFile(tmp_path, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+            os.replace(tmp_path, path)
+            size = os.path.getsize(path)
+            self._files[handle] = size
+            self._bytes += size
+            while self._bytes > self.max_bytes and len(self._files) > 1:
+                old, old_size = self._files.popitem(last=False)
+                self._bytes -= old_size
+                try:
+                    os.remove(os.path.join(self.dir, f"{old}.arrow"))  # 已映射的进程不受影响
+                except OSError:
+                    pass
+        return path
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"files": len(self._files), "bytes": self._bytes}
+
+    def cleanup(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+
+class SandboxSession:
+    """一次分析占用的工作进程；execute 在同一进程中执行代码，变量在多次调用之间保留。"""
+
+    def __init__(self, pool: "SandboxPool", handle: str, arrow_path: str):
+        self.pool = pool
+        self.handle = handle
+        self.arrow_path = arrow_path
+        self.worker: Optional[_Worker] = None
+        self._lock = threading.Lock()
+
+    def _begin(self):
+        self.worker = self.pool._checkout()
+        try:
+            self.worker.request(("begin", self.handle, self.arrow_path), SANDBOX_TASK_TIMEOUT)
+        except SandboxError:
+            self.pool._checkin(self.worker)
+            self.worker = None
+            raise
+
+    def execute(self, code: str) -> str:
+        with self._lock:
+            if self.worker is None or not self.worker.alive():
+                restarted = self.worker is not None
+                if restarted:
+                    self.pool._checkin(self.worker)
+                    self.worker = None
+                try:
+                    self._begin()
+                except SandboxError as e:
+                    # 等不到空闲进程、加载数据集超时或导出文件已被淘汰等，与执行失败一样以文本返回给 Agent
+                    self.pool._stats["failures"] += 1
+                    return f"SandboxError: {e}"
+                if restarted:
+                    logger.warning("沙箱进程已重启，会话中之前定义的变量已丢失。")
+            started = time.perf_counter()
+            try:
+                output = self.worker.request(("exec", code, SANDBOX_CPU_SECONDS), SANDBOX_TASK_TIMEOUT)
+            except SandboxError as e:
+                self.pool._stats["failures"] += 1
+                if not self.worker.alive():
+                    return f"SandboxError: {e}之前定义的变量已丢失，下一段代码将在新的进程中执行（df 会重新加载）。"
+                return f"SandboxError: {e}"
+            finally:
+                self.pool._stats["executions"] += 1
+                self.pool._stats["exec_time"] += time.perf_counter() - started
+            return output
+
+    def close(self):
+        with self._lock:
+            worker, self.worker = self.worker, None
+        if worker is None:
+            return
+        if worker.alive():
+            try:
+                worker.request(("end",), SANDBOX_TASK_TIMEOUT)
+            except SandboxError:
+                pass
+        self.pool._checkin(worker)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SandboxPool:
+    def __init__(self, size: int):
+        self.size = size
+        self._idle: "queue.Queue[_Worker]" = queue.Queue()
+        self._exports: Optional[_ArrowExports] = None
+        self._lock = threading.Lock()
+        self._started = False
+        self._stats = {"sessions": 0, "executions": 0, "failures": 0, "restarts": 0, "exec_time": 0.0}
+
+    def start(self):
+        """启动全部工作进程（幂等）。"""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+            self._exports = _ArrowExports(SANDBOX_EXPORT_MAX_BYTES)
+            for _ in range(self.size):
+                self._idle.put(_Worker())
+        logger.info(f"沙箱进程池已启动: {self.size} 个工作进程")
+
+    def _checkout(self) -> _Worker:
+        self.start()
+        try:
+            worker = self._idle.get(timeout=SANDBOX_CHECKOUT_TIMEOUT)
+        except queue.Empty:
+            raise SandboxError(f"等待空闲沙箱进程超过 {SANDBOX_CHECKOUT_TIMEOUT:.0f} 秒。")
+        if not worker.alive():
+            worker.kill()
+            worker = _Worker()
+            self._stats["restarts"] += 1
+        return worker
+
+    def _checkin(self, worker: _Worker):
+        if not worker.alive():
+            worker.kill()
+            worker = _Worker()
+            self._stats["restarts"] += 1
+        self._idle.put(worker)
+
+    def session(self, handle: str, df) -> SandboxSession:
+        """为数据集创建一个会话；工作进程在第一次执行代码时才借出。"""
+        self.start()
+        self._stats["sessions"] += 1
+        return SandboxSession(self, handle, self._exports.path_for(handle, df))
+
+    def shutdown(self):
+        while True:
+            try:
+                self._idle.get_nowait().kill()
+            except queue.Empty:
+                break
+        if self._exports is not None:
+            self._exports.cleanup()
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(self._stats, exec_time=round(self._stats["exec_time"], 3), workers=self.size,
+                    idle_workers=self._idle.qsize(), exports=self._exports.stats() if self._exports else None)
+
+
+if SANDBOX_ENABLED and SANDBOX_WORKERS < int(os.getenv("LLM_MAX_CONCURRENCY", 4)):
+    logger.warning(f"SANDBOX_WORKERS={SANDBOX_WORKERS} 小于 LLM_MAX_CONCURRENCY，超出的并发分析会排队等待沙箱进程。")
+
+sandbox_pool = SandboxPool(SANDBOX_WORKERS)
+atexit.register(sandbox_pool.shutdown)
+
+if SANDBOX_ENABLED:
+    # 在后台预热工作进程，首次分析不必等待 pandas / matplotlib 的导入
+    threading.Thread(target=sandbox_pool.start, name="sandbox-warmup", daemon=True).start()
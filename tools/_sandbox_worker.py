@@ -0,0 +1,169 @@
+"""
+沙箱工作进程：执行 Agent 生成的 pandas / matplotlib 代码。
+
+由 _sandbox 以 `python -m tools._sandbox_worker` 启动，通过 stdin/stdout 交换带长度前缀的 pickle 消息：
+- ("begin", handle, arrow_path)：开始一个会话，REPL 中的 df 为该数据集的副本。数据集通过内存映射的
+  Arrow 文件读取，转换后的 DataFrame 在进程内缓存，同一数据集的后续会话不再读取文件。
+- ("exec", code, cpu_seconds)：在会话中执行一段代码，返回最后一个表达式的值或标准输出，语义与
+  PythonAstREPLTool 相同。单次执行的 CPU 时间由 RLIMIT_CPU 限制。
+- ("end",)：结束会话，清空变量并关闭所有 matplotlib 图形。
+进程的内存上限由启动参数 --memory-mb 通过 RLIMIT_AS 设置。
+"""
+import os
+import pickle
+import struct
+import sys
+from typing import Any, BinaryIO
+
+try:
+    import resource
+except ImportError:  # Windows 没有 resource 模块，不做资源限制
+    resource = None
+
+_HEADER = struct.Struct("!I")
+_MAX_CACHED_DATASETS = 2
+
+
+def send_message(stream: BinaryIO, message: Any):
+    payload = pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL)
+    stream.write(_HEADER.pack(len(payload)) + payload)
+    stream.flush()
+
+
+def recv_message(stream: BinaryIO) -> Any:
+    header = stream.read(_HEADER.size)
+    if len(header) < _HEADER.size:
+        raise EOFError("沙箱进程已退出")
+    size = _HEADER.unpack(header)[0]
+    payload = stream.read(size)
+    if len(payload) < size:
+        raise EOFError("沙箱进程已退出")
+    return pickle.loads(payload)
+
+
+class CpuLimitExceeded(Exception):
+    pass
+
+
+def _on_cpu_limit(signum, frame):
+    raise CpuLimitExceeded("代码执行超过 CPU 时间上限，已被中止。")
+
+
+def _limit_cpu(seconds: float):
+    """把 CPU 软限制设为“已用时间 + seconds”，超过后收到 SIGXCPU。"""
+    if resource is None:
+        return
+    if seconds <= 0:
+        resource.setrlimit(resource.RLIMIT_CPU, (resource.RLIM_INFINITY, resource.RLIM_INFINITY))
+        return
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    soft = int(usage.ru_utime + usage.ru_stime + seconds) + 1
+    resource.setrlimit(resource.RLIMIT_CPU, (soft, resource.RLIM_INFINITY))
+
+
+def _sanitize(code: str) -> str:
+    # 去掉 LLM 输出中常见的 ``` 代码块标记，与 PythonAstREPLTool 的 sanitize_input 一致
+    code = code.strip().strip("`").strip()
+    if code.lower().startswith("python"):
+        code = code[6:]
+    return code.strip().strip("`")
+
+
+def _run_code(code: str, namespace: dict) -> str:
+    import ast
+    import io
+    from contextlib import redirect_stdout
+
+    try:
+        tree = ast.parse(_sanitize(code))
+        exec(ast.unparse(ast.Module(tree.body[:-1], type_ignores=[])), namespace, namespace)
+        last = ast.unparse(ast.Module(tree.body[-1:], type_ignores=[]))
+        buffer = io.StringIO()
+        try:
+            with redirect_stdout(buffer):
+                value = eval(last, namespace, namespace)
+            return buffer.getvalue() if value is None else str(value)
+        except SyntaxError:
+            with redirect_stdout(buffer):
+                exec(last, namespace, namespace)
+            return buffer.getvalue()
+    except CpuLimitExceeded as e:
+        return f"CpuLimitExceeded: {e}"
+    except MemoryError:
+        return "MemoryError: 代码执行超过内存上限。"
+    except Exception as e:
+        return f"{type(e).__name__}: {e}"
+
+
+def main():
+    import argparse
+    import gc
+    import signal
+    from collections import OrderedDict
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--memory-mb", type=int, default=0)
+    args = parser.parse_args()
+
+    # 协议使用原始 stdout；之后任何库写到 stdout 的内容都改写到 stderr，避免破坏消息帧
+    channel_in = os.fdopen(os.dup(sys.stdin.fileno()), "rb")
+    channel_out = os.fdopen(os.dup(sys.stdout.fileno()), "wb")
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+
+    if resource is not None:
+        signal.signal(signal.SIGXCPU, _on_cpu_limit)
+        if args.memory_mb > 0:
+            limit = args.memory_mb * 1024 * 1024
+            resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+    os.environ.setdefault("MPLBACKEND", "Agg")
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    import pandas as pd  # noqa: F401  预先导入，避免每段代码首次 import 的开销
+    import pyarrow as pa
+
+    datasets: "OrderedDict[str, Any]" = OrderedDict()
+    namespace: dict = {}
+    send_message(channel_out, ("ready", os.getpid()))
+
+    while True:
+        try:
+            message = recv_message(channel_in)
+        except EOFError:
+            return
+        kind = message[0]
+        try:
+            if kind == "begin":
+                _, handle, arrow_path = message
+                df = datasets.get(handle)
+                if df is None:
+                    with pa.memory_map(arrow_path) as source:
+                        df = pa.ipc.open_file(source).read_all().to_pandas()
+                    datasets[handle] = df
+                    while len(datasets) > _MAX_CACHED_DATASETS:
+                        datasets.popitem(last=False)
+                datasets.move_to_end(handle)
+                namespace = {"df": df.copy()}
+                reply = ("ok", None)
+            elif kind == "exec":
+                _, code, cpu_seconds = message
+                _limit_cpu(cpu_seconds)
+                try:
+                    reply = ("ok", _run_code(code, namespace))
+                finally:
+                    _limit_cpu(0)
+            elif kind == "end":
+                namespace = {}
+                plt.close("all")
+                gc.collect()
+                reply = ("ok", None)
+            else:
+                reply = ("error", f"未知消息类型: {kind}")
+        except Exception as e:
+            reply = ("error", f"{type(e).__name__}: {e}")
+        send_message(channel_out, reply)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+"""
+数据库结构目录（schema catalog）。
+
+用两条 information_schema 批量查询一次性加载整个库的表和字段，缓存在进程内。
+缓存在 SCHEMA_CACHE_TTL 内有效；超过 SCHEMA_CACHE_CHECK_INTERVAL 后会先用一条聚合查询
+（表数量、字段数量、最新建表时间，以及表名、表注释和字段定义的校验和）比对指纹，指纹未变则继续使用缓存，避免重复加载。
+每次重新加载后会通知通过 add_listener 注册的回调（例如 _schema_index 据此增量更新索引）。
+"""
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from loguru import logger
+from dotenv import load_dotenv
+
+from tools._db_pool import acquire_connection, release_connection
+
+load_dotenv()
+
+SCHEMA_CACHE_TTL = float(os.getenv("SCHEMA_CACHE_TTL", 600))                        # 超过该秒数强制重新加载
+SCHEMA_CACHE_CHECK_INTERVAL = float(os.getenv("SCHEMA_CACHE_CHECK_INTERVAL", 10))   # 超过该秒数先校验指纹
+
+SYSTEM_DATABASES = ("information_schema", "mysql", "performance_schema", "sys")
+
+# 表和字段的校验和覆盖目录中缓存的全部内容：改列名、改类型、改注释这类 ALTER 不改变数量，
+# 在线 / INSTANT ALTER 也不一定更新 CREATE_TIME。不使用 UPDATE_TIME，它随数据写入变化，会导致频繁重新加载。
+_FINGERPRINT_SQL = """
+SELECT
+    (SELECT COUNT(*) FROM information_schema.SCHEMATA WHERE SCHEMA_NAME = %s) AS db_exists,
+    (SELECT COUNT(*) FROM information_schema.TABLES WHERE TABLE_SCHEMA = %s) AS table_count,
+    (SELECT COUNT(*) FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = %s) AS column_count,
+    (SELECT MAX(CREATE_TIME) FROM information_schema.TABLES WHERE TABLE_SCHEMA = %s) AS last_created,
+    (SELECT SUM(CRC32(CONCAT_WS(0x1f, TABLE_NAME, TABLE_COMMENT)))
+     FROM information_schema.TABLES WHERE TABLE_SCHEMA = %s) AS tables_checksum,
+    (SELECT SUM(CRC32(CONCAT_WS(0x1f, TABLE_NAME, ORDINAL_POSITION, COLUMN_NAME, COLUMN_TYPE, IS_NULLABLE,
+                                COLUMN_KEY, IFNULL(COLUMN_DEFAULT, 0x00), EXTRA, COLUMN_COMMENT)))
+     FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = %s) AS columns_checksum
+"""
+
+_TABLES_SQL = """
+SELECT TABLE_NAME, TABLE_COMMENT
+FROM information_schema.TABLES
+WHERE TABLE_SCHEMA = %s
+ORDER BY TABLE_NAME
+"""
+
+_COLUMNS_SQL = """
+SELECT TABLE_NAME, COLUMN_NAME, COLUMN_TYPE, IS_NULLABLE, COLUMN_KEY, COLUMN_DEFAULT, EXTRA, COLUMN_COMMENT
+FROM information_schema.COLUMNS
+WHERE TABLE_SCHEMA = %s
+ORDER BY TABLE_NAME, ORDINAL_POSITION
+"""
+
+
+class DatabaseNotFoundError(Exception):
+    """指定的数据库不存在。"""
+
+
+class _CatalogEntry:
+    __slots__ = ("schema", "fingerprint", "loaded_at", "checked_at")
+
+    def __init__(self, schema, fingerprint):
+        now = time.monotonic()
+        self.schema = schema
+        self.fingerprint = fingerprint
+        self.loaded_at = now
+        self.checked_at = now
+
+
+_catalog: Dict[str, _CatalogEntry] = {}
+_locks: Dict[str, threading.Lock] = {}
+_locks_guard = threading.Lock()
+_stats = {"hits": 0, "validations": 0, "loads": 0}
+_listeners: List[Callable[[str, Optional[Dict[str, Dict[str, Any]]]], None]] = []
+
+
+def add_listener(callback: Callable[[str, Optional[Dict[str, Dict[str, Any]]]], None]):
+    """注册回调 callback(db_name, schema)，在某个库重新加载后调用；库不存在时 schema 为 None。"""
+    _listeners.append(callback)
+
+
+def _notify(db_name: str, schema: Optional[Dict[str, Dict[str, Any]]]):
+    for callback in list(_listeners):
+        try:
+            callback(db_name, schema)
+        except Exception as e:
+            logger.error(f"结构目录回调执行失败: {e}")
+
+
+def _lock_for(db_name: str) -> threading.Lock:
+    with _locks_guard:
+        return _locks.setdefault(db_name, threading.Lock())
+
+
+def _fingerprint(cursor, db_name: str):
+    cursor.execute(_FINGERPRINT_SQL, (db_name,) * 6)
+    row = cursor.fetchone()
+    if not row or not row["db_exists"]:
+        raise DatabaseNotFoundError(f"数据库 '{db_name}' 不存在。")
+    return (row["table_count"], row["column_count"], str(row["last_created"]),
+            str(row["tables_checksum"]), str(row["columns_checksum"]))
+
+
+def _load(cursor, db_name: str) -> Dict[str, Dict[str, Any]]:
+    cursor.execute(_TABLES_SQL, (db_name,))
+    schema: Dict[str, Dict[str, Any]] = {
+        row["TABLE_NAME"]: {"columns": [], "table_comment": row["TABLE_COMMENT"] or ""}
+        for row in cursor.fetchall()
+    }
+    cursor.execute(_COLUMNS_SQL, (db_name,))
+    for col in cursor.fetchall():
+        table = schema.get(col["TABLE_NAME"])
+        if table is None:
+            continue  # 两次查询之间新建的表，下次校验指纹时会重新加载
+        table["columns"].append({
+            "field": col["COLUMN_NAME"],
+            "type": col["COLUMN_TYPE"],
+            "null": col["IS_NULLABLE"],
+            "key": col["COLUMN_KEY"],
+            "default": col["COLUMN_DEFAULT"],
+            "extra": col["EXTRA"],
+            "comment": col["COLUMN_COMMENT"],
+        })
+    return schema
+
+
+def get_schema(db_name: str, force_reload: bool = False) -> Dict[str, Dict[str, Any]]:
+    """
+    返回 {表名: {"columns": [...], "table_comment": str}}。
+    返回的是缓存中的共享对象，调用方不能修改。
+    """
+    entry = _catalog.get(db_name)
+    now = time.monotonic()
+    if (entry and not force_reload and now - entry.loaded_at < SCHEMA_CACHE_TTL
+            and now - entry.checked_at < SCHEMA_CACHE_CHECK_INTERVAL):
+        _stats["hits"] += 1
+        return entry.schema
+
+    with _lock_for(db_name):
+        # 等锁期间其他线程可能已经刷新过
+        entry = _catalog.get(db_name)
+        now = time.monotonic()
+        if (entry and not force_reload and now - entry.loaded_at < SCHEMA_CACHE_TTL
+                and now - entry.checked_at < SCHEMA_CACHE_CHECK_INTERVAL):
+            _stats["hits"] += 1
+            return entry.schema
+
+        conn = acquire_connection()
+        try:
+            with conn.cursor() as cursor:
+                try:
+                    fingerprint = _fingerprint(cursor, db_name)
+                except DatabaseNotFoundError:
+                    if _catalog.pop(db_name, None) is not None:
+                        _notify(db_name, None)
+                    raise
+                if (entry and not force_reload and entry.fingerprint == fingerprint
+                        and now - entry.loaded_at < SCHEMA_CACHE_TTL):
+                    _stats["validations"] += 1
+                    entry.checked_at = time.monotonic()
+                    return entry.schema
+                started = time.perf_counter()
+                schema = _load(cursor, db_name)
+                _stats["loads"] += 1
+                logger.info(f"已加载数据库 '{db_name}' 的结构目录: {len(schema)} 张表，"
+                            f"耗时 {time.perf_counter() - started:.3f}s")
+        finally:
+            release_connection(conn)
+
+        _catalog[db_name] = _CatalogEntry(schema, fingerprint)
+    _notify(db_name, schema)
+    return schema
+
+
+def get_table(db_name: str, table_name: str) -> Optional[Dict[str, Any]]:
+    """返回单个表的结构；表不存在时强制刷新一次目录后再查找。"""
+    table = get_schema(db_name).get(table_name)
+    if table is None:
+        table = get_schema(db_name, force_reload=True).get(table_name)
+    return table
+
+
+def list_tables(db_name: str) -> List[str]:
+    return list(get_schema(db_name).keys())
+
+
+def list_user_databases() -> List[str]:
+    """列出除系统库以外的所有数据库。"""
+    conn = acquire_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SHOW DATABASES")
+            return [row["Database"] for row in cursor.fetchall() if row["Database"] not in SYSTEM_DATABASES]
+    finally:
+        release_connection(conn)
+
+
+def invalidate(db_name: Optional[str] = None):
+    """使指定数据库（或全部数据库）的缓存失效。"""
+    if db_name is None:
+        _catalog.clear()
+    else:
+        _catalog.pop(db_name, None)
+
+
+def catalog_stats() -> Dict[str, Any]:
+    return dict(_stats, cached_databases=len(_catalog))
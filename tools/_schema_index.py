@@ -0,0 +1,229 @@
+"""
+跨数据库的表结构倒排索引，供 search_schema 工具按关键词查找相关的表和字段。
+
+索引覆盖库名、表名、表注释、字段名和字段注释：
+- 英文标识符按 snake_case / camelCase 拆词并转小写，同时保留完整标识符，复数做简单归一（orders -> order）；
+- 中文按连续字符的二元组（bigram）加单字切分，单字权重减半。
+不同字段的权重不同（表名 > 表注释 > 字段名 > 字段注释 > 库名），查询时按 log(1 + N/df) 加权求和排序。
+
+索引随 _schema_catalog 增量更新：目录重新加载某个库后通过回调只重建该库的索引；
+search 前最多每 SCHEMA_INDEX_REFRESH_INTERVAL 秒同步一次库列表，新增的库补建索引、已删除的库移出索引。
+"""
+import heapq
+import math
+import os
+import re
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from loguru import logger
+from dotenv import load_dotenv
+
+from tools import _schema_catalog as schema_catalog
+
+load_dotenv()
+
+SCHEMA_INDEX_REFRESH_INTERVAL = float(os.getenv("SCHEMA_INDEX_REFRESH_INTERVAL", 60))  # 同步库列表的最短间隔（秒）
+
+_TABLE_NAME_WEIGHT = 3.0
+_TABLE_COMMENT_WEIGHT = 2.0
+_COLUMN_NAME_WEIGHT = 1.5
+_COLUMN_COMMENT_WEIGHT = 1.0
+_DB_NAME_WEIGHT = 1.0
+_CJK_UNIGRAM_FACTOR = 0.5
+_MAX_COLUMNS_PER_TABLE = 10   # 每张表最多返回的命中字段数
+
+_CAMEL_RE = re.compile(r"([a-z0-9])([A-Z])|([A-Z])([A-Z][a-z])")
+_WORD_RE = re.compile(r"[A-Za-z]+|[0-9]+|[\u3400-\u9fff\uf900-\ufaff]+")
+_CJK_RE = re.compile(r"[\u3400-\u9fff\uf900-\ufaff]")
+
+TableKey = Tuple[str, str]          # (库名, 表名)
+ColumnKey = Tuple[str, str, str]    # (库名, 表名, 字段名)
+
+_lock = threading.Lock()
+_refresh_lock = threading.Lock()
+_postings: Dict[str, Dict[TableKey, float]] = {}
+_column_postings: Dict[str, Dict[ColumnKey, float]] = {}
+_db_tokens: Dict[str, set] = {}
+_db_schemas: Dict[str, Dict[str, Dict[str, Any]]] = {}
+_tables: Dict[TableKey, Dict[str, Any]] = {}
+_last_refresh = 0.0
+_stats = {"searches": 0, "refreshes": 0, "reindexed": 0}
+
+
+def _normalize_word(word: str) -> str:
+    word = word.lower()
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+def tokenize(text: Optional[str]) -> Dict[str, float]:
+    """把标识符或注释切分为 {词: 系数}。"""
+    tokens: Dict[str, float] = {}
+    if not text:
+        return tokens
+    text = str(text)
+    stripped = text.strip().lower()
+    if stripped and not _CJK_RE.search(stripped) and re.fullmatch(r"[0-9a-z_$-]+", stripped):
+        tokens[stripped] = 1.0  # 完整标识符，精确匹配 user_id 这类查询
+    for word in _WORD_RE.findall(_CAMEL_RE.sub(r"\1\3 \2\4", text)):
+        if _CJK_RE.match(word):
+            for ch in word:
+                tokens.setdefault(ch, _CJK_UNIGRAM_FACTOR)
+            for i in range(len(word) - 1):
+                tokens[word[i:i + 2]] = 1.0
+        else:
+            tokens[_normalize_word(word)] = 1.0
+    return tokens
+
+
+def _remove_database(db_name: str):
+    """调用方需持有 _lock。"""
+    for token in _db_tokens.pop(db_name, ()):
+        for index in (_postings, _column_postings):
+            postings = index.get(token)
+            if not postings:
+                continue
+            for key in [k for k in postings if k[0] == db_name]:
+                del postings[key]
+            if not postings:
+                del index[token]
+    for key in [k for k in _tables if k[0] == db_name]:
+        del _tables[key]
+    _db_schemas.pop(db_name, None)
+
+
+def _index_database(db_name: str, schema: Dict[str, Dict[str, Any]]):
+    """重建单个库的索引。调用方需持有 _lock。"""
+    _remove_database(db_name)
+    db_tokens = set()
+    db_name_tokens = tokenize(db_name)
+    for table_name, table in schema.items():
+        key = (db_name, table_name)
+        weights: Dict[str, float] = {}
+
+        def add(tokens: Dict[str, float], weight: float):
+            for token, factor in tokens.items():
+                weights[token] = max(weights.get(token, 0.0), weight * factor)
+
+        add(tokenize(table_name), _TABLE_NAME_WEIGHT)
+        add(tokenize(table.get("table_comment")), _TABLE_COMMENT_WEIGHT)
+        add(db_name_tokens, _DB_NAME_WEIGHT)
+        for column in table["columns"]:
+            column_weights: Dict[str, float] = {}
+            for tokens, weight in ((tokenize(column["field"]), _COLUMN_NAME_WEIGHT),
+                                   (tokenize(column.get("comment")), _COLUMN_COMMENT_WEIGHT)):
+                for token, factor in tokens.items():
+                    column_weights[token] = max(column_weights.get(token, 0.0), weight * factor)
+            add(column_weights, 1.0)
+            column_key = (db_name, table_name, column["field"])
+            for token, weight in column_weights.items():
+                _column_postings.setdefault(token, {})[column_key] = weight
+        for token, weight in weights.items():
+            _postings.setdefault(token, {})[key] = weight
+        db_tokens.update(weights)
+        _tables[key] = table
+    _db_tokens[db_name] = db_tokens
+    _db_schemas[db_name] = schema
+    _stats["reindexed"] += 1
+
+
+def _on_schema_loaded(db_name: str, schema: Optional[Dict[str, Dict[str, Any]]]):
+    if db_name in schema_catalog.SYSTEM_DATABASES:
+        return
+    with _lock:
+        if schema is None:
+            _remove_database(db_name)
+        elif _db_schemas.get(db_name) is not schema:
+            _index_database(db_name, schema)
+
+
+schema_catalog.add_listener(_on_schema_loaded)
+
+
+def refresh(force: bool = False):
+    """
+    同步库列表：为尚未索引或结构已变化的库建立索引，移除已删除的库。
+    距上次同步不足 SCHEMA_INDEX_REFRESH_INTERVAL 秒时直接返回；其他线程正在同步时沿用现有索引。
+    """
+    global _last_refresh
+    if not force and _last_refresh and time.monotonic() - _last_refresh < SCHEMA_INDEX_REFRESH_INTERVAL:
+        return
+    # 首次建立索引时必须等待，之后的同步由一个线程完成即可
+    if not _refresh_lock.acquire(blocking=not _last_refresh):
+        return
+    try:
+        started = time.perf_counter()
+        databases = schema_catalog.list_user_databases()
+        for db_name in databases:
+            try:
+                # 不持有 _lock 调用目录，目录重新加载时会通过回调获取 _lock
+                schema = schema_catalog.get_schema(db_name)
+            except schema_catalog.DatabaseNotFoundError:
+                continue
+            with _lock:
+                if _db_schemas.get(db_name) is not schema:
+                    _index_database(db_name, schema)
+        with _lock:
+            for db_name in set(_db_schemas) - set(databases):
+                _remove_database(db_name)
+        _last_refresh = time.monotonic()
+        _stats["refreshes"] += 1
+        logger.info(f"表结构索引已同步: {len(databases)} 个库，{len(_tables)} 张表，"
+                    f"耗时 {time.perf_counter() - started:.3f}s")
+    finally:
+        _refresh_lock.release()
+
+
+def search(keywords: str, top_k: int = 10) -> List[Dict[str, Any]]:
+    """
+    按关键词返回最相关的 top_k 张表，每张表附带命中的字段（没有字段命中时附带主键字段）。
+    """
+    refresh()
+    query = tokenize(keywords)
+    with _lock:
+        _stats["searches"] += 1
+        total = len(_tables) or 1
+        scores: Dict[TableKey, float] = {}
+        column_scores: Dict[TableKey, Dict[str, float]] = {}
+        for token, factor in query.items():
+            postings = _postings.get(token)
+            if not postings:
+                continue
+            idf = math.log(1 + total / len(postings)) * factor
+            for key, weight in postings.items():
+                scores[key] = scores.get(key, 0.0) + weight * idf
+            for (db_name, table_name, field), weight in _column_postings.get(token, {}).items():
+                matched = column_scores.setdefault((db_name, table_name), {})
+                matched[field] = matched.get(field, 0.0) + weight * idf
+
+        results = []
+        for key, score in heapq.nlargest(top_k, scores.items(), key=lambda item: item[1]):
+            table = _tables[key]
+            matched = column_scores.get(key, {})
+            if matched:
+                order = sorted(matched, key=matched.get, reverse=True)
+                by_name = {c["field"]: c for c in table["columns"]}
+                columns = [by_name[f] for f in order[:_MAX_COLUMNS_PER_TABLE] if f in by_name]
+            else:
+                columns = [c for c in table["columns"] if c.get("key") == "PRI"]
+            results.append({
+                "database": key[0],
+                "table": key[1],
+                "table_comment": table.get("table_comment", ""),
+                "score": round(score, 3),
+                "columns": [{"field": c["field"], "type": c["type"], "comment": c.get("comment") or ""}
+                            for c in columns],
+                "column_count": len(table["columns"]),
+            })
+    return results
+
+
+def index_stats() -> Dict[str, Any]:
+    with _lock:
+        return dict(_stats, databases=len(_db_schemas), tables=len(_tables), tokens=len(_postings),
+                    last_refresh_age=round(time.monotonic() - _last_refresh, 1) if _last_refresh else None)
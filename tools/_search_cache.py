@@ -0,0 +1,97 @@
+"""
+Tavily 搜索结果缓存和 arXiv 论文链接解析。
+
+- 以 (规范化后的查询, 搜索参数) 为键缓存 Tavily 的搜索响应，按 TAVILY_CACHE_TTL 过期、按 TAVILY_CACHE_MAX_BYTES
+  做 LRU 淘汰；并发的相同查询通过 AsyncSingleFlight 只调用一次 Tavily。
+- resolve_arxiv 在本地识别 arXiv 编号（2106.09685、arXiv:2106.09685v2、hep-th/9901001）和 arxiv.org 的
+  abs/pdf/html 链接，直接生成 PDF 链接，不消耗搜索额度。
+- find_paper_url 查到的 标题→PDF 链接 记录在 PAPER_URL_CACHE_TTL 秒内有效的缓存中，同一篇论文再次查找时直接返回。
+"""
+import json
+import os
+import re
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from tools._cache import AsyncSingleFlight, TTLCache
+
+load_dotenv()
+
+TAVILY_CACHE_ENABLED = os.getenv("TAVILY_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+TAVILY_CACHE_TTL = float(os.getenv("TAVILY_CACHE_TTL", 3600))                          # 搜索结果的有效秒数
+TAVILY_CACHE_MAX_BYTES = int(os.getenv("TAVILY_CACHE_MAX_BYTES", 16 * 1024 * 1024))    # 搜索结果缓存总容量（字节）
+PAPER_URL_CACHE_TTL = float(os.getenv("PAPER_URL_CACHE_TTL", 7 * 24 * 3600))           # 论文 标题→PDF 链接 的有效秒数
+
+_PAPER_URL_CACHE_MAX_BYTES = 4 * 1024 * 1024
+
+search_cache = TTLCache(TAVILY_CACHE_MAX_BYTES, TAVILY_CACHE_TTL, name="tavily")
+paper_url_cache = TTLCache(_PAPER_URL_CACHE_MAX_BYTES, PAPER_URL_CACHE_TTL, name="paper_url")
+_flight = AsyncSingleFlight()
+
+# 新格式编号（2007 年起）：YYMM.NNNN 或 YYMM.NNNNN，可带版本号
+_ARXIV_NEW_ID = r"\d{4}\.\d{4,5}(?:v\d+)?"
+# 旧格式编号：分类/YYMMNNN，例如 hep-th/9901001、math.GT/0309136
+_ARXIV_OLD_ID = r"[a-z\-]+(?:\.[A-Z]{2})?/\d{7}(?:v\d+)?"
+_ARXIV_URL_RE = re.compile(
+    rf"arxiv\.org/(?:abs|pdf|html)/({_ARXIV_NEW_ID}|{_ARXIV_OLD_ID})", re.IGNORECASE)
+_ARXIV_ID_RE = re.compile(
+    rf"(?:arxiv:\s*)({_ARXIV_NEW_ID}|{_ARXIV_OLD_ID})|(?<![\w.])({_ARXIV_NEW_ID})(?!\w|\.\d)", re.IGNORECASE)
+
+
+def normalize_query(query: str) -> str:
+    return re.sub(r"\s+", " ", query).strip().lower()
+
+
+def _normalize_title(title: str) -> str:
+    return re.sub(r"[\W_]+", " ", title.lower()).strip()
+
+
+def resolve_arxiv(text: str) -> Optional[str]:
+    """从查询或链接中识别 arXiv 编号，返回对应的 PDF 链接；识别不到时返回 None。"""
+    match = _ARXIV_URL_RE.search(text)
+    arxiv_id = match.group(1) if match else None
+    if arxiv_id is None:
+        match = _ARXIV_ID_RE.search(text)
+        if match:
+            arxiv_id = match.group(1) or match.group(2)
+    if arxiv_id is None:
+        return None
+    return f"https://arxiv.org/pdf/{arxiv_id}"
+
+
+def remember_paper(query: str, url: str):
+    key = _normalize_title(query)
+    if key:
+        paper_url_cache.set(key, url, len(key) + len(url))
+
+
+def lookup_paper(query: str) -> Optional[str]:
+    return paper_url_cache.get(_normalize_title(query))
+
+
+async def cached_search(query: str, fetch: Callable[[], Awaitable[Dict[str, Any]]],
+                        **params) -> Tuple[Dict[str, Any], bool]:
+    """返回 (Tavily 搜索响应, 是否来自缓存或合并的并发请求)。fetch 抛出的异常不缓存，并传给所有等待方。"""
+    if not TAVILY_CACHE_ENABLED:
+        return await fetch(), False
+    key = (normalize_query(query), tuple(sorted((k, repr(v)) for k, v in params.items())))
+    cached = search_cache.get(key)
+    if cached is not None:
+        return cached, True
+
+    leader = []
+
+    async def load():
+        leader.append(True)
+        response = await fetch()
+        search_cache.set(key, response, len(json.dumps(response, ensure_ascii=False, default=str).encode("utf-8")))
+        return response
+
+    response = await _flight.do(key, load)
+    return response, not leader
+
+
+def cache_stats() -> Dict[str, Any]:
+    return {"search": dict(search_cache.stats(), enabled=TAVILY_CACHE_ENABLED, single_flight=_flight.stats()),
+            "paper_url": paper_url_cache.stats()}
@@ -0,0 +1,74 @@
+"""
+表格渲染：把 (columns, rows) 渲染为 Markdown 表格或对齐的纯文本表格。
+
+- write_markdown：逐行写入输出流，不缓存行，适合大输入（json_to_markdown_table 使用）。
+- render_aligned：对有限行数计算列宽后对齐输出，支持单元格截断（run_query_as_table 使用）。
+列宽按终端显示宽度计算，中文等全角字符计为 2。
+"""
+import unicodedata
+from typing import Any, Iterable, List, Sequence, TextIO
+
+from tools._result_format import to_jsonable
+
+
+def display_width(text: str) -> int:
+    return sum(2 if unicodedata.east_asian_width(ch) in ("W", "F") else 1 for ch in text)
+
+
+def cell_text(value: Any, max_width: int = 0, markdown: bool = True) -> str:
+    """把单元格值转为单行文本，超过 max_width（显示宽度）时截断并以 … 结尾。"""
+    if value is None:
+        text = "NULL"
+    else:
+        text = str(to_jsonable(value))
+    text = text.replace("\r\n", " ").replace("\n", " ").replace("\r", " ")
+    if markdown:
+        text = text.replace("|", "\\|")
+    if max_width > 0 and display_width(text) > max_width:
+        width = 0
+        for i, ch in enumerate(text):
+            width += 2 if unicodedata.east_asian_width(ch) in ("W", "F") else 1
+            if width > max_width - 1:
+                text = text[:i] + "…"
+                break
+    return text
+
+
+def _pad(text: str, width: int) -> str:
+    return text + " " * (width - display_width(text))
+
+
+def write_markdown(out: TextIO, columns: Sequence[Any], rows: Iterable[Sequence[Any]]) -> int:
+    """逐行写出 Markdown 表格（不对齐），单元格按 cell_text 转义 | 和换行，返回写出的数据行数。"""
+    out.write("| " + " | ".join(cell_text(c, 0, True) for c in columns) + " |\n")
+    out.write("|" + "---|" * len(columns))
+    count = 0
+    for row in rows:
+        out.write("\n| " + " | ".join(cell_text(v, 0, True) for v in row) + " |")
+        count += 1
+    return count
+
+
+def render_aligned(columns: Sequence[Any], rows: List[Sequence[Any]], style: str = "markdown",
+                   max_cell_width: int = 0) -> str:
+    """计算列宽后渲染整个表格。style 为 "markdown" 或 "text"。"""
+    markdown = style == "markdown"
+    header = [cell_text(c, max_cell_width, markdown) for c in columns]
+    body = [[cell_text(v, max_cell_width, markdown) for v in row] for row in rows]
+    widths = [max(3, display_width(h)) for h in header]
+    for row in body:
+        for i, text in enumerate(row):
+            widths[i] = max(widths[i], display_width(text))
+
+    lines = []
+    if markdown:
+        lines.append("| " + " | ".join(_pad(h, w) for h, w in zip(header, widths)) + " |")
+        lines.append("|" + "|".join("-" * (w + 2) for w in widths) + "|")
+        for row in body:
+            lines.append("| " + " | ".join(_pad(t, w) for t, w in zip(row, widths)) + " |")
+    else:
+        lines.append("  ".join(_pad(h, w) for h, w in zip(header, widths)).rstrip())
+        lines.append("  ".join("-" * w for w in widths))
+        for row in body:
+            lines.append("  ".join(_pad(t, w) for t, w in zip(row, widths)).rstrip())
+    return "\n".join(lines)
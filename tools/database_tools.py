@@ -1,56 +1,75 @@
 import os
 import re
+import sys
 import json
 import pymysql
 from loguru import logger
 from dotenv import load_dotenv
 from server import mcp
+from tools._db_pool import pool_stats, executor_stats, db_task
+from tools import _result_stream as result_stream
+from tools._result_stream import QUERY_PAGE_MAX_ROWS, QUERY_PAGE_MAX_BYTES
+from tools import _schema_catalog as schema_catalog
+from tools import _schema_index as schema_index
+from tools._query_cache import QUERY_CACHE_ENABLED, cache_key, query_cache
+from tools._result_format import FORMATS, encode_page, encode_rows
+from tools._query_guard import QueryGuardError
+from tools._table_render import render_aligned
 
 load_dotenv()
 
-# Database connection details
-DB_HOST = os.getenv("DB_HOST", "localhost")
-DB_PORT = int(os.getenv("DB_PORT", 3306))
-DB_USER = os.getenv("DB_USER", "root")
-DB_PASSWORD = os.getenv("DB_PASSWORD", "123456")
-
-def get_db_connection(db_name=None):
-    try:
-        return pymysql.connect(
-            host=DB_HOST,
-            port=DB_PORT,
-            user=DB_USER,
-            password=DB_PASSWORD,
-            database=db_name,
-            charset='utf8mb4',
-            cursorclass=pymysql.cursors.DictCursor
-        )
-    except Exception as e:
-        logger.error(f"数据库连接失败: {e}")
-        return None
+QUERY_TABLE_COUNT_LIMIT = int(os.getenv("QUERY_TABLE_COUNT_LIMIT", 100_000))  # run_query_as_table 统计剩余行数的上限
 
 @mcp.tool()
+@db_task(None)
 def list_databases() -> str:
     """连接到MySQL服务器并列出所有数据库的名称。当不确定有哪些数据库可用时调用。"""
     logger.info("--- 🛠️ 执行工具: list_databases ---")
-    conn = get_db_connection()
-    if conn is None:
-        return "无法连接到数据库，请检查配置。"
     try:
-        with conn.cursor() as cursor:
-            cursor.execute("SHOW DATABASES")
-            databases = [db['Database'] for db in cursor.fetchall()]
-            user_databases = [db for db in databases if db not in ['information_schema', 'mysql', 'performance_schema', 'sys']]
-            result = json.dumps(user_databases, ensure_ascii=False, indent=2)
-            logger.info(f"工具输出: {result}")
-            return result
+        user_databases = schema_catalog.list_user_databases()
+        result = json.dumps(user_databases, ensure_ascii=False, indent=2)
+        logger.info(f"工具输出: {result}")
+        return result
+    except pymysql.err.OperationalError as e:
+        logger.error(f"数据库连接失败: {e}")
+        return "无法连接到数据库，请检查配置。"
     except Exception as e:
         logger.error(f"列出数据库失败: {e}")
         return f"列出数据库失败，错误信息: {e}"
-    finally:
-        conn.close()
 
 @mcp.tool()
+@db_task(None)
+def search_schema(keywords: str, top_k: int = 10) -> str:
+    """
+    在所有数据库的库名、表名、字段名及其注释（支持中文注释）中按关键词搜索，返回最相关的表和命中的字段。
+    当不确定某个概念（如“订单金额”“user email”）存放在哪个库的哪张表时，应先调用本工具，
+    而不是对多个数据库逐一调用 get_schema_of_database。
+
+    Args:
+        keywords: 一个或多个关键词，以空格分隔，中英文均可。
+        top_k: 最多返回的表数量。
+
+    Returns:
+        JSON 列表，每项包含 database、table、table_comment、score、columns（命中的字段，
+        没有字段命中时为主键字段）和 column_count（表的字段总数）。
+        需要完整表结构时再对目标表调用 describe_table_in_database。
+    """
+    logger.info(f"--- 🛠️ 执行工具: search_schema (keywords='{keywords}', top_k={top_k}) ---")
+    if not keywords or not keywords.strip():
+        return "请提供搜索关键词。"
+    try:
+        results = schema_index.search(keywords, max(1, min(int(top_k), 100)))
+        if not results:
+            return f"没有找到与 '{keywords}' 相关的表或字段。"
+        result = json.dumps(results, ensure_ascii=False, separators=(",", ":"), default=str)
+        logger.info(f"工具输出: {len(results)} 张表, {len(result)} 字符")
+        return result
+    except Exception as e:
+        logger.error(f"搜索表结构失败: {e}")
+        return f"搜索表结构失败，错误信息: {e}"
+
+@mcp.tool()
+@db_task()
 def get_schema_of_database(db_name: str) -> str:
     """
     获取指定数据库的完整表结构（包括表名、字段名、字段类型、主键、是否可空、默认值和注释）。
@@ -59,66 +78,212 @@ def get_schema_of_database(db_name: str) -> str:
     logger.info(f"--- 🛠️ 执行工具: get_schema_of_database (db_name='{db_name}') ---")
     if not re.match(r'^[a-zA-Z0-9_-]+$', db_name):
         return "无效的数据库名称。"
-    conn = get_db_connection(db_name)
-    if conn is None:
-        return "无法连接到数据库，请检查配置或数据库名称是否正确。"
     try:
-        with conn.cursor() as cursor:
-            cursor.execute("SHOW TABLES")
-            tables = [table[f'Tables_in_{db_name}'] for table in cursor.fetchall()]
-            schema_info = {}
-            for table_name in tables:
-                cursor.execute(f"SHOW FULL COLUMNS FROM `{table_name}`")
-                columns = cursor.fetchall()
-                table_comment_query = f"SELECT TABLE_COMMENT FROM information_schema.TABLES WHERE TABLE_SCHEMA = '{db_name}' AND TABLE_NAME = '{table_name}'"
-                cursor.execute(table_comment_query)
-                table_comment_result = cursor.fetchone()
-                table_comment = table_comment_result['TABLE_COMMENT'] if table_comment_result else ""
-                schema_info[table_name] = {
-                    "columns": [{"field": col['Field'], "type": col['Type'], "null": col['Null'], "key": col['Key'], "default": col['Default'], "extra": col['Extra'], "comment": col['Comment']} for col in columns],
-                    "table_comment": table_comment
-                }
-            result = json.dumps(schema_info, ensure_ascii=False, indent=2)
-            logger.info(f"工具输出: {result}")
-            return result
+        schema_info = schema_catalog.get_schema(db_name)
+        result = json.dumps(schema_info, ensure_ascii=False, indent=2)
+        logger.info(f"工具输出: {result}")
+        return result
+    except schema_catalog.DatabaseNotFoundError as e:
+        return str(e)
     except Exception as e:
         logger.error(f"获取数据库 '{db_name}' 结构失败: {e}")
         return f"获取数据库 '{db_name}' 结构失败，错误信息: {e}"
-    finally:
-        conn.close()
+
+def _check_readonly_query(db_name: str, query: str):
+    """校验数据库名和只读查询，不通过时返回错误信息。"""
+    if not re.match(r'^[a-zA-Z0-9_-]+$', db_name):
+        return "无效的数据库名称。"
+    query_upper = query.strip().upper()
+    disallowed_keywords = ["INSERT", "UPDATE", "DELETE", "REPLACE", "CREATE", "DROP", "ALTER", "TRUNCATE", "GRANT", "REVOKE", "LOCK", "UNLOCK"]
+    if any(re.search(r'\b' + keyword + r'\b', query_upper) for keyword in disallowed_keywords):
+        return "检测到潜在的写操作，已禁止执行。只允许执行不修改数据库的查询。"
+    if re.match(r'^(USE|SET)\b', query_upper):
+        # 连接是池化复用的，切换库或修改会话变量会污染后续借用该连接的请求
+        return "不允许执行 USE 或 SET 语句，请通过 db_name 参数指定数据库。"
+    return None
+
+def _page_response(rows, has_more, stream, cursor_id, format) -> str:
+    """构造分页结果；has_more 为 True 时附带续读句柄。"""
+    meta = {
+        "row_count": len(rows),
+        "rows_read": stream.rows_read,
+        "has_more": has_more,
+    }
+    if has_more:
+        meta["cursor_id"] = cursor_id
+        meta["message"] = "结果未读完，可使用 fetch_more_query_results(cursor_id) 读取下一页，不需要时请调用 close_query_cursor(cursor_id) 释放连接。"
+    return encode_page(rows, stream.columns, format, meta)
 
 @mcp.tool()
-def run_readonly_query_in_database(db_name: str, query: str) -> str:
+@db_task()
+def run_readonly_query_in_database(db_name: str, query: str, max_rows: int = QUERY_PAGE_MAX_ROWS, max_bytes: int = QUERY_PAGE_MAX_BYTES, use_cache: bool = True, format: str = "json") -> str:
     """
     在指定的数据库中执行只读SQL查询。
     允许的查询类型包括 'SELECT', 'SHOW', 'DESCRIBE', 'EXPLAIN'。
     禁止执行任何可能修改数据库状态的写操作（如 INSERT, UPDATE, DELETE, CREATE, DROP, ALTER）。
     返回查询结果的JSON字符串。
+
+    结果以服务端游标流式读取，每次最多返回 max_rows 行、约 max_bytes 字节。
+    若结果不止一页，返回 {"rows": [...], "has_more": true, "cursor_id": ...}，
+    可用 fetch_more_query_results(cursor_id) 继续读取而无需重新执行查询。
+
+    服务端开启查询缓存时，相同的确定性 SELECT 会在短时间内直接返回缓存结果；
+    需要最新数据时可传入 use_cache=False。
+
+    format 控制输出格式：
+    - "json"（默认）：行字典列表
+    - "columnar"：{"columns": [...], "rows": [[...], ...]}，列名只出现一次，体积更小
+    - "csv"：带表头的 CSV 文本
+    - "arrow"：base64 编码的 Arrow IPC 流，保留原始数据类型
+    分页时以上数据放在分页对象的 rows（json/columnar）或 data（csv/arrow）字段中。
+    json_to_markdown_table 和 analyze_csv_content 可以直接接受以上任意格式。
+
+    SELECT 语句执行前会先做 EXPLAIN 估算扫描行数，代价过高的查询会被拒绝，
+    超时的查询会在服务端被中止。此时返回 {"status": "rejected" | "timeout", "reason": ..., "suggestions": [...]}，
+    请根据 suggestions 改写查询后重试。
     """
     logger.info(f"--- 🛠️ 执行工具: run_readonly_query_in_database (db_name='{db_name}', query='{query}') ---")
-    if not re.match(r'^[a-zA-Z0-9_-]+$', db_name):
-        return "无效的数据库名称。"
-    query_upper = query.strip().upper()
-    disallowed_keywords = ["INSERT", "UPDATE", "DELETE", "REPLACE", "CREATE", "DROP", "ALTER", "TRUNCATE", "GRANT", "REVOKE", "LOCK", "UNLOCK"]
-    if any(re.search(r'\b' + keyword + r'\b', query_upper) for keyword in disallowed_keywords):
-        return "检测到潜在的写操作，已禁止执行。只允许执行不修改数据库的查询。"
-    conn = get_db_connection(db_name)
-    if conn is None:
-        return "无法连接到数据库，请检查配置或数据库名称是否正确。"
+    error = _check_readonly_query(db_name, query)
+    if error:
+        return error
+    if format not in FORMATS:
+        return f"不支持的格式: {format}，可选: {', '.join(FORMATS)}"
+    key = cache_key(db_name, query) if QUERY_CACHE_ENABLED and use_cache else None
+    if key is not None:
+        cached = query_cache.get(key)
+        if cached is not None:
+            rows, columns, size = cached
+            if len(rows) <= max_rows and size <= max_bytes:
+                logger.info(f"工具输出: 命中查询缓存, {len(rows)} 行")
+                return encode_rows(rows, columns, format)
     try:
-        with conn.cursor() as cursor:
-            cursor.execute(query)
-            result = cursor.fetchall()
-            result_json = json.dumps(result, ensure_ascii=False, indent=2)
-            logger.info(f"工具输出: {result_json}")
-            return result_json
+        stream = result_stream.QueryStream(db_name, query)
+    except QueryGuardError as e:
+        logger.warning(f"查询被守卫拦截或中止: {e}")
+        return e.to_json()
+    except pymysql.err.OperationalError as e:
+        logger.error(f"数据库连接或查询失败: {e}")
+        return f"执行查询失败，请检查配置或数据库名称是否正确。错误信息: {e}"
     except Exception as e:
         logger.error(f"执行查询失败: {e}")
         return f"执行查询失败，错误信息: {e}"
+    try:
+        with stream.lock:
+            rows, has_more = stream.fetch_page(max_rows, max_bytes)
+        if has_more:
+            result_json = _page_response(rows, has_more, stream, result_stream.register(stream), format)
+        else:
+            # 一页即可放下全部结果时，直接返回该格式的完整结果
+            result_json = encode_rows(rows, stream.columns, format)
+            if key is not None:
+                # 只缓存单页即可放下的完整结果，跨页的大结果不进缓存
+                query_cache.set(key, (rows, stream.columns, stream.last_page_bytes), stream.last_page_bytes)
+        logger.info(f"工具输出: {len(rows)} 行, has_more={has_more}, {len(result_json)} 字符")
+        return result_json
+    except QueryGuardError as e:
+        stream.close()
+        logger.warning(f"查询被守卫中止: {e}")
+        return e.to_json()
+    except Exception as e:
+        stream.close()
+        logger.error(f"读取查询结果失败: {e}")
+        return f"读取查询结果失败，错误信息: {e}"
+
+@mcp.tool()
+@db_task(None)
+def fetch_more_query_results(cursor_id: str, max_rows: int = QUERY_PAGE_MAX_ROWS, max_bytes: int = QUERY_PAGE_MAX_BYTES, format: str = "json") -> str:
+    """
+    凭 run_readonly_query_in_database 返回的 cursor_id 读取查询结果的下一页，不会重新执行查询。
+    返回 {"rows": [...], "has_more": bool, "cursor_id": ...}；has_more 为 false 时游标已自动关闭。
+    format 与 run_readonly_query_in_database 相同，可选 "json"、"columnar"、"csv"、"arrow"。
+    """
+    logger.info(f"--- 🛠️ 执行工具: fetch_more_query_results (cursor_id='{cursor_id}') ---")
+    if format not in FORMATS:
+        return f"不支持的格式: {format}，可选: {', '.join(FORMATS)}"
+    stream = result_stream.take(cursor_id)
+    if stream is None:
+        return f"游标 '{cursor_id}' 不存在或已过期，请重新执行查询。"
+    try:
+        with stream.lock:
+            rows, has_more = stream.fetch_page(max_rows, max_bytes)
+        if not has_more:
+            result_stream.discard(cursor_id)
+        result_json = _page_response(rows, has_more, stream, cursor_id, format)
+        logger.info(f"工具输出: {len(rows)} 行, has_more={has_more}, 累计 {stream.rows_read} 行")
+        return result_json
+    except QueryGuardError as e:
+        result_stream.discard(cursor_id)
+        logger.warning(f"查询被守卫中止: {e}")
+        return e.to_json()
+    except Exception as e:
+        result_stream.discard(cursor_id)
+        logger.error(f"读取查询结果失败: {e}")
+        return f"读取查询结果失败，错误信息: {e}"
+
+@mcp.tool()
+@db_task(None)
+def close_query_cursor(cursor_id: str) -> str:
+    """关闭一个不再需要的查询游标，立即释放其占用的数据库连接。"""
+    logger.info(f"--- 🛠️ 执行工具: close_query_cursor (cursor_id='{cursor_id}') ---")
+    if result_stream.discard(cursor_id):
+        return f"游标 '{cursor_id}' 已关闭。"
+    return f"游标 '{cursor_id}' 不存在或已关闭。"
+
+@mcp.tool()
+@db_task()
+def run_query_as_table(db_name: str, query: str, max_rows: int = 50, max_cell_width: int = 40, style: str = "markdown") -> str:
+    """
+    在指定数据库中执行只读SQL查询，并直接返回渲染好的表格（无需再调用 json_to_markdown_table）。
+    适合需要向用户展示查询结果的场景。
+
+    Args:
+        db_name: 数据库名称。
+        query: 只读SQL查询，限制与 run_readonly_query_in_database 相同。
+        max_rows: 最多显示的行数，超出部分只在表格末尾给出剩余行数。
+        max_cell_width: 单元格最大显示宽度，超出部分以 … 截断；0 表示不截断。
+        style: "markdown"（默认）为对齐的Markdown表格，"text" 为对齐的纯文本表格。
+    """
+    logger.info(f"--- 🛠️ 执行工具: run_query_as_table (db_name='{db_name}', query='{query}') ---")
+    error = _check_readonly_query(db_name, query)
+    if error:
+        return error
+    if style not in ("markdown", "text"):
+        return f"不支持的表格样式: {style}，可选: markdown, text"
+    try:
+        stream = result_stream.QueryStream(db_name, query)
+    except QueryGuardError as e:
+        logger.warning(f"查询被守卫拦截或中止: {e}")
+        return e.to_json()
+    except Exception as e:
+        logger.error(f"执行查询失败: {e}")
+        return f"执行查询失败，错误信息: {e}"
+    try:
+        with stream.lock:
+            # 行数已由 max_rows 限制，单元格也会被截断，因此不再按字节分页
+            rows, has_more = stream.fetch_page(max_rows, sys.maxsize)
+            remaining, exhausted = stream.drain(QUERY_TABLE_COUNT_LIMIT) if has_more else (0, True)
+        if not stream.columns:
+            return "查询没有返回结果集。"
+        table = render_aligned(stream.columns, [[row.get(c) for c in stream.columns] for row in rows],
+                               style, max_cell_width)
+        if not rows:
+            table += "\n（查询结果为空）"
+        elif has_more:
+            more = f" {remaining} " if exhausted else f"超过 {remaining} "
+            table += f"\n（仅显示前 {len(rows)} 行，还有{more}行未显示）"
+        logger.info(f"工具输出: {len(rows)} 行, 未显示 {remaining} 行, {len(table)} 字符")
+        return table
+    except QueryGuardError as e:
+        logger.warning(f"查询被守卫中止: {e}")
+        return e.to_json()
+    except Exception as e:
+        logger.error(f"读取查询结果失败: {e}")
+        return f"读取查询结果失败，错误信息: {e}"
     finally:
-        conn.close()
+        stream.close()
 
 @mcp.tool()
+@db_task()
 def list_tables_in_database(db_name: str) -> str:
     """
     【后备工具】当get_schema_of_database工具失败时，用于列出指定数据库中的所有表名。
@@ -126,24 +291,19 @@ def list_tables_in_database(db_name: str) -> str:
     logger.info(f"--- 🛠️ 执行后备工具: list_tables_in_database (db_name='{db_name}') ---")
     if not re.match(r'^[a-zA-Z0-9_-]+$', db_name):
         return "无效的数据库名称。"
-    conn = get_db_connection(db_name)
-    if conn is None:
-        return "无法连接到数据库，请检查配置或数据库名称是否正确。"
     try:
-        with conn.cursor() as cursor:
-            cursor.execute(f"USE `{db_name}`")
-            cursor.execute("SHOW TABLES")
-            tables = [table[f'Tables_in_{db_name}'] for table in cursor.fetchall()]
-            result = json.dumps(tables, ensure_ascii=False, indent=2)
-            logger.info(f"工具输出: {result}")
-            return result
+        tables = schema_catalog.list_tables(db_name)
+        result = json.dumps(tables, ensure_ascii=False, indent=2)
+        logger.info(f"工具输出: {result}")
+        return result
+    except schema_catalog.DatabaseNotFoundError as e:
+        return str(e)
     except Exception as e:
         logger.error(f"列出数据库 '{db_name}' 中的表失败: {e}")
         return f"列出数据库 '{db_name}' 中的表失败，错误信息: {e}"
-    finally:
-        conn.close()
 
 @mcp.tool()
+@db_task()
 def describe_table_in_database(db_name: str, table_name: str) -> str:
     """
     【后备工具】当get_schema_of_database工具失败时，用于获取指定数据库中单个表的详细结构。
@@ -151,28 +311,39 @@ def describe_table_in_database(db_name: str, table_name: str) -> str:
     logger.info(f"--- 🛠️ 执行后备工具: describe_table_in_database (db_name='{db_name}', table_name='{table_name}') ---")
     if not re.match(r'^[a-zA-Z0-9_-]+$', db_name) or not re.match(r'^[a-zA-Z0-9_-]+$', table_name):
         return "无效的数据库或表名称。"
-    conn = get_db_connection(db_name)
-    if conn is None:
-        return "无法连接到数据库，请检查配置或数据库名称是否正确。"
     try:
-        with conn.cursor() as cursor:
-            cursor.execute(f"USE `{db_name}`")
-            cursor.execute(f"SHOW FULL COLUMNS FROM `{table_name}`")
-            columns = cursor.fetchall()
-            table_comment_query = f"SELECT TABLE_COMMENT FROM information_schema.TABLES WHERE TABLE_SCHEMA = '{db_name}' AND TABLE_NAME = '{table_name}'"
-            cursor.execute(table_comment_query)
-            table_comment_result = cursor.fetchone()
-            table_comment = table_comment_result['TABLE_COMMENT'] if table_comment_result else ""
-            table_info = {
-                "table_name": table_name,
-                "table_comment": table_comment,
-                "columns": [{"field": col['Field'], "type": col['Type'], "null": col['Null'], "key": col['Key'], "default": col['Default'], "extra": col['Extra'], "comment": col['Comment']} for col in columns]
-            }
-            result = json.dumps(table_info, ensure_ascii=False, indent=2)
-            logger.info(f"工具输出: {result}")
-            return result
+        table = schema_catalog.get_table(db_name, table_name)
+        if table is None:
+            return f"表 '{table_name}' 在数据库 '{db_name}' 中不存在。"
+        table_info = {
+            "table_name": table_name,
+            "table_comment": table["table_comment"],
+            "columns": table["columns"]
+        }
+        result = json.dumps(table_info, ensure_ascii=False, indent=2)
+        logger.info(f"工具输出: {result}")
+        return result
+    except schema_catalog.DatabaseNotFoundError as e:
+        return str(e)
     except Exception as e:
         logger.error(f"获取表 '{table_name}' 结构失败: {e}")
         return f"获取表 '{table_name}' 结构失败，错误信息: {e}"
-    finally:
-        conn.close()
\ No newline at end of file
+
+@mcp.tool()
+def get_db_pool_stats() -> str:
+    """
+    查看MySQL连接池的运行统计（借出次数、等待次数与等待耗时、淘汰次数、当前空闲/使用中连接数等），
+    以及表结构目录缓存、表结构索引和查询结果缓存的命中情况。用于排查数据库工具的性能问题。
+    """
+    logger.info("--- 🛠️ 执行工具: get_db_pool_stats ---")
+    stats = {
+        "pools": pool_stats(),
+        "executor": executor_stats(),
+        "schema_catalog": schema_catalog.catalog_stats(),
+        "schema_index": schema_index.index_stats(),
+        "open_query_cursors": result_stream.open_cursor_count(),
+        "query_cache": dict(query_cache.stats(), enabled=QUERY_CACHE_ENABLED),
+    }
+    result = json.dumps(stats, ensure_ascii=False, indent=2)
+    logger.info(f"工具输出: {result}")
+    return result
@@ -1,35 +1,159 @@
 # mcp_server/default_tools/file_analysis_tool.py
 import pandas as pd
 import os
-import io
 import asyncio
-import uuid
+import json
+import shutil
+import tempfile
 import matplotlib
 matplotlib.use('Agg')
+from langchain_core.tools import BaseTool
 from langchain_experimental.agents.agent_toolkits import create_pandas_dataframe_agent
-from langchain_openai import ChatOpenAI
-from typing import Dict, Any
+from typing import Any, Optional
 from server import mcp  # Import from centralized app
 from logger import logger  # 从中央日志记录器导入
 from dotenv import load_dotenv
-from tabulate import tabulate
+from tools import _datasets as datasets
+from tools._llm_pool import agent_pool, get_llm, llm_slot
+from tools._fast_analysis import AGGREGATIONS, OPERATIONS, AnalysisError, route_question, run_operation
+from tools._sandbox import SANDBOX_ENABLED, sandbox_pool
+from tools._artifacts import ArtifactTooLargeError, store_file
 
 # 加载环境变量
 load_dotenv()
 
-# 获取环境变量
-API_KEY = os.getenv("OPENAI_API_KEY")
-ENDPOINT = os.getenv("OPENAI_API_BASE")
+class SandboxREPLTool(BaseTool):
+    """替换 Agent 的 python_repl_ast 工具，把生成的代码交给沙箱进程执行。"""
+    name: str = "python_repl_ast"
+    description: str = "A Python shell. Use this to execute python commands."
+    session: Optional[Any] = None
+
+    def _run(self, query: str, **kwargs) -> str:
+        if self.session is None:
+            return "SandboxError: 沙箱会话未绑定。"
+        return self.session.execute(query)
+
+    async def _arun(self, query: str, **kwargs) -> str:
+        if self.session is None:
+            return "SandboxError: 沙箱会话未绑定。"
+        return await asyncio.to_thread(self.session.execute, query)
+
+def _create_agent(df: pd.DataFrame):
+    """创建Pandas DataFrame Agent，使用共享的 LLM 客户端。"""
+    executor = create_pandas_dataframe_agent(
+        llm=get_llm(),
+        df=df,
+        verbose=False, # 设置为True可以在控制台查看LLM生成的Python代码
+        agent_executor_kwargs={"handle_parsing_errors": True},
+        allow_dangerous_code=True,
+        max_iterations=15,
+        max_execution_time=120
+    )
+    if SANDBOX_ENABLED:
+        # 提示词中的工具名和描述保持不变，只替换实际执行代码的工具
+        executor.tools[0] = SandboxREPLTool(description=executor.tools[0].description)
+    return executor
+
+def _bind_executor(executor, df: Optional[pd.DataFrame], session):
+    """把执行器绑定到本次调用的沙箱会话（或进程内 df 副本）；两者都为 None 时解除绑定。"""
+    repl = executor.tools[0]
+    if isinstance(repl, SandboxREPLTool):
+        repl.session = session
+    else:
+        # 缓存中的 DataFrame 会被多次调用共享，交给 Agent 的是副本，避免生成的代码原地修改缓存数据
+        repl.locals = {"df": df.copy()} if df is not None else {}
+        repl.globals = {}
+
+@mcp.tool()
+async def load_csv(csv_content: str = "", content_format: str = "auto", file_path: str = "", sample_rows: int = 0) -> str:
+    """
+    【数据集加载工具】解析一份数据内容并缓存，返回数据集句柄（dataset_id）。
+    需要对同一份数据提多个问题时，先调用本工具，之后把 dataset_id 作为 analyze_csv_content 的 csv_content 传入，
+    避免每次都重新上传和解析整份数据。
+
+    Args:
+        csv_content (str): 数据内容，格式与 analyze_csv_content 相同。与 file_path 二选一。
+        content_format (str): 内容格式，"auto"（默认，自动识别）、"csv"、"json"、"columnar" 或 "arrow"。
+        file_path (str): 服务器上的数据文件路径（如 downloads 目录中的文件），大文件应优先使用该方式。
+        sample_rows (int): 大于 0 时流式读取并随机抽取该数量的行；为 0 时只有超大文件才会自动抽样。
+
+    Returns:
+        str: JSON，包含 dataset_id、行数、列名、列类型、占用内存以及读取信息（是否抽样、总行数、压缩前后的内存）；或错误信息。
+    """
+    logger.info(f"--- [数据集加载工具] 正在加载数据集 (file_path='{file_path}', sample_rows={sample_rows}) ---")
+    if bool(csv_content) == bool(file_path):
+        return "错误: 请提供 csv_content 或 file_path 其中之一。"
+    try:
+        if file_path:
+            handle, df, cached = await asyncio.to_thread(datasets.load_file, file_path, content_format, sample_rows)
+        else:
+            handle, df, cached = await asyncio.to_thread(datasets.load, csv_content, content_format, sample_rows)
+    except datasets.DatasetPathError as e:
+        return f"错误: {e}"
+    except Exception as e:
+        logger.error(f"--- [数据集加载工具 ERROR] 解析数据内容时出错: {e} ---")
+        return f"错误: 解析数据内容时出错: {e}"
+    info = datasets.describe(handle, df, cached)
+    logger.info(f"--- [数据集加载工具] 数据集 {handle}: {info['rows']} 行, {info['column_count']} 列, 命中缓存={cached} ---")
+    return json.dumps(info, ensure_ascii=False, indent=2)
 
 @mcp.tool()
-async def analyze_csv_content(csv_content: str, question: str) -> str:
+async def analyze_dataset(csv_content: str, operation: str, column: str = "", by: str = "", agg: str = "sum",
+                          n: int = 10, ascending: bool = False, content_format: str = "auto") -> str:
+    """
+    【结构化数据分析工具】对数据直接执行常见的统计操作，毫秒级返回，不调用LLM。
+    简单的统计问题应优先使用本工具，只有开放式问题才使用 analyze_csv_content。
+
+    Args:
+        csv_content (str): 数据内容或 load_csv 返回的 dataset_id，格式与 analyze_csv_content 相同。
+        operation (str): 操作类型：
+            "row_count"（行数）、"columns"（列名、类型和非空数量）、"describe"（描述性统计，可指定 column）、
+            "null_counts"（各列缺失值数量）、"head"（前 n 行）、"top_n"（按数值列 column 排序取前 n 行）、
+            "group_by"（按 by 分组对 column 做 agg 聚合）、"value_counts"（column 的取值分布）。
+        column (str): 目标列。
+        by (str): group_by 的分组列。
+        agg (str): group_by 的聚合方式："sum"、"mean"、"count"、"min"、"max"、"median"。
+        n (int): 返回的行数上限。
+        ascending (bool): top_n / group_by 是否按升序排列（默认降序）。
+        content_format (str): 内容格式，"auto"（默认）、"csv"、"json"、"columnar" 或 "arrow"。
+
+    Returns:
+        str: Markdown 表格或文本结果，或错误信息。
+    """
+    logger.info(f"--- [结构化数据分析工具] operation='{operation}', column='{column}', by='{by}', agg='{agg}' ---")
+    if operation not in OPERATIONS:
+        return f"错误: 不支持的操作: {operation}，可选: {', '.join(OPERATIONS)}"
+    if operation == "group_by" and agg not in AGGREGATIONS:
+        return f"错误: 不支持的聚合方式: {agg}，可选: {', '.join(AGGREGATIONS)}"
+    try:
+        handle, df, cached = await asyncio.to_thread(datasets.resolve, csv_content, content_format)
+    except datasets.DatasetNotFoundError:
+        return f"错误: 数据集 '{csv_content.strip()}' 不存在或已过期，请重新调用 load_csv 加载数据。"
+    except Exception as e:
+        logger.error(f"--- [结构化数据分析工具 ERROR] 解析数据内容时出错: {e} ---")
+        return f"错误: 解析数据内容时出错: {e}"
+    try:
+        return await asyncio.to_thread(run_operation, df, operation, column, by, agg, n, ascending)
+    except AnalysisError as e:
+        return f"错误: {e}"
+    except Exception as e:
+        logger.error(f"--- [结构化数据分析工具 ERROR] 执行分析时出错: {e} ---")
+        return f"执行分析时出错: {e}"
+
+@mcp.tool()
+async def analyze_csv_content(csv_content: str, question: str, content_format: str = "auto", use_fast_path: bool = True) -> str:
     """
     【CSV内容分析工具】此工具用于从给定的CSV文本内容中加载数据，并回答关于该数据的问题。
     它使用LangChain的Pandas DataFrame Agent来执行数据分析。
 
     Args:
-        csv_content (str): 需要被分析的CSV文件的文本内容。
+        csv_content (str): 需要被分析的数据内容。可以是CSV文本，也可以直接传入 run_readonly_query_in_database
+            返回的任意格式结果（JSON字典列表、columnar JSON、base64 Arrow IPC 或分页对象），
+            或 load_csv 返回的 dataset_id。相同内容会自动命中已解析的缓存。
         question (str): 关于该CSV文件内容的自然语言问题。
+        content_format (str): 内容格式，"auto"（默认，自动识别）、"csv"、"json"、"columnar" 或 "arrow"。
+        use_fast_path (bool): 为 True（默认）时，行数、列名、描述性统计、缺失值、前 N 名、分组汇总等简单问题
+            直接计算并返回，不调用LLM。
 
     Returns:
         str: 数据分析的结果，或错误信息。
@@ -37,36 +161,29 @@ async def analyze_csv_content(csv_content: str, question: str) -> str:
     logger.info(f"--- [CSV内容分析工具(Gemini) - 默认工具] 正在分析CSV内容，问题: '{question}' ---")
 
     try:
-        # Use io.StringIO to treat the string content as a file
-        df = await asyncio.to_thread(pd.read_csv, io.StringIO(csv_content))
+        handle, df, cached = await asyncio.to_thread(datasets.resolve, csv_content, content_format)
+    except datasets.DatasetNotFoundError:
+        return f"错误: 数据集 '{csv_content.strip()}' 不存在或已过期，请重新调用 load_csv 加载数据。"
     except Exception as e:
         logger.error(f"--- [CSV内容分析工具(Gemini) ERROR] 解析CSV内容时出错: {e} ---")
         return f"错误: 解析CSV内容时出错: {e}"
+    logger.info(f"--- [CSV内容分析工具(Gemini)] 数据集 {handle}: {len(df)} 行, 命中缓存={cached} ---")
 
-    llm = ChatOpenAI(
-        model="google/gemini-2.5-pro",  # 使用最新的Gemini 2.5 Pro 模型
-        temperature=0.1,
-        api_key=API_KEY,
-        base_url=ENDPOINT
-    )
-    
-    # 创建Pandas DataFrame Agent
-    pandas_agent_executor = create_pandas_dataframe_agent(
-        llm=llm,
-        df=df,
-        verbose=False, # 设置为True可以在控制台查看LLM生成的Python代码
-        agent_executor_kwargs={"handle_parsing_errors": True},
-        allow_dangerous_code=True,
-        max_iterations=15,
-        max_execution_time=120
-    )
+    if use_fast_path:
+        route = route_question(question, df)
+        if route is not None:
+            try:
+                result = await asyncio.to_thread(run_operation, df, **route)
+                logger.info(f"--- [CSV内容分析工具(Gemini)] 快速路径 {route} 完成，未调用LLM ---")
+                return result
+            except Exception as e:
+                logger.warning(f"--- [CSV内容分析工具(Gemini)] 快速路径 {route} 失败，改用Agent: {e} ---")
 
     logger.warning("--- [CSV内容分析工具 - 安全警告] 即将执行由LLM生成的Python代码进行数据分析。 ---")
 
-    plot_dir = "downloads"
-    os.makedirs(plot_dir, exist_ok=True)
-    plot_filename = f"plot_{uuid.uuid4()}.png"
-    plot_filepath = os.path.join(plot_dir, plot_filename).replace('\\', '/')
+    # 图表先保存到本次调用的临时目录，完成后按内容哈希存入产物目录
+    plot_dir = tempfile.mkdtemp(prefix="plot_")
+    plot_filepath = os.path.join(plot_dir, "plot.png").replace('\\', '/')
 
     plot_instruction = (
         f"IMPORTANT: If you need to generate a plot, you MUST save it as a file. "
@@ -78,16 +195,28 @@ async def analyze_csv_content(csv_content: str, question: str) -> str:
     )
     full_question = plot_instruction + question
 
+    # 复用共享的 LLM 客户端和该数据集的执行器；生成的代码在沙箱进程中执行
+    pandas_agent_executor = agent_pool.acquire(handle, lambda: _create_agent(df))
+    session = None
     try:
+        if SANDBOX_ENABLED:
+            session = await asyncio.to_thread(sandbox_pool.session, handle, df)
+        _bind_executor(pandas_agent_executor, df, session)
         # The agent's ainvoke method is asynchronous
-        result = await pandas_agent_executor.ainvoke({"input": full_question})
+        async with llm_slot():
+            result = await pandas_agent_executor.ainvoke({"input": full_question})
         
         output = result.get("output", "未能获得有效的输出。")
         
         # Check if the agent created a plot by checking if the file exists
         if os.path.exists(plot_filepath):
-            logger.info(f"--- [CSV内容分析工具(Gemini)] 分析完成，生成了图表: {plot_filepath} ---")
-            return f"![Generated Plot]({plot_filepath})"
+            try:
+                artifact_path = await asyncio.to_thread(store_file, plot_filepath)
+            except ArtifactTooLargeError as e:
+                logger.error(f"--- [CSV内容分析工具(Gemini) ERROR] 图表无法保存: {e} ---")
+                return f"生成的图表过大，无法保存: {e}"
+            logger.info(f"--- [CSV内容分析工具(Gemini)] 分析完成，生成了图表: {artifact_path} ---")
+            return f"![Generated Plot]({artifact_path})"
         
         # If no plot, return the text output. The agent formats its own output.
         logger.info(f"--- [CSV内容分析工具(Gemini)] 分析完成，结果: {str(output)[:200]}... ---")
@@ -95,3 +224,9 @@ async def analyze_csv_content(csv_content: str, question: str) -> str:
     except Exception as e:
         logger.error(f"--- [CSV内容分析工具(Gemini) ERROR] 执行Pandas代码分析时出错: {e} ---")
         return f"执行Pandas代码分析时出错: {e}"
+    finally:
+        if session is not None:
+            await asyncio.to_thread(session.close)
+        _bind_executor(pandas_agent_executor, None, None)
+        agent_pool.release(handle, pandas_agent_executor)
+        shutil.rmtree(plot_dir, ignore_errors=True)
@@ -1,36 +1,31 @@
-
-import json
+import io
 from typing import List, Dict, Any
 from server import mcp
 from logger import logger
+from tools._result_format import ResultFormatError, iter_table
+from tools._table_render import write_markdown
 
 @mcp.tool()
-def json_to_markdown_table(json_data: str) -> str:
+def json_to_markdown_table(json_data: str, input_format: str = "auto") -> str:
     """
-    将JSON格式的查询结果转换为Markdown表格。
+    将查询结果转换为Markdown表格。
 
     Args:
-        json_data: 包含查询结果的JSON字符串。
+        json_data: 查询结果字符串。可以是JSON字典列表、columnar JSON（{"columns": [...], "rows": [[...]]}）、
+                   CSV 文本、base64 编码的 Arrow IPC，或 run_readonly_query_in_database 返回的分页对象。
+        input_format: 输入格式，"auto"（默认，自动识别）、"json"、"columnar"、"csv" 或 "arrow"。
 
     Returns:
         格式化为Markdown表格的字符串。
     """
     try:
-        data = json.loads(json_data)
-    except json.JSONDecodeError:
-        return "Error: 无效的JSON数据。"
-
-    if not data:
-        return "数据为空。"
-
-    if not isinstance(data, list) or not all(isinstance(row, dict) for row in data):
-        return "Error: JSON数据必须是字典列表。"
-
-    headers = data[0].keys()
-    md_table = ["| " + " | ".join(headers) + " |"]
-    md_table.append("|" + "---|" * len(headers))
-
-    for row in data:
-        md_table.append("| " + " | ".join(str(row.get(h, "")) for h in headers) + " |")
-
-    return "\n".join(md_table)
+        headers, rows = iter_table(json_data, input_format)
+        if not headers:
+            return "数据为空。"
+        # 逐行写入同一个缓冲区，避免先构造整张表的行列表再 join
+        out = io.StringIO()
+        write_markdown(out, headers, rows)
+    except ResultFormatError as e:
+        return f"Error: {e}"
+
+    return out.getvalue()
@@ -1,33 +1,50 @@
 import os
 import httpx
-from ragflow_sdk import RAGFlow
 from logger import logger
 from dotenv import load_dotenv
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional
 from server import mcp
-import time
+from mcp.server.fastmcp import Context
+import asyncio
+from tools._ragflow import ragflow, RAGFlowError, RAGFLOW_BASE_URL
+from tools._retrieval_cache import cached_retrieve, normalize_query, cache_stats
+from tools._chunks import slim_chunk, merge_chunks, rerank_and_pack
+from tools._parse_tracker import parse_tracker
+from tools._http import http_stats
 
 load_dotenv()
 
 # --- RagFlow API 的配置 ---
-RAGFLOW_BASE_URL = os.getenv("RAGFLOW_BASE_URL", "http://localhost:8000")
-RAGFLOW_API_KEY = os.getenv("RAGFLOW_API_KEY", "YOUR_API_KEY_HERE")
 RAGFLOW_DATASET_ID = os.getenv("RAGFLOW_DATASET_ID", "YOUR_DATASET_ID_HERE")
+RETRIEVAL_BATCH_CONCURRENCY = int(os.getenv("RETRIEVAL_BATCH_CONCURRENCY", 8))      # 批量检索同时进行的请求数
+RETRIEVAL_BATCH_MAX_REQUESTS = int(os.getenv("RETRIEVAL_BATCH_MAX_REQUESTS", 64))   # 单次批量检索的 问题×数据集 上限
 
-# 初始化 RAGFlow 客户端
-rag_flow = RAGFlow(api_key=RAGFLOW_API_KEY, base_url=RAGFLOW_BASE_URL)
+async def _fetch_chunks(query: str, dataset_id: str) -> List[Dict[str, Any]]:
+    return [slim_chunk(c) for c in await ragflow.retrieve(query, [dataset_id])]
+
+async def _retrieve_chunks(query: str, dataset_id: str, use_cache: bool = True):
+    """检索单个数据集，返回 (精简后的分块列表, 是否来自缓存)。"""
+    if not use_cache:
+        return await _fetch_chunks(query, dataset_id), False
+    return await cached_retrieve(query, [dataset_id], lambda: _fetch_chunks(query, dataset_id), kind="chunks")
 
 @mcp.tool()
-def knowledge_retrieval_tool(query: str, dataset_id: str = RAGFLOW_DATASET_ID) -> Dict[str, Any]:
+async def knowledge_retrieval_tool(query: str, dataset_id: str = RAGFLOW_DATASET_ID, use_cache: bool = True,
+                                   rerank: bool = False, max_chars: int = 0, max_tokens: int = 0) -> Dict[str, Any]:
     """
     根据用户问题，从指定的RagFlow知识库数据集中检索相关文档。
 
     Args:
         query (str): 要查询的问题或关键词。
         dataset_id (str): 要查询的RagFlow知识库数据集ID。此参数为必需项。
+        use_cache (bool): 是否使用检索缓存。相同问题在短时间内重复检索时直接返回缓存结果；
+            需要确保拿到最新内容时传入 False。
+        rerank (bool): 是否在本地按问题对分块重排并去掉近似重复的分块。
+        max_chars (int): 返回内容的字符数上限，超出预算的分块被丢弃（0 表示不限制，设置后自动重排）。
+        max_tokens (int): 返回内容的估算 token 数上限，优先于 max_chars（0 表示不限制，设置后自动重排）。
 
     Returns:
-        一个包含检索结果的字典。
+        一个包含检索结果的字典。重排时 postprocess 中给出保留和丢弃的分块数。
     """
     logger.info(f"--- 🛠️ 执行工具: knowledge_retrieval_tool (query='{query}', dataset_id='{dataset_id}') ---")
 
@@ -38,30 +55,93 @@ def knowledge_retrieval_tool(query: str, dataset_id: str = RAGFLOW_DATASET_ID) -
         return {"status": "error", "error_message": error_msg}
 
     try:
-        # 调用 RAGFlow SDK 进行检索
-        chunks = rag_flow.retrieve(
-            question=query,
-            dataset_ids=[dataset_id]
-        )
-        if chunks:
-            processed_chunks = []
-            for r in chunks:
-                if hasattr(r, 'text'):
-                    processed_chunks.append(r.text)
-                elif isinstance(r, dict) and 'content' in r:
-                    processed_chunks.append(r['content'])
-                else:
-                    processed_chunks.append(str(r))
-            
-            result_content = "\n\n".join(processed_chunks)
-            logger.info(f"工具输出: {result_content}")
-            return {"status": "success", "summary": result_content}
-        else:
-            logger.info("工具输出: 在知识库中没有找到相关信息。")
-            return {"status": "not_found", "summary": "在知识库中没有找到相关信息。"}
-    except httpx.RequestError as e:
+        chunks, cached = await _retrieve_chunks(query, dataset_id, use_cache)
+    except (httpx.HTTPError, RAGFlowError) as e:
         logger.error(f"RagFlow知识库检索失败: {e}")
         return {"status": "error", "error_message": f"知识库检索失败，错误信息: {e}"}
+    if cached:
+        logger.info("工具输出: 命中检索缓存")
+    if not chunks:
+        logger.info("工具输出: 在知识库中没有找到相关信息。")
+        return {"status": "not_found", "summary": "在知识库中没有找到相关信息。"}
+
+    result: Dict[str, Any] = {"status": "success"}
+    if rerank or max_chars > 0 or max_tokens > 0:
+        chunks, result["postprocess"] = rerank_and_pack(query, chunks, max_chars, max_tokens)
+        logger.info(f"工具输出: 重排裁剪 {result['postprocess']}")
+    result["summary"] = "\n\n".join(c.get("content") or "" for c in chunks)
+    logger.info(f"工具输出: {result['summary']}")
+    return result
+
+@mcp.tool()
+async def batch_knowledge_retrieval(queries: List[str], dataset_ids: Optional[List[str]] = None, top_k: int = 20,
+                                    use_cache: bool = True, rerank: bool = False, max_chars: int = 0,
+                                    max_tokens: int = 0) -> Dict[str, Any]:
+    """
+    批量检索：把多个子问题在多个知识库中并发检索，合并去重后返回一个按相关度排序的分块列表。
+    适合把复杂问题拆成多个子问题后一次性检索，比逐个调用 knowledge_retrieval_tool 更快，返回内容也更少。
+
+    Args:
+        queries (List[str]): 要检索的问题或关键词列表。
+        dataset_ids (List[str]): 要检索的知识库数据集ID列表，默认使用配置的默认知识库。
+        top_k (int): 合并后最多返回的分块数，默认 20。
+        use_cache (bool): 是否使用检索缓存。
+        rerank (bool): 是否在本地按全部问题对分块重排并去掉近似重复的分块。
+        max_chars (int): 返回内容的字符数上限（0 表示不限制，设置后自动重排）。
+        max_tokens (int): 返回内容的估算 token 数上限，优先于 max_chars（0 表示不限制，设置后自动重排）。
+
+    Returns:
+        一个字典，chunks 中每个分块带有 content、document_name、dataset_id、similarity，
+        以及命中该分块的问题列表 matched_queries；stats 为请求数、去重前后的分块数和失败的检索，
+        重排时 stats.postprocess 中给出保留和丢弃的分块数。
+    """
+    queries = list(dict.fromkeys(q for q in (normalize_query(q) for q in queries or []) if q))
+    dataset_ids = list(dict.fromkeys(d for d in (dataset_ids or [RAGFLOW_DATASET_ID]) if d))
+    logger.info(f"--- 🛠️ 执行工具: batch_knowledge_retrieval (queries={queries}, dataset_ids={dataset_ids}) ---")
+
+    if not queries:
+        return {"status": "error", "error_message": "批量检索失败：queries 不能为空。"}
+    if not dataset_ids or "YOUR_DATASET_ID_HERE" in dataset_ids:
+        return {"status": "error", "error_message": "批量检索失败：未提供有效的 'dataset_ids'。"}
+    pairs = [(q, d) for q in queries for d in dataset_ids]
+    if len(pairs) > RETRIEVAL_BATCH_MAX_REQUESTS:
+        return {"status": "error", "error_message": f"批量检索失败：问题数 × 知识库数 为 {len(pairs)}，"
+                                                    f"超过上限 {RETRIEVAL_BATCH_MAX_REQUESTS}。"}
+
+    semaphore = asyncio.Semaphore(RETRIEVAL_BATCH_CONCURRENCY)
+
+    async def fetch(query: str, dataset_id: str):
+        async with semaphore:
+            chunks, _ = await _retrieve_chunks(query, dataset_id, use_cache)
+        return query, dataset_id, chunks
+
+    outcomes = await asyncio.gather(*(fetch(q, d) for q, d in pairs), return_exceptions=True)
+    results, errors = [], []
+    for (query, dataset_id), outcome in zip(pairs, outcomes):
+        if isinstance(outcome, (httpx.HTTPError, RAGFlowError)):
+            logger.error(f"RagFlow知识库检索失败 (query='{query}', dataset_id='{dataset_id}'): {outcome}")
+            errors.append({"query": query, "dataset_id": dataset_id, "error": str(outcome)})
+        elif isinstance(outcome, Exception):
+            # 解析响应出错等意外异常也只算这一组检索失败，不影响其余结果
+            logger.opt(exception=outcome).error(f"RagFlow知识库检索出错 (query='{query}', dataset_id='{dataset_id}')")
+            errors.append({"query": query, "dataset_id": dataset_id, "error": f"{type(outcome).__name__}: {outcome}"})
+        elif isinstance(outcome, BaseException):
+            # CancelledError 等表示整个调用被取消或进程退出，必须继续向上抛出
+            raise outcome
+        else:
+            results.append(outcome)
+
+    if not results:
+        return {"status": "error", "error_message": "知识库检索全部失败。", "errors": errors}
+    chunks, total = merge_chunks(results)
+    stats = {"requests": len(pairs), "raw_chunks": total, "unique_chunks": len(chunks)}
+    if chunks and (rerank or max_chars > 0 or max_tokens > 0):
+        chunks, stats["postprocess"] = rerank_and_pack(" ".join(queries), chunks, max_chars, max_tokens)
+    stats.update(returned=min(len(chunks), max(top_k, 0)), errors=errors)
+    logger.info(f"工具输出: 批量检索 {stats}")
+    if not chunks:
+        return {"status": "not_found", "summary": "在知识库中没有找到相关信息。", "chunks": [], "stats": stats}
+    return {"status": "success", "chunks": chunks[:max(top_k, 0)], "stats": stats}
 
 @mcp.tool()
 async def list_knowledge_bases(page: int = 1, page_size: int = 30, orderby: str = "create_time", desc: bool = True, id: str = "", name: str = "") -> List[dict]:
@@ -83,17 +163,17 @@ async def list_knowledge_bases(page: int = 1, page_size: int = 30, orderby: str
     name = None if not name else name
 
     try:
-        datasets = rag_flow.list_datasets(page=page, page_size=page_size, orderby=orderby, desc=desc, id=id, name=name)
+        datasets = await ragflow.list_datasets(page=page, page_size=page_size, orderby=orderby, desc=desc, id=id, name=name)
         return [
             {
-                "id": ds.id,
-                "name": ds.name,
-                "document_count": ds.document_count,
-                "chunk_count": ds.chunk_count,
-                "embedding_model": ds.embedding_model,
-                "permission": ds.permission,
-                "description": ds.description,
-                "avatar": ds.avatar,
+                "id": ds.get("id"),
+                "name": ds.get("name"),
+                "document_count": ds.get("document_count"),
+                "chunk_count": ds.get("chunk_count"),
+                "embedding_model": ds.get("embedding_model"),
+                "permission": ds.get("permission"),
+                "description": ds.get("description"),
+                "avatar": ds.get("avatar"),
             }
             for ds in datasets
         ]
@@ -128,8 +208,9 @@ async def list_documents(
     try:
         if base_url.endswith('/'):
             base_url = base_url[:-1]
-        url = f"{base_url}/api/v1/datasets/{dataset_id}/documents"
-        headers = {"Authorization": f"Bearer {RAGFLOW_API_KEY}"}
+        # 默认地址走共享客户端的相对路径；传入其他 base_url 时使用绝对地址
+        path = f"/datasets/{dataset_id}/documents"
+        url = path if base_url == ragflow.base_url else f"{base_url}/api/v1{path}"
         params = {
             "page": page,
             "page_size": page_size
@@ -137,11 +218,9 @@ async def list_documents(
         # Filter out None values from params
         params = {k: v for k, v in params.items() if v is not None}
 
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url, headers=headers, params=params)
-            response.raise_for_status()
-            data = response.json()
-            return data.get("data", {})
+        response = await ragflow.request("GET", url, params=params)
+        data = response.json()
+        return data.get("data", {})
     except httpx.HTTPStatusError as e:
         logger.error(f"HTTP error listing documents: {e.response.text}")
         return {"error": f"HTTP error: {e.response.status_code} - {e.response.text}"}
@@ -149,77 +228,106 @@ async def list_documents(
         logger.error(f"An unexpected error occurred while listing documents: {e}")
         return {"error": str(e)}
 
-def _trigger_parsing_and_wait(dataset, document_ids: List[str], timeout: int = 20) -> Dict:
+async def _trigger_parsing_and_wait(dataset_id: str, document_ids: List[str], timeout: int = 20,
+                                    ctx: Optional[Context] = None) -> Dict:
     """
     Triggers parsing for given document IDs and waits until all are done.
 
     Args:
-        dataset: The dataset object from RAGFlow.
+        dataset_id: The ID of the RAGFlow dataset.
         document_ids: List of document IDs to parse.
-        timeout: Max time to wait in seconds (default 20).
+        timeout: Max time to wait in seconds (default 20). Tracking continues in the background after that.
+        ctx: MCP context used to send progress notifications.
 
     Returns:
-        A dictionary with status and message.
+        A dictionary with status and message, plus the job_id of the parse job.
     """
     if not document_ids:
         return {"status": "skipped", "message": "No documents to parse."}
 
     try:
-        dataset.async_parse_documents(document_ids=document_ids)
-        logger.info(f"Parsing triggered for documents: {document_ids}")
-
-        for doc_id in document_ids:
-            i = 0
-            current_doc = dataset.list_documents(id=doc_id)[0]
-            while current_doc.run != "DONE":
-                logger.info(f"Current parsing status for {doc_id}: {current_doc.run}. Will sleep 1 second.")
-                time.sleep(1)
-                current_doc = dataset.list_documents(id=doc_id)[0]
-                i += 1
-                if i >= timeout:
-                    error_msg = f"Document parsing exceeded time limit: {timeout} s."
-                    logger.error(error_msg)
-                    return {"error": error_msg}
-                elif current_doc.run == "FAIL":
-                    error_msg = f"Document parsing failed for {doc_id}. Final status: {current_doc.run}"
-                    logger.error(error_msg)
-                    return {"error": error_msg}
-
-            logger.success(f"Parsing completed for {doc_id}. Final status: {current_doc.run}")
+        job = await parse_tracker.start(dataset_id, document_ids)
+    except Exception as e:
+        logger.error(f"Error during parsing: {e}")
+        return {"error": str(e)}
+
+    async def report(job):
+        counts = job.snapshot()["status_counts"]
+        await ctx.report_progress(job.progress(), len(job.document_ids),
+                                  ", ".join(f"{k}: {v}" for k, v in sorted(counts.items())))
 
+    await parse_tracker.wait(job, timeout, report if ctx is not None else None)
+    if job.state == "success":
         return {
             "status": "success",
-            "message": f"Documents parsed successfully: {document_ids}"
+            "message": f"Documents parsed successfully: {document_ids}",
+            "job_id": job.job_id,
         }
-    except Exception as e:
-        logger.error(f"Error during parsing: {e}")
-        return {"error": str(e)}
+    if job.state == "running":
+        error_msg = f"Document parsing exceeded time limit: {timeout} s."
+        logger.warning(f"{error_msg} 解析仍在后台跟踪，job_id: {job.job_id}")
+        return {"error": error_msg, "status": "running", "job_id": job.job_id,
+                "message": "解析仍在进行，可以用 get_parse_job 查询进度。"}
+    logger.error(f"解析任务 {job.job_id} 失败: {job.error}")
+    return {"error": job.error, "status": job.state, "job_id": job.job_id, "documents": job.snapshot()["documents"]}
 
 @mcp.tool()
 async def trigger_parsing_and_wait(
     document_ids: List[str],
-    timeout: int = 20
+    timeout: int = 20,
+    wait: bool = True,
+    dataset_id: str = "",
+    ctx: Context = None
 ) -> Dict:
     """
     Triggers parsing for given document IDs and waits until all are done.
+    Progress notifications are sent while waiting. With wait=False the call returns a job_id immediately;
+    query it later with get_parse_job.
 
     Args:
         document_ids: List of document IDs to parse.
         timeout: Max time to wait in seconds (default 20).
+        wait: Whether to wait for parsing to finish (default True).
+        dataset_id: The dataset containing the documents. Defaults to the configured dataset.
 
     Returns:
-        A dictionary with status and message.
+        A dictionary with status and message, plus the job_id of the parse job.
     """
     if not document_ids:
         return {"status": "skipped", "message": "No documents to parse."}
 
-    try:
-        # 2. 获取 dataset 实例
-        dataset = rag_flow.list_datasets(id=RAGFLOW_DATASET_ID)[0]
-        result = await _trigger_parsing_and_wait(dataset, document_ids, timeout) # TODO wait
-        # 3. 调用内部函数处理解析逻辑
-        return result
+    dataset_id = dataset_id or RAGFLOW_DATASET_ID
+    if not wait:
+        try:
+            job = await parse_tracker.start(dataset_id, document_ids)
+        except Exception as e:
+            logger.error(f"Error during parsing: {e}")
+            return {"error": str(e)}
+        return {"status": "started", "job_id": job.job_id,
+                "message": "解析已开始，可以用 get_parse_job 查询进度。"}
+    return await _trigger_parsing_and_wait(dataset_id, document_ids, timeout, ctx)
 
-    except Exception as e:
-        logger.error(f"Error linking to RAGFlow dataset {RAGFLOW_DATASET_ID}: {e}")
-        return {"error": str(e)}
\ No newline at end of file
+@mcp.tool()
+async def get_parse_job(job_id: str) -> Dict:
+    """
+    Returns the state of a parse job started by trigger_parsing_and_wait.
+
+    Args:
+        job_id: The job ID returned by trigger_parsing_and_wait.
+
+    Returns:
+        A dictionary with the job state (running / success / failed / timeout / error), overall progress
+        and the parsing status of each document.
+    """
+    job = parse_tracker.get(job_id)
+    if job is None:
+        return {"error": f"Parse job not found or expired: {job_id}"}
+    return job.snapshot()
+
+@mcp.tool()
+def get_http_pool_stats() -> Dict:
+    """
+    Returns statistics of the shared HTTP connection pools (per upstream host: requests, errors, retries,
+    open and idle connections), the retrieval cache and the parse jobs.
+    """
+    return {"http": http_stats(), "retrieval_cache": cache_stats(), "parse_jobs": parse_tracker.stats()}
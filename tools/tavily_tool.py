@@ -1,19 +1,45 @@
 import os
-from tavily import TavilyClient
+import re
+import time
+import asyncio
+from tavily import AsyncTavilyClient
 from dotenv import load_dotenv
 from server import mcp
+from mcp.server.fastmcp import Context
 from logger import logger
-from ragflow_sdk import RAGFlow
-import httpx
 from typing import List, Dict
-import tempfile
+from tools import _http
+from tools._ragflow import ragflow
+from tools._search_cache import cached_search, lookup_paper, remember_paper, resolve_arxiv
+from tools._ingest import IngestError, IngestPipeline, download, ingest_filename
+from tools._parse_tracker import parse_tracker
 
 # 加载环境变量
 load_dotenv()
 RAGFLOW_DATASET_ID = os.getenv("RAGFLOW_DATASET_ID")
+TAVILY_API_BASE = "https://api.tavily.com"
+INGEST_MAX_PAPERS = int(os.getenv("INGEST_MAX_PAPERS", 200))  # ingest_papers 单次导入的论文数上限
+
+_http.register_upstream(TAVILY_API_BASE, "tavily")
+
+_tavily = None
+_tavily_http = None
+
+
+def _get_tavily() -> AsyncTavilyClient:
+    """返回复用共享 HTTP 连接池的 Tavily 客户端；共享连接池重建时（事件循环变化）随之重建。"""
+    global _tavily, _tavily_http
+    api_key = os.getenv("TAVILY_API_KEY")
+    if not api_key:
+        raise ValueError("TAVILY_API_KEY 环境变量未设置。")
+    http_client = _http.client_for(TAVILY_API_BASE)
+    if _tavily is None or _tavily_http is not http_client:
+        _tavily = AsyncTavilyClient(api_key=api_key, client=http_client)
+        _tavily_http = http_client
+    return _tavily
 
 @mcp.tool()
-def tavily_search(query: str, max_results: int = 5, topic: str = "general"):
+async def tavily_search(query: str, max_results: int = 5, topic: str = "general"):
     """
     【Tavily搜索工具】此工具使用Tavily API执行网络搜索。
 
@@ -23,21 +49,21 @@ def tavily_search(query: str, max_results: int = 5, topic: str = "general"):
         topic (str): 搜索主题，可以是 'general' (常规) 或 'news' (新闻)。
 
     Returns:
-        list: 搜索结果列表，或在出错时返回错误信息字符串。
+        list: 搜索结果列表，或在出错时返回错误信息字符串。相同查询在 TAVILY_CACHE_TTL 秒内直接返回缓存结果。
     """
-    api_key = os.getenv("TAVILY_API_KEY")
-    if not api_key:
-        raise ValueError("TAVILY_API_KEY 环境变量未设置。")
-    
-    client = TavilyClient(api_key=api_key)
+    client = _get_tavily()
     try:
-        response = client.search(query=query, topic=topic, max_results=max_results)
+        response, cached = await cached_search(
+            query, lambda: client.search(query=query, topic=topic, max_results=max_results),
+            topic=topic, max_results=max_results)
+        if cached:
+            logger.info(f"Tavily 搜索命中缓存: {query}")
         return response['results']
     except Exception as e:
         return f"Tavily搜索时发生错误: {e}"
 
 @mcp.tool()
-def find_paper_url(query: str) -> Dict[str, str]:
+async def find_paper_url(query: str) -> Dict[str, str]:
     """
     【论文URL查找工具】此工具根据查询词在arXiv.org上搜索学术论文，并返回其PDF的URL。
 
@@ -47,16 +73,21 @@ def find_paper_url(query: str) -> Dict[str, str]:
     Returns:
         dict: 包含查找状态和PDF URL的字典。
     """
-    api_key = os.getenv("TAVILY_API_KEY")
-    if not api_key:
-        raise ValueError("TAVILY_API_KEY 环境变量未设置。")
+    return await _find_paper_url(query)
+
+async def _find_paper_url(query: str) -> Dict[str, str]:
+    # 0. 查询中已有 arXiv 编号或链接，或者之前查到过同一标题时，直接返回，不调用搜索
+    url = resolve_arxiv(query) or lookup_paper(query)
+    if url:
+        return {"status": "success", "url": url}
+
+    client = _get_tavily()
 
-    client = TavilyClient(api_key=api_key)
-    
     try:
         # 1. 优化查询，优先搜索arXiv
         search_query = f'{query} site:arxiv.org'
-        response = client.search(query=search_query, max_results=5)
+        response, _ = await cached_search(search_query, lambda: client.search(query=search_query, max_results=5),
+                                          max_results=5)
         results = response.get('results', [])
 
         if not results:
@@ -64,9 +95,11 @@ def find_paper_url(query: str) -> Dict[str, str]:
 
         # 2. 查找PDF链接
         for result in results:
-            url = result.get('url')
-            # 优先寻找arXiv和常见论文网站的PDF链接
+            url = result.get('url') or ''
+            # 优先寻找arXiv和常见论文网站的PDF链接；arXiv 的摘要页链接直接换成 PDF 链接
+            url = resolve_arxiv(url) if 'arxiv.org/' in url else url
             if url and ('arxiv.org/pdf' in url or url.endswith('.pdf')):
+                remember_paper(query, url)
                 return {
                     "status": "success",
                     "url": url
@@ -77,7 +110,17 @@ def find_paper_url(query: str) -> Dict[str, str]:
     except Exception as e:
         return {"status": "error", "message": f"在查找论文时发生错误: {e}"}
 
-def download_and_upload(url: str) -> dict:
+async def _resolve_paper(item: str) -> str:
+    """把论文标题、arXiv 编号或链接转换为 PDF 下载链接。"""
+    if re.match(r"https?://", item.strip()):
+        url = item.strip()
+        return resolve_arxiv(url) if "arxiv.org/" in url else url
+    result = await _find_paper_url(item)
+    if result.get("status") != "success":
+        raise IngestError(result.get("message") or "未找到论文的 PDF 链接")
+    return result["url"]
+
+async def download_and_upload(url: str) -> dict:
     """
     工具一：从URL下载文件，并将其上传到指定的RagFlow知识库。
     
@@ -87,30 +130,76 @@ def download_and_upload(url: str) -> dict:
     Returns:
         一个包含操作结果的字典。成功时包含 'doc_id'，失败时包含 'error'。
     """
-    print(f"  [Action] 正在从URL下载文件: {url}")
+    logger.info(f"  [Action] 正在从URL下载文件: {url}")
     try:
-        # CHANGED: 使用 httpx 进行同步流式下载
-        with httpx.stream("GET", url, follow_redirects=True, timeout=30.0) as response_download:
-            response_download.raise_for_status()  # 检查下载是否成功
-
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp_file:
-                for chunk in response_download.iter_bytes(chunk_size=8192):
-                    tmp_file.write(chunk)
-                tmp_file_path = tmp_file.name
-        
-        print(f"  [Action] 文件已下载到临时路径: {tmp_file_path}")
-        print(f"  [Action] 正在上传到知识库 '{RAGFLOW_DATASET_ID}'...")
-        
-        # 使用 ragflow-sdk 上传文档
-        result = RAGFlow.upload_document(tmp_file_path, RAGFLOW_DATASET_ID)
-        
-        os.remove(tmp_file_path) # 清理临时文件
-        
-        # SDK返回的结果通常是一个字典，我们提取关键信息
-        if "doc_id" in result:
-            return {"status": "success", "doc_id": result["doc_id"]}
+        # 通过共享连接池流式下载到内存，同一主机的后续下载复用连接
+        content, sha256 = await download(url)
+        logger.info(f"  [Action] 正在上传到知识库 '{RAGFLOW_DATASET_ID}'...")
+        docs = await ragflow.upload_document(RAGFLOW_DATASET_ID, ingest_filename(url, sha256), content)
+
+        if docs and docs[0].get("id"):
+            return {"status": "success", "doc_id": docs[0]["id"]}
         else:
-            return {"status": "error", "message": f"SDK上传失败，返回信息: {result}"}
+            return {"status": "error", "message": f"上传失败，返回信息: {docs}"}
 
     except Exception as e:
         return {"status": "error", "message": f"下载或上传过程中发生错误: {e}"}
+
+@mcp.tool()
+async def ingest_papers(papers: List[str], dataset_id: str = "", wait_for_parsing: bool = False,
+                        timeout: int = 300, ctx: Context = None) -> Dict:
+    """
+    【论文批量导入工具】把一批论文导入RagFlow知识库：查找PDF链接、下载、上传并触发解析，各步骤并发流水执行。
+
+    Args:
+        papers (List[str]): 论文标题、arXiv 编号或 PDF 链接的列表。
+        dataset_id (str): 目标知识库数据集ID，默认使用配置的默认知识库。
+        wait_for_parsing (bool): 是否等待解析完成后再返回（默认只触发解析，返回解析任务 ID）。
+        timeout (int): 等待解析的最长秒数。
+
+    Returns:
+        dict: 每篇论文的处理结果（uploaded / skipped / failed）、解析任务 ID 以及各阶段的吞吐量统计。
+    """
+    dataset_id = dataset_id or RAGFLOW_DATASET_ID
+    papers = list(dict.fromkeys(p.strip() for p in papers or [] if p and p.strip()))
+    if not papers:
+        return {"status": "error", "message": "papers 不能为空。"}
+    if not dataset_id:
+        return {"status": "error", "message": "未提供有效的 dataset_id。"}
+    if len(papers) > INGEST_MAX_PAPERS:
+        return {"status": "error", "message": f"单次最多导入 {INGEST_MAX_PAPERS} 篇论文，本次为 {len(papers)} 篇。"}
+    logger.info(f"--- 🛠️ 执行工具: ingest_papers ({len(papers)} 篇, dataset_id='{dataset_id}') ---")
+
+    finished = 0
+
+    async def on_item_done(record):
+        nonlocal finished
+        finished += 1
+        if ctx is not None:
+            await ctx.report_progress(finished, len(papers), f"{record['status']}: {record['input']}")
+
+    started = time.perf_counter()
+    pipeline = IngestPipeline(dataset_id, _resolve_paper, on_item_done)
+    records = await pipeline.run(papers)
+
+    parse = [job.job_id for job in pipeline.jobs]
+    if wait_for_parsing and pipeline.jobs:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        for job in pipeline.jobs:
+            await parse_tracker.wait(job, max(deadline - loop.time(), 0))
+        parse = [{"job_id": job.job_id, "state": job.state, "error": job.error} for job in pipeline.jobs]
+
+    counts: Dict[str, int] = {}
+    for record in records:
+        counts[record["status"]] = counts.get(record["status"], 0) + 1
+    result = {
+        "status": "success" if counts.get("failed", 0) < len(records) else "error",
+        "counts": counts,
+        "papers": records,
+        "parse_jobs": parse,
+        "stages": pipeline.report(),
+        "elapsed_seconds": round(time.perf_counter() - started, 3),
+    }
+    logger.info(f"工具输出: 导入结果 {counts}，各阶段 {result['stages']}")
+    return result